@@ -0,0 +1,41 @@
+"""Client order ids of the bots' orders: `dca-<bot>-<cycle>-<side><level>-<attempt>`
+
+<bot> and <cycle> are the first 8 hex digits of their ids, <side> is B or S, <attempt>
+follows the highest attempt among the ids of the cycle's orders on that side and level. Grid
+shifts renumber orders but keep their ids, so the ids are counted, not the current levels of
+the orders. The id of an order is computed again the same way until the order is stored, so
+an order sent again after a lost response is rejected by the exchange as a duplicate, and can
+be looked up by its id. Execution reports name the bot of the order, and the order itself: it
+is found by primary key, without searching the cycle's orders by exchange order id.
+"""
+import re
+from typing import NamedTuple, Optional
+from uuid import UUID
+
+PREFIX = "dca"
+PATTERN = re.compile(rf"^{PREFIX}-([0-9a-f]{{8}})-([0-9a-f]{{8}})-([BS])(\d+)-(\d+)$")
+
+
+class ClientOrderId(NamedTuple):
+    bot: str  # tag of the bot id
+    cycle: str
+    side: str  # BUY or SELL
+    number: int
+    attempt: int
+
+
+def tag(id: UUID) -> str:
+    return id.hex[:8]
+
+
+def client_order_id(bot_id: UUID, cycle_id: UUID, side: str, number: int, attempt: int) -> str:
+    return f"{PREFIX}-{tag(bot_id)}-{tag(cycle_id)}-{side[0]}{number}-{attempt}"
+
+
+def parse_client_order_id(value: Optional[str]) -> Optional[ClientOrderId]:
+    """Parts of a client order id of a bot, None for the ids of other orders"""
+    match = PATTERN.match(value or "")
+    if match is None:
+        return None
+    bot, cycle, side, number, attempt = match.groups()
+    return ClientOrderId(bot, cycle, "BUY" if side == "B" else "SELL", int(number), int(attempt))
@@ -0,0 +1,236 @@
+"""Trading engine: runs the active bots, either inside the web process or on its own
+
+    python -m app.engine
+
+runs it headless. It then takes the bot commands of the web tier and sends its
+engine events back over the Postgres control bus (see ENGINE_MODE in app.main).
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+from datetime import timedelta
+from typing import Optional
+from uuid import UUID
+
+from .database import EngineSessionLocal, engine_session
+from .models import Bot
+from .services.balance_cache import BalanceCache
+from .services.bot_events_handler import BotEventsHandler
+from .services.bot_leases import BotLeaseCoordinator
+from .services.bot_manager import BotManager
+from .services.control_bus import COMMANDS_CHANNEL, ControlBus
+from .services.engine_events import EngineEvents
+from .services.engine_snapshots import EngineSnapshots
+from .services.event_dispatcher import EventDispatcher
+from .services.exchange_client import client_registry
+from .services.market_data import MarketDataFeed
+from .services.order_archiver import OrderArchiver
+from .services.order_writer import OrderWriter
+from .services.paper_trading import PaperTrading
+from .services.stream_recorder import StreamRecorder
+from .services.trading_service import TradingService
+
+
+class TradingEngine:
+    def __init__(self, events: EngineEvents, bus: Optional[ControlBus] = None):
+        self.events = events
+        self.bus = bus
+        self.order_writer = OrderWriter(
+            session_factory=EngineSessionLocal,
+            max_delay=float(os.getenv("ORDER_WRITE_DELAY", "0.005")),
+            max_rows=int(os.getenv("ORDER_WRITE_BATCH", "500")),
+        )
+        # With STREAM_RECORD_DIR every websocket message received is recorded there, for replays
+        self.recorder = StreamRecorder(
+            os.getenv("STREAM_RECORD_DIR"),
+            segment_bytes=int(os.getenv("STREAM_RECORD_SEGMENT_MB", "64")) * 1024 * 1024,
+            max_age=float(os.getenv("STREAM_RECORD_MAX_HOURS", "168")) * 3600,
+            max_bytes=int(os.getenv("STREAM_RECORD_MAX_MB", "10240")) * 1024 * 1024,
+        ) if os.getenv("STREAM_RECORD_DIR") else None
+        self.market_data = MarketDataFeed(
+            stream=os.getenv("PRICE_STREAM", "miniTicker"),
+            streams_per_socket=int(os.getenv("PRICE_STREAMS_PER_SOCKET", "200")),
+            recorder=self.recorder,
+        )
+        # The events of the bots run on these workers, the websocket threads only read and decode
+        self.dispatcher = EventDispatcher(workers=int(os.getenv("ENGINE_WORKERS", "8")))
+        self.snapshots = EngineSnapshots(os.getenv("SNAPSHOT_DIR", "snapshots"))
+        self.balances = BalanceCache()
+        self.bot_manager = BotManager(TradingService, BotEventsHandler, order_writer=self.order_writer, events=events,
+                                      market_data=self.market_data, snapshots=self.snapshots, balances=self.balances,
+                                      recorder=self.recorder, dispatcher=self.dispatcher)
+        # With ENGINE_SHARDING several engine processes share the bots through leases in the database
+        self.bot_leases = BotLeaseCoordinator(
+            worker_id=os.getenv("ENGINE_WORKER_ID", f"{socket.gethostname()}-{os.getpid()}"),
+            bot_manager=self.bot_manager,
+            ttl=float(os.getenv("BOT_LEASE_TTL", "30")),
+            heartbeat_interval=float(os.getenv("BOT_LEASE_HEARTBEAT", "10")),
+        ) if os.getenv("ENGINE_SHARDING") else None
+        # With PAPER_TRADING the engine also runs the paper bots, on the same price feed
+        self.paper_trading = PaperTrading(self.market_data, EngineSessionLocal) if os.getenv("PAPER_TRADING") else None
+        self.order_archiver = OrderArchiver(min_age=timedelta(hours=float(os.getenv("ARCHIVE_MIN_AGE_HOURS", "24"))))
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connected = False  # whether the control bus was connected before
+        self.tasks = []
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.order_writer.start()
+        self.dispatcher.start()
+
+        if self.bus:
+            self.events.subscribe(self.bus.publish_event)
+            self.bus.subscribe(COMMANDS_CHANNEL, self._on_command)
+            self.bus.on_connect.append(self._on_reconnect)
+            self.bus.start()
+
+        if self.bot_leases:
+            self.tasks.append(asyncio.create_task(self.bot_leases.run()))
+        else:
+            await self.bot_manager.install_bots(self._active_bots())
+
+        self.tasks.append(asyncio.create_task(
+            self.order_archiver.run(interval=float(os.getenv("ARCHIVE_INTERVAL", "3600")))
+        ))
+        self.tasks.append(asyncio.create_task(
+            self.save_snapshots(interval=float(os.getenv("SNAPSHOT_INTERVAL", "60")))
+        ))
+        self.tasks.append(asyncio.create_task(
+            self.reseed_balances(interval=float(os.getenv("BALANCE_RESEED_INTERVAL", "3600")))
+        ))
+        self.tasks.append(asyncio.create_task(
+            self.watch_queues(interval=10, max_wait=float(os.getenv("EVENT_WAIT_WARNING", "1")))
+        ))
+
+        if self.paper_trading:
+            await asyncio.to_thread(self.paper_trading.load)
+            self.tasks.append(asyncio.create_task(
+                self.paper_trading.run(interval=float(os.getenv("PAPER_FLUSH_INTERVAL", "10")))
+            ))
+
+    async def drain(self):
+        """Hand the bots over to the other engine workers before stopping"""
+        if self.bot_leases:
+            await self.bot_leases.drain()
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        # The last snapshots must include every order update already received
+        await asyncio.to_thread(self.dispatcher.stop)
+        try:
+            await asyncio.to_thread(self.order_writer.wait, timeout=float(os.getenv("ORDER_WRITE_TIMEOUT", "5")))
+            await asyncio.to_thread(self.bot_manager.save_snapshots)
+        except Exception as e:
+            logging.error(f"Failed to write the engine snapshots: {e}")
+        if self.bot_leases:
+            await self.bot_leases.stop()
+        self.bot_manager.release_all(keep_snapshots=True)
+        if self.paper_trading:
+            try:
+                await asyncio.to_thread(self.paper_trading.stop)
+            except Exception as e:
+                logging.error(f"Failed to write the paper cycles: {e}")
+        self.market_data.stop()
+        if self.recorder:
+            self.recorder.close()
+        if self.bus:
+            self.bus.stop()
+        self.order_writer.stop()
+
+    async def save_snapshots(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.bot_manager.save_snapshots)
+
+    async def reseed_balances(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.bot_manager.reseed_balances)
+
+    async def watch_queues(self, interval: float, max_wait: float):
+        """Log the bots whose events wait longer than `max_wait` seconds to run"""
+        while True:
+            await asyncio.sleep(interval)
+            for bot_id, stats in self.dispatcher.stats().items():
+                if stats["oldest_wait"] > max_wait:
+                    logging.warning(f"Bot {bot_id} is behind: {stats['depth']} events pending, "
+                                    f"the oldest for {stats['oldest_wait']:.1f}s")
+
+    @staticmethod
+    def _active_bots(bot_id: Optional[UUID] = None):
+        with engine_session() as db:
+            query = db.query(Bot).filter(Bot.is_active)
+            if bot_id:
+                query = query.filter(Bot.id == bot_id)
+            return query.all()
+
+    async def handle_command(self, command: str, bot_id: UUID):
+        """Apply a change the web tier made to a bot"""
+        match command:
+            case "start":
+                if self.bot_leases:
+                    return  # the worker that claims the bot's lease starts it
+                if bot_id not in self.bot_manager.events_handlers:
+                    await self.bot_manager.install_bots(self._active_bots(bot_id))
+            case "stop" | "update":
+                await asyncio.to_thread(self.bot_manager.reconfigure, bot_id)
+            case "snapshot":
+                await asyncio.to_thread(self._publish_snapshot, bot_id)
+            case _:
+                logging.error(f"Unknown bot command: {command}")
+
+    def _publish_snapshot(self, bot_id: UUID):
+        events_handler = self.bot_manager.events_handlers.get(bot_id)
+        if events_handler:
+            trading_service = events_handler.trading_service
+            with trading_service.unit_of_work():
+                trading_service.publish_snapshot()
+
+    async def resync(self):
+        """Catch up with the commands that may have been missed while the control bus was down"""
+        if self.bot_leases:
+            return
+        await self.bot_manager.sync({bot.id for bot in self._active_bots()})
+        for bot_id in list(self.bot_manager.events_handlers):
+            await asyncio.to_thread(self.bot_manager.reconfigure, bot_id)
+
+    def _on_command(self, message: dict):
+        """Control bus handler, hands the command over to the engine event loop"""
+        self._run(self.handle_command(message["command"], UUID(message["bot_id"])),
+                  f"Bot command {message['command']} for bot {message['bot_id']}")
+
+    def _on_reconnect(self):
+        if self.connected:
+            self._run(self.resync(), "Engine resync")
+        self.connected = True
+
+    def _run(self, coroutine, description: str):
+        def done(future):
+            if not future.cancelled() and future.exception():
+                logging.error(f"{description} failed: {future.exception()}")
+
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop).add_done_callback(done)
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO)
+    trading_engine = TradingEngine(EngineEvents(), ControlBus())
+    await trading_engine.start()
+    logging.info("Trading engine started")
+
+    signals = asyncio.Queue()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, signals.put_nowait, signum)
+    # SIGTERM, as sent on deployments, lets the other workers take over the bots first
+    if await signals.get() == signal.SIGTERM:
+        await trading_engine.drain()
+
+    await trading_engine.stop()
+    client_registry.close_all()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""Scaled integer prices and quantities for the engine's hot path
+
+Values are held as integers of 10^-8 units, the scale of the DECIMAL(20, 8) columns, so that
+converting from and to the stored Decimals is exact. Percentages, stored as DECIMAL(10, 2),
+are held in hundredths. Per tick comparisons then only use integer arithmetic, without
+creating Decimal objects or depending on the Decimal context precision.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Tuple, Union
+
+PLACES = 8
+SCALE = 10 ** PLACES
+PERCENT_PLACES = 2
+PERCENT_SCALE = 10 ** PERCENT_PLACES
+
+Number = Union[Decimal, int, str]
+
+
+def parse_units(text: str, places: int = PLACES) -> int:
+    """Convert a decimal string as sent by the exchange ("65001.23000000") to scaled units
+
+    Raises ValueError when the value has more than `places` significant decimals.
+    """
+    if len(text) > places and text[-places - 1] == ".":  # the exchange sends all values with 8 decimals
+        return int(text.replace(".", "", 1))
+
+    negative = text.startswith("-")
+    whole, _, fraction = text.lstrip("+-").partition(".")
+    if len(fraction) > places:
+        if fraction[places:].strip("0"):
+            raise ValueError(f"{text} has more than {places} decimals")
+        fraction = fraction[:places]
+    units = int(whole or "0") * 10 ** places + int(fraction.ljust(places, "0") or "0")
+    return -units if negative else units
+
+
+def to_units(value: Number, places: int = PLACES) -> int:
+    """Exact scaled units of a Decimal, int or string value"""
+    if isinstance(value, str):
+        return parse_units(value, places)
+    if isinstance(value, int):
+        return value * 10 ** places
+    units = value.scaleb(places)
+    if units != units.to_integral_value():
+        raise ValueError(f"{value} has more than {places} decimals")
+    return int(units)
+
+
+def from_units(units: int, places: int = PLACES) -> Decimal:
+    """Decimal of the given scaled units, with exactly `places` decimals like the database columns"""
+    return Decimal(units).scaleb(-places)
+
+
+def price_change_trigger(reference: int, percentage: int) -> int:
+    """Lowest price, in units, that is up at least `percentage` (in hundredths of a percent) from `reference`
+
+    `price >= trigger` is the same test as `(price - reference) / reference * 100 >= percentage`
+    for a positive reference, so checking a tick costs a single integer comparison.
+    """
+    return reference - (-percentage * reference // (100 * PERCENT_SCALE))
+
+
+@dataclass(frozen=True)
+class SymbolPrecision:
+    """Decimals of the price tick and of the quantity step of a symbol"""
+    price_places: int
+    quantity_places: int
+
+    @property
+    def tick_size(self) -> Decimal:
+        return Decimal(1).scaleb(-self.price_places)
+
+    @property
+    def step_size(self) -> Decimal:
+        return Decimal(1).scaleb(-self.quantity_places)
+
+
+# TODO: we need to get these from the exchange info dynamically
+SYMBOL_PRECISIONS = {
+    "BTCUSDT": SymbolPrecision(price_places=2, quantity_places=5),
+    "ETHUSDT": SymbolPrecision(price_places=2, quantity_places=4),
+    "PEPEUSDT": SymbolPrecision(price_places=8, quantity_places=8),
+}
+
+
+# Base and quote asset of the symbols
+SYMBOL_ASSETS = {
+    "BTCUSDT": ("BTC", "USDT"),
+    "ETHUSDT": ("ETH", "USDT"),
+    "PEPEUSDT": ("PEPE", "USDT"),
+}
+
+
+def symbol_precision(symbol: str) -> SymbolPrecision:
+    try:
+        return SYMBOL_PRECISIONS[symbol]
+    except KeyError:
+        raise ValueError(f"Unsupported symbol: {symbol}")
+
+
+def symbol_assets(symbol: str) -> Tuple[str, str]:
+    try:
+        return SYMBOL_ASSETS[symbol]
+    except KeyError:
+        raise ValueError(f"Unsupported symbol: {symbol}")
@@ -0,0 +1,71 @@
+"""Planning of grid shifts, as a diff between the current ladder and the new one
+
+Prices and quantities are in fixed point units (see app.fixed_point). An order whose level
+the new ladder still has, within the tolerances, is kept as it is; the tolerances are a dead
+band, so levels that land close to where they were don't churn orders. The other orders are
+moved to the remaining levels with a single cancel-replace request each, and only the
+surplus is cancelled or placed.
+"""
+from dataclasses import dataclass, field
+from typing import Generic, List, Sequence, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass(frozen=True)
+class GridLevel:
+    number: int
+    price: int
+    quantity: int
+
+
+@dataclass
+class GridShift(Generic[T]):
+    keep: List[Tuple[T, GridLevel]] = field(default_factory=list)  # order and the level it now stands for
+    replace: List[Tuple[T, GridLevel]] = field(default_factory=list)  # order and the level it is moved to
+    cancel: List[T] = field(default_factory=list)
+    place: List[GridLevel] = field(default_factory=list)
+
+    @property
+    def requests(self) -> int:
+        """Number of exchange requests the shift takes"""
+        return len(self.replace) + len(self.cancel) + len(self.place)
+
+
+def plan_grid_shift(orders: Sequence[Tuple[T, GridLevel]], levels: Sequence[GridLevel],
+                    price_tolerance: int = 0, quantity_tolerance: int = 0) -> GridShift[T]:
+    """Diff the open grid `orders`, with the level each one stands for, against the new `levels`
+
+    Both ladders are walked from the highest price down, so planning is linear in the
+    number of levels.
+    """
+    orders = sorted(orders, key=lambda order: -order[1].price)
+    levels = sorted(levels, key=lambda level: -level.price)
+    shift = GridShift()
+    unmatched_orders, unmatched_levels = [], []
+
+    i = j = 0
+    while i < len(orders) and j < len(levels):
+        order, current = orders[i]
+        level = levels[j]
+        if current.price > level.price + price_tolerance:
+            unmatched_orders.append(order)  # above the new level, and so above all the next ones
+            i += 1
+        elif current.price < level.price - price_tolerance:
+            unmatched_levels.append(level)
+            j += 1
+        else:
+            if abs(current.quantity - level.quantity) <= quantity_tolerance:
+                shift.keep.append((order, level))
+            else:
+                shift.replace.append((order, level))
+            i += 1
+            j += 1
+    unmatched_orders.extend(order for order, _ in orders[i:])
+    unmatched_levels.extend(levels[j:])
+
+    moved = min(len(unmatched_orders), len(unmatched_levels))
+    shift.replace.extend(zip(unmatched_orders[:moved], unmatched_levels[:moved]))
+    shift.cancel.extend(unmatched_orders[moved:])
+    shift.place.extend(unmatched_levels[moved:])
+    return shift
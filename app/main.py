@@ -1,54 +1,92 @@
 import asyncio
+import functools
 import json
 import logging
 import os
+import time
+import uuid
 from decimal import Decimal
 from typing import List, Optional
 
 from app.enums import BotStatusType
 from binance.spot import Spot
-from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request, WebSocket
+from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import HTMLResponse, RedirectResponse, Response
-from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 from typing_extensions import Doc, IntVar
 
 from .database import engine, get_db
-from .models import Base, Bot
+from .engine import TradingEngine
+from .fixed_point import SYMBOL_PRECISIONS
+from .migrations import upgrade
+from .models import Bot
 from .routes import bot
-from .services.bot_manager import BotManager
-from .services.trading_service import TradingService
-from .services.bot_events_handler import BotEventsHandler
+from .services.balance_cache import AccountStream, BalanceCache
+from .services.bot_state_hub import BotStateHub, encode
+from .services.bot_view import BotQueries, ViewCache
+from .services.control_bus import EVENTS_CHANNEL, ControlBus
+from .services.engine_events import EngineEvents
+from .services.exchange_client import client_registry, exchange_metrics
+from .services.market_data import MarketDataFeed
+from .services.price_history import PriceHistory
 from app.services import trading_service
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Tables are created and upgraded (app.migrations) at startup; with CREATE_TABLES=0 the deployment
+# runs `python -m app.migrations` instead
+CREATE_TABLES = os.getenv("CREATE_TABLES", "1") == "1"
+# With FAST_STARTUP the server answers right away, /health first, while the engine and the bots warm up
+FAST_STARTUP = bool(os.getenv("FAST_STARTUP"))
 
-logging.basicConfig(level=logging.DEBUG)
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "DEBUG"))
 
 app = FastAPI()
-bot_manager = BotManager(TradingService, BotEventsHandler)
+app.state.status = "starting"
+engine_events = EngineEvents()
+bot_state_hub = BotStateHub()
+engine_events.subscribe(bot_state_hub.publish)
+bot_view_cache = ViewCache()
+engine_events.subscribe(bot_view_cache.invalidate)
+
+# "embedded" runs the trading engine in this process; with "remote" it runs as `python -m app.engine`
+# and this process only serves the web pages and APIs, talking to the engine over the control bus
+ENGINE_MODE = os.getenv("ENGINE_MODE", "embedded")
+control_bus = ControlBus() if ENGINE_MODE == "remote" else None
+trading_engine = TradingEngine(engine_events) if ENGINE_MODE == "embedded" else None
+
+# Price history for the dashboard charts, fed from the engine's price feed when it runs in this process
+app.state.price_history = PriceHistory(
+    tick_capacity=int(os.getenv("PRICE_HISTORY_TICKS", "10000")),
+    candle_capacity=int(os.getenv("PRICE_HISTORY_CANDLES", "1000")),
+)
+chart_feed = trading_engine.market_data if trading_engine else MarketDataFeed(os.getenv("PRICE_STREAM", "miniTicker"))
 
 ENV = os.getenv("ENV", "development")
 
 # Get the absolute path to the templates directory
 TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
-templates = Jinja2Templates(directory=TEMPLATES_DIR)
+
+@functools.cache
+def get_templates():
+    from fastapi.templating import Jinja2Templates  # jinja2 is loaded with the first page, not at import
+    return Jinja2Templates(directory=TEMPLATES_DIR)
 
 # Include bot routes
-#app.include_router(bot.router, prefix="/api/v1") # XXX
-
-# Initialize Binance client
-client = Spot(
-    api_key=os.getenv("BINANCE_API_KEY"),
-    api_secret=os.getenv("BINANCE_API_SECRET"),
-    base_url="https://testnet.binance.vision"
-    if os.getenv("BINANCE_TESTNET")
-    else "https://api.binance.com",
-)
-logging.info(f"Using {client.base_url} for Binance API")
+app.include_router(bot.router, prefix="/api/v1")
+
+def get_client() -> Spot:
+    """Binance client of the account given in the environment, shared by the requests"""
+    return client_registry.get(os.getenv("BINANCE_API_KEY"), os.getenv("BINANCE_API_SECRET"))
+
+# Balances of the account above, shared with the engine when it runs in this process
+account_balances = trading_engine.balances if trading_engine else BalanceCache()
+
+@functools.cache
+def get_account_stream() -> AccountStream:
+    return AccountStream(get_client(), account_balances)
+
+LISTEN_KEY_KEEPALIVE = 30 * 60
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -64,16 +102,88 @@ async def validation_exception_handler(request: Request, exc: RequestValidationE
 
 @app.on_event("startup")
 async def startup_event():
-    db = next(get_db())
-    bots = db.query(Bot).filter(Bot.is_active).all()
+    bot_state_hub.attach(asyncio.get_running_loop())
+    if FAST_STARTUP:
+        app.state.warm_up = asyncio.create_task(warm_up())
+        app.state.warm_up.add_done_callback(warm_up_done)
+    else:
+        await warm_up()
+
+def warm_up_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        app.state.status = "failed"
+        logging.error(f"Startup failed: {task.exception()}")
+
+async def warm_up():
+    """Create the tables, start the engine (or connect to it) and open the account stream"""
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    if CREATE_TABLES:
+        await asyncio.to_thread(upgrade, engine)
+
+    if control_bus:
+        control_bus.subscribe(EVENTS_CHANNEL, lambda message: engine_events.publish(
+            uuid.UUID(message["bot_id"]), message["event"], message["data"]
+        ))
+        control_bus.on_connect.append(lambda: loop.call_soon_threadsafe(request_snapshots))
+        control_bus.start()
+    else:
+        await trading_engine.start()
+
+    for symbol in SYMBOL_PRECISIONS:
+        chart_feed.subscribe(symbol, app.state.price_history.record)
 
-    # Initialize trading service and websocket manager for each bot
-    await bot_manager.install_bots(bots)
+    try:
+        await asyncio.to_thread(get_account_stream().start)
+        asyncio.create_task(keep_account_stream_alive())
+    except Exception as e:
+        logging.error(f"Failed to open the account stream, balances will be loaded on request: {e}")
+
+    app.state.status = "ready"
+    logging.info(f"Started in {time.perf_counter() - started:.2f}s")
+
+async def keep_account_stream_alive():
+    while True:
+        await asyncio.sleep(LISTEN_KEY_KEEPALIVE)
+        try:
+            await asyncio.to_thread(get_account_stream().keepalive)
+        except Exception as e:
+            logging.error(f"Failed to extend the account stream listen key: {e}")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    bot_manager.release_all()
-
+    if FAST_STARTUP:
+        app.state.warm_up.cancel()
+    get_account_stream().stop()
+    if control_bus:
+        control_bus.stop()
+        chart_feed.stop()
+    else:
+        await trading_engine.stop()
+    client_registry.close_all()
+
+async def send_command(command: str, bot_id: uuid.UUID):
+    """Have the trading engine apply a change made to a bot"""
+    if control_bus:
+        control_bus.send_command(command, bot_id)
+    else:
+        await trading_engine.handle_command(command, bot_id)
+
+app.state.send_command = send_command  # for the JSON API
+
+def request_snapshots():
+    """Ask the remote engine for the state of the bots with open dashboards"""
+    for bot_id in list(bot_state_hub.subscribers):
+        control_bus.send_command("snapshot", bot_id)
+
+
+@app.get("/health")
+async def health():
+    """Answers as soon as the server runs: starting, ready once the engine and the bots are started, or failed"""
+    return {
+        "status": app.state.status,
+        "bots": len(trading_engine.bot_manager.events_handlers) if trading_engine else None,
+    }
 
 @app.get("/")
 async def home():
@@ -83,21 +193,24 @@ async def home():
 @app.get("/bots", response_class=HTMLResponse)
 async def list_bots(request: Request, db: Session = Depends(get_db)):
     bots = db.query(Bot).all()
-    return templates.TemplateResponse("bots.html", {"request": request, "bots": bots})
+    return get_templates().TemplateResponse("bots.html", {"request": request, "bots": bots})
 
 
 @app.get("/bots/{bot_id}", response_class=HTMLResponse)
-async def bot_detail(request: Request, bot_id: str, db: Session = Depends(get_db)):
-    bot_obj = db.query(Bot).filter(Bot.id == bot_id).first()
-    ts_obj = TradingService(bot=bot_obj, db=db)
-    cycle_obj = ts_obj.cycle
+async def bot_detail(request: Request, bot_id: uuid.UUID, db: Session = Depends(get_db)):
+    html = bot_view_cache.get(bot_id)
+    if html is None:
+        generation = bot_view_cache.generation(bot_id)
+        view = BotQueries(db).bot_view(bot_id)
+        if not view:
+            raise HTTPException(status_code=404, detail="Bot not found")
 
-    if not bot_obj:
-        raise HTTPException(status_code=404, detail="Bot not found")
+        html = get_templates().get_template("bot_details.html").render({"request": request, "bot": view.bot,
+                                                                  "current_cycle": view.cycle,
+                                                                  "stats": view})
+        bot_view_cache.put(bot_id, html, generation)
 
-    return templates.TemplateResponse("bot_details.html", {"request": request, "bot": bot_obj,
-                                                           "current_cycle": cycle_obj,
-                                                           "trading_service": ts_obj })
+    return HTMLResponse(html)
 
 @app.get("/bots/{bot_id}/dashboard", response_class=HTMLResponse)
 async def bot_dashboard(request: Request, bot_id: str, db: Session = Depends(get_db)):
@@ -105,7 +218,7 @@ async def bot_dashboard(request: Request, bot_id: str, db: Session = Depends(get
     if not bot_obj:
         raise HTTPException(status_code=404, detail="Bot not found")
 
-    return templates.TemplateResponse("bot_dashboard.html", {"request": request, "bot": bot_obj })
+    return get_templates().TemplateResponse("bot_dashboard.html", {"request": request, "bot": bot_obj })
 
 @app.put("/bots/{bot_id}")
 async def update_bot(
@@ -136,15 +249,22 @@ async def update_bot(
         bot_obj.price_change_percentage = price_change_percentage
         bot_obj.upper_price_limit = 0 # XXX
 
-        if bot_obj.is_active and not is_active:
-            bot_obj.status = BotStatusType.LAST_CYCLE
-            db.commit()
-        elif not bot_obj.is_active and is_active:
+        # HTML forms send booleans as text
+        is_active = is_active.lower() in ("true", "on", "1")
+        if not bot_obj.is_active and is_active:
             bot_obj.status = BotStatusType.RUNNING
             bot_obj.is_active = True
             db.commit()
-            await bot_manager.install(bot_obj)
+            await send_command("start", bot_obj.id)
+        elif bot_obj.is_active:
+            # A running bot keeps its connections, the engine applies the changed settings in place
+            bot_obj.status = BotStatusType.RUNNING if is_active else BotStatusType.LAST_CYCLE
+            db.commit()
+            await send_command("update", bot_obj.id)
+        else:
+            db.commit()
 
+        bot_view_cache.invalidate(bot_obj.id)
         return "Bot updated."
     except Exception as e:
         logging.error(f"Error placing order: {e}")
@@ -187,9 +307,11 @@ async def create_bot(
 @app.get("/balance")
 async def balance(assets: Optional[List[str]] = Query(None)):
     try:
-        client.account()
-        account_info = client.account(omitZeroBalances="true")
-        balances = account_info["balances"]
+        client = get_client()
+        balances = account_balances.balances(client.api_key)
+        if balances is None:  # the account stream is not running
+            await asyncio.to_thread(account_balances.seed, client.api_key, client, True)
+            balances = account_balances.balances(client.api_key)
         if assets:
             balances = [x for x in balances if x["asset"] in set(assets)]
         return balances
@@ -197,12 +319,27 @@ async def balance(assets: Optional[List[str]] = Query(None)):
         logging.error(f"Error getting balance: {e}")
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/engine/queues")
+async def engine_queues():
+    """Event queue of every bot of the engine: depth and waits in seconds"""
+    if not trading_engine:
+        raise HTTPException(status_code=404, detail="The trading engine runs in another process")
+    return {str(bot_id): stats for bot_id, stats in trading_engine.dispatcher.stats().items()}
+
+
+@app.get("/engine/exchange")
+async def engine_exchange():
+    """Calls, retries, failures, hedged requests and latency percentiles of every exchange endpoint"""
+    if not trading_engine:
+        raise HTTPException(status_code=404, detail="The trading engine runs in another process")
+    return exchange_metrics.snapshot()
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     logging.info("WebSocket connection established")
 
+    client = get_client()
     while True:
         try:
             btc_usdt = client.ticker_price(symbol="BTCUSDT")
@@ -213,3 +350,22 @@ async def websocket_endpoint(websocket: WebSocket):
         except Exception as e:
             logging.error(f"WebSocket error: {e}")
             break
+
+
+@app.websocket("/bots/{bot_id}/ws")
+async def bot_state_websocket(websocket: WebSocket, bot_id: uuid.UUID):
+    """Push the bot's state as the engine changes it: a snapshot first, then deltas"""
+    await websocket.accept()
+    queue = bot_state_hub.subscribe(bot_id)
+    if control_bus and bot_id not in bot_state_hub.states:
+        control_bus.send_command("snapshot", bot_id)
+
+    try:
+        await websocket.send_text(encode(bot_state_hub.snapshot(bot_id)))
+        while True:
+            await websocket.send_text(await queue.get())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        bot_state_hub.unsubscribe(bot_id, queue)
+
@@ -0,0 +1,54 @@
+"""Upgrades of the tables of deployed databases, which create_all never alters
+
+    python -m app.migrations
+
+creates the missing tables, then adds the columns and indexes the models gained after
+their table was created. Every step is skipped when already applied, so it runs at each
+start of the web process (see CREATE_TABLES in app.main) as well as on its own.
+"""
+import logging
+
+from sqlalchemy import Index, inspect, text
+from sqlalchemy.engine import Engine
+
+from .models import Base
+
+# Columns added to existing tables, all nullable, in the order they were introduced
+COLUMNS = [
+    ("trading_cycles", "archived_at"),  # cycles whose orders were moved to orders_archive
+    ("orders", "client_order_id"),  # see app.client_order_ids
+    ("orders_archive", "client_order_id"),
+]
+
+# Indexes added to existing tables
+INDEXES = [
+    "ix_trading_cycles_bot_id_created_at_id",  # keyset pagination of the cycles and orders
+    "ix_orders_cycle_id_created_at_id",
+]
+
+
+def _index(name: str) -> Index:
+    return next(index for table in Base.metadata.tables.values() for index in table.indexes if index.name == name)
+
+
+def upgrade(engine: Engine):
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table_name, column_name in COLUMNS:
+            if column_name in {column["name"] for column in inspector.get_columns(table_name)}:
+                continue
+            column = Base.metadata.tables[table_name].c[column_name]
+            connection.execute(text(
+                f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column.type.compile(dialect=engine.dialect)}"
+            ))
+            logging.info(f"Added column {table_name}.{column_name}")
+        for name in INDEXES:
+            _index(name).create(connection, checkfirst=True)
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    upgrade(engine)
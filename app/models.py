@@ -1,7 +1,7 @@
 import uuid
-from sqlalchemy import Column, String, Boolean, Integer, JSON, ForeignKey, DateTime, DECIMAL
+from sqlalchemy import Column, String, Boolean, Integer, JSON, ForeignKey, DateTime, DECIMAL, Index
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import declarative_base, relationship, Session
+from sqlalchemy.orm import declarative_base, object_session, relationship, Session
 from .enums import *
 from sqlalchemy.sql import func
 
@@ -33,6 +33,7 @@ class Bot(Base):
 
 class TradingCycle(Base):
     __tablename__ = "trading_cycles"
+    __table_args__ = (Index("ix_trading_cycles_bot_id_created_at_id", "bot_id", "created_at", "id"),)
 
     bot = relationship("Bot", back_populates="trading_cycles")
     orders = relationship("Order", back_populates="cycle", lazy="dynamic")
@@ -51,18 +52,28 @@ class TradingCycle(Base):
     status = Column(String(20), nullable=False)
     price_change_percentage = Column(DECIMAL(precision=10, scale=2), nullable=False)
     quantity = Column(DECIMAL(precision=20, scale=8), server_default='0')
+    archived_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
+    def order_model(self):
+        """Table holding the cycle's orders: the hot one, or the archive once the cycle was archived"""
+        return OrderArchive if self.archived_at else Order
+
+    def order_history(self):
+        model = self.order_model()
+        return object_session(self).query(model).filter(model.cycle_id == self.id)
+
     def profit(self):
         if self.status == CycleStatusType.COMPLETED:
-            buy_orders = self.orders.filter(
-                Order.side == SideType.BUY,
-                Order.status.in_([OrderStatusType.FILLED, OrderStatusType.PARTIALLY_FILLED])
+            model = self.order_model()
+            buy_orders = self.order_history().filter(
+                model.side == SideType.BUY,
+                model.status.in_([OrderStatusType.FILLED, OrderStatusType.PARTIALLY_FILLED])
             ).all()
 
-            sell_orders = self.orders.filter(
-                Order.side == SideType.SELL
+            sell_orders = self.order_history().filter(
+                model.side == SideType.SELL
             ).all()
 
             total_buy_amount = sum(order.quantity_filled * order.price for order in buy_orders)
@@ -75,13 +86,8 @@ class TradingCycle(Base):
         else:
             return 0
 
-class Order(Base):
-    __tablename__ = "orders"
-
-    cycle = relationship("TradingCycle", back_populates="orders")
-
+class OrderColumns:
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    cycle_id = Column(UUID(as_uuid=True), ForeignKey('trading_cycles.id'), nullable=False)
     exchange = Column(String(20), nullable=False)
     symbol = Column(String(20), nullable=False)
     side = Column(String(10), nullable=False)
@@ -93,7 +99,95 @@ class Order(Base):
     quantity_filled = Column(DECIMAL(precision=20, scale=8), server_default='0')
     status = Column(String(20), nullable=False)
     number = Column(Integer, nullable=False)
-    exchange_order_id = Column(Integer, nullable=False, unique=True)
+    client_order_id = Column(String(36), nullable=True)  # see app.client_order_ids, empty for older orders
     exchange_order_data = Column(JSON, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class Order(OrderColumns, Base):
+    """Orders of live cycles (hot partition)"""
+    __tablename__ = "orders"
+    __table_args__ = (Index("ix_orders_cycle_id_created_at_id", "cycle_id", "created_at", "id"),)
+
+    cycle = relationship("TradingCycle", back_populates="orders")
+
+    cycle_id = Column(UUID(as_uuid=True), ForeignKey('trading_cycles.id'), nullable=False)
+    exchange_order_id = Column(Integer, nullable=False, unique=True)
+
+class OrderArchive(OrderColumns, Base):
+    """Orders of completed cycles moved out of the hot table by the OrderArchiver (cold partition)"""
+    __tablename__ = "orders_archive"
+    __table_args__ = (Index("ix_orders_archive_cycle_id_created_at_id", "cycle_id", "created_at", "id"),)
+
+    cycle_id = Column(UUID(as_uuid=True), ForeignKey('trading_cycles.id'), nullable=False)
+    exchange_order_id = Column(Integer, nullable=False, index=True)
+
+class ExportWatermark(Base):
+    """Point up to which the trade history of a scope (a bot or an account) was exported"""
+    __tablename__ = "export_watermarks"
+
+    scope = Column(String(120), primary_key=True)
+    exported_until = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+class EngineWorker(Base):
+    """Trading engine process taking part in bot ownership, alive while its heartbeat is recent"""
+    __tablename__ = "engine_workers"
+
+    id = Column(String(100), primary_key=True)
+    heartbeat_at = Column(DateTime, nullable=False)
+    draining = Column(Boolean, nullable=False, default=False)
+
+class BotLease(Base):
+    """Ownership of a bot by an engine worker, valid until expires_at (database clock)"""
+    __tablename__ = "bot_leases"
+
+    bot_id = Column(UUID(as_uuid=True), ForeignKey('bots.id'), primary_key=True)
+    worker_id = Column(String(100), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False)
+
+
+class PaperBot(Base):
+    """Shadow bot traded on the live prices against the simulated matching engine, never on the exchange"""
+    __tablename__ = "paper_bots"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    name = Column(String(100), nullable=False)
+    symbol = Column(String(20), nullable=False)
+    amount = Column(DECIMAL(precision=20, scale=8), nullable=False)
+    grid_length = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    first_order_offset = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    num_orders = Column(Integer, nullable=False)
+    next_order_volume = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    profit_percentage = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    price_change_percentage = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+class PaperCycle(Base):
+    """Completed cycle of a paper bot, with its simulated results"""
+    __tablename__ = "paper_cycles"
+    __table_args__ = (Index("ix_paper_cycles_paper_bot_id_created_at", "paper_bot_id", "created_at"),)
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    paper_bot_id = Column(UUID(as_uuid=True), ForeignKey('paper_bots.id'), nullable=False)
+    symbol = Column(String(20), nullable=False)
+    amount = Column(DECIMAL(precision=20, scale=8), nullable=False)
+    grid_length = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    first_order_offset = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    num_orders = Column(Integer, nullable=False)
+    next_order_volume = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    price = Column(DECIMAL(precision=20, scale=8), nullable=False)
+    profit_percentage = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    price_change_percentage = Column(DECIMAL(precision=10, scale=2), nullable=False)
+    status = Column(String(20), nullable=False)
+    quantity = Column(DECIMAL(precision=20, scale=8), server_default='0')  # bought, and sold back
+    cost = Column(DECIMAL(precision=20, scale=8), server_default='0')
+    proceeds = Column(DECIMAL(precision=20, scale=8), server_default='0')
+    buy_fills = Column(Integer, server_default='0')
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+    def profit(self):
+        return round(self.proceeds - self.cost, 2) if self.status == CycleStatusType.COMPLETED else 0
@@ -1,52 +1,55 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
-from typing import List
-from ..services.trading_service import TradingService
+from starlette.background import BackgroundTask
+from typing import Awaitable, Callable, List, Literal, Optional
+from datetime import datetime
+from ..services.price_history import PriceHistory, lttb, to_price
+from ..services.trade_exporter import TradeExporter
 from ..services.bot_events_handler import BotEventsHandler
-from ..models import Bot, TradingCycle, Order
+from ..models import Bot, TradingCycle, Order, OrderArchive
 from ..schemas import (
     BotCreate, BotResponse,
-    TradingCycleResponse,
-    OrderResponse
+    TradingCycleResponse, TradingCyclePage,
+    OrderResponse, OrderPage
 )
-from ..database import get_db
-from ..enums import BotStatusType, CycleStatusType
+from ..database import SessionLocal, get_db
+from ..enums import BotStatusType, CycleStatusType, OrderStatusType
+import asyncio
+import base64
+import json
 import os
+import tempfile
 import uuid
 
+STREAM_BATCH_SIZE = 1000
+
 router = APIRouter()
 
-def get_trading_service(db: Session = Depends(get_db)) -> TradingService:
-    # Initialize Binance client with credentials from environment
-    client = Spot(
-        api_key=os.getenv("BINANCE_API_KEY"),
-        api_secret=os.getenv("BINANCE_API_SECRET"),
-        base_url='https://testnet.binance.vision' if os.getenv("BINANCE_TESTNET") == '1' else 'https://api.binance.com'
-    )
-    return TradingService(client=client, db=db)
+def get_price_history(request: Request) -> PriceHistory:
+    return request.app.state.price_history
+
+def get_send_command(request: Request) -> Callable[[str, uuid.UUID], Awaitable[None]]:
+    """Hands a bot change over to the trading engine, which alone places and cancels the bot's orders"""
+    return request.app.state.send_command
 
 @router.post("/bots/", response_model=BotResponse)
 async def create_bot(
     bot_data: BotCreate,
     db: Session = Depends(get_db),
-    trading_service: TradingService = Depends(get_trading_service)
+    send_command=Depends(get_send_command)
 ):
-    """Create a new trading bot and start its first cycle"""
-    try:
-        # Create bot
-        bot = Bot(**bot_data.dict())
-        bot.status = BotStatusType.ACTIVE
-        db.add(bot)
-        db.commit()
-        db.refresh(bot)
-        
-        # Start first trading cycle
-        cycle = trading_service.start_new_cycle(bot)
-        
-        return bot
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+    """Create a new trading bot; the engine starts its first cycle if it is active"""
+    bot = Bot(**bot_data.model_dump())
+    bot.status = BotStatusType.RUNNING if bot.is_active else BotStatusType.STOPPED
+    db.add(bot)
+    db.commit()
+    db.refresh(bot)
+
+    if bot.is_active:
+        await send_command("start", bot.id)
+    return bot
 
 @router.get("/bots/", response_model=List[BotResponse])
 async def list_bots(
@@ -73,85 +76,181 @@ async def get_bot(
 async def start_bot(
     bot_id: uuid.UUID,
     db: Session = Depends(get_db),
-    trading_service: TradingService = Depends(get_trading_service)
+    send_command=Depends(get_send_command)
 ):
     """Start or resume bot trading"""
     bot = db.query(Bot).filter(Bot.id == bot_id).first()
     if not bot:
         raise HTTPException(status_code=404, detail="Bot not found")
-    
-    try:
-        bot.is_active = True
-        bot.status = BotStatusType.ACTIVE
-        db.commit()
-        
-        # Start new cycle if no active cycle exists
-        active_cycle = db.query(TradingCycle).filter(
-            TradingCycle.bot_id == bot.id,
-            TradingCycle.status == CycleStatusType.ACTIVE
-        ).first()
-        
-        if not active_cycle:
-            cycle = trading_service.start_new_cycle(bot)
-        
-        return {"message": "Bot started successfully"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+
+    was_active = bot.is_active
+    bot.is_active = True
+    bot.status = BotStatusType.RUNNING
+    db.commit()
+    # A bot stopping after its last cycle keeps running, the engine only picks up the new status
+    await send_command("update" if was_active else "start", bot.id)
+    return {"message": "Bot started successfully"}
 
 @router.post("/bots/{bot_id}/stop")
 async def stop_bot(
     bot_id: uuid.UUID,
     db: Session = Depends(get_db),
-    trading_service: TradingService = Depends(get_trading_service)
+    send_command=Depends(get_send_command)
 ):
-    """Stop bot trading and cancel all active orders"""
+    """Stop the bot once its running cycle is completed, as the bot page does"""
     bot = db.query(Bot).filter(Bot.id == bot_id).first()
     if not bot:
         raise HTTPException(status_code=404, detail="Bot not found")
-    
-    try:
-        # Cancel orders in active cycle
-        active_cycle = db.query(TradingCycle).filter(
-            TradingCycle.bot_id == bot.id,
-            TradingCycle.status == CycleStatusType.ACTIVE
-        ).first()
-        
-        if active_cycle:
-            trading_service.cancel_cycle_orders(active_cycle)
-            active_cycle.status = CycleStatusType.CANCELED
-        
-        bot.is_active = False
-        bot.status = BotStatusType.STOPPED
+
+    if bot.is_active:
+        bot.status = BotStatusType.LAST_CYCLE
         db.commit()
-        
-        return {"message": "Bot stopped successfully"}
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=400, detail=str(e))
+        await send_command("update", bot.id)
+    return {"message": "Bot stops after its running cycle"}
+
+def _encode_cursor(row) -> str:
+    """Opaque keyset cursor pointing right after the given row in (created_at, id) order"""
+    return base64.urlsafe_b64encode(json.dumps([row.created_at.isoformat(), str(row.id)]).encode()).decode()
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), uuid.UUID(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def _keyset_page(query, model, cursor: Optional[str], limit: int):
+    """Fetch one page ordered by (created_at, id), seeking past the cursor instead of using an offset"""
+    if cursor:
+        query = query.filter(tuple_(model.created_at, model.id) > _decode_cursor(cursor))
 
-@router.get("/bots/{bot_id}/cycles", response_model=List[TradingCycleResponse])
+    rows = query.order_by(model.created_at, model.id).limit(limit + 1).all()
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return {"items": rows[:limit], "next_cursor": next_cursor}
+
+@router.get("/bots/{bot_id}/cycles", response_model=TradingCyclePage)
 async def list_bot_cycles(
     bot_id: uuid.UUID,
-    skip: int = 0,
-    limit: int = 100,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     db: Session = Depends(get_db)
 ):
-    """List all cycles for a specific bot"""
-    cycles = db.query(TradingCycle).filter(
-        TradingCycle.bot_id == bot_id
-    ).offset(skip).limit(limit).all()
-    return cycles
+    """List cycles of a specific bot, oldest first; pass `next_cursor` back as `cursor` for the next page"""
+    query = db.query(TradingCycle).filter(TradingCycle.bot_id == bot_id)
+    return _keyset_page(query, TradingCycle, cursor, limit)
 
-@router.get("/cycles/{cycle_id}/orders", response_model=List[OrderResponse])
+@router.get("/cycles/{cycle_id}/orders", response_model=OrderPage)
 async def list_cycle_orders(
     cycle_id: uuid.UUID,
-    skip: int = 0,
-    limit: int = 100,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
     db: Session = Depends(get_db)
 ):
-    """List all orders in a specific cycle"""
-    orders = db.query(Order).filter(
-        Order.cycle_id == cycle_id
-    ).offset(skip).limit(limit).all()
-    return orders 
+    """List orders of a specific cycle, oldest first; pass `next_cursor` back as `cursor` for the next page"""
+    cycle = db.query(TradingCycle).filter(TradingCycle.id == cycle_id).first()
+    if not cycle:
+        raise HTTPException(status_code=404, detail="Cycle not found")
+
+    model = cycle.order_model()
+    return _keyset_page(cycle.order_history(), model, cursor, limit)
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)  # Decimal and UUID
+
+def _stream_bot_orders(bot_id: uuid.UUID):
+    """Yield the bot's orders as NDJSON lines, archived cycles first, through server-side cursors"""
+    db = SessionLocal()
+    try:
+        for model in (OrderArchive, Order):
+            statement = (
+                select(model.__table__)
+                .join(TradingCycle, TradingCycle.id == model.cycle_id)
+                .where(TradingCycle.bot_id == bot_id)
+                .order_by(model.created_at, model.id)
+                .execution_options(yield_per=STREAM_BATCH_SIZE)
+            )
+            for row in db.execute(statement):
+                yield json.dumps(dict(row._mapping), default=_json_default) + "\n"
+    finally:
+        db.close()
+
+@router.get("/bots/{bot_id}/orders/stream")
+async def stream_bot_orders(
+    bot_id: uuid.UUID,
+    db: Session = Depends(get_db)
+):
+    """Export the full order history of a bot as newline-delimited JSON"""
+    if not db.query(Bot.id).filter(Bot.id == bot_id).first():
+        raise HTTPException(status_code=404, detail="Bot not found")
+
+    return StreamingResponse(_stream_bot_orders(bot_id), media_type="application/x-ndjson")
+
+@router.get("/bots/{bot_id}/export")
+async def export_bot_history(
+    bot_id: uuid.UUID,
+    table: Literal["cycles", "orders"] = "orders",
+    format: Literal["parquet", "arrow"] = "parquet",
+    scope: Literal["bot", "account"] = "bot",
+    since: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """Export cycles or orders of the bot (or of every bot on its account) as a Parquet or Arrow IPC file"""
+    bot = db.query(Bot).filter(Bot.id == bot_id).first()
+    if not bot:
+        raise HTTPException(status_code=404, detail="Bot not found")
+
+    scope_filter = {"bot_id": bot.id} if scope == "bot" else {"api_key": bot.api_key}
+    fd, path = tempfile.mkstemp(suffix=f".{format}")
+    os.close(fd)
+    try:
+        await asyncio.to_thread(TradeExporter().export, path, table, format, since=since, **scope_filter)
+    except Exception as e:
+        os.remove(path)
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return FileResponse(
+        path,
+        media_type="application/vnd.apache.parquet" if format == "parquet" else "application/vnd.apache.arrow.file",
+        filename=f"{scope}-{bot_id}-{table}.{format}",
+        background=BackgroundTask(os.remove, path)
+    )
+
+
+@router.get("/bots/{bot_id}/chart")
+async def bot_chart(
+    bot_id: uuid.UUID,
+    resolution: int = 60,
+    points: int = Query(500, ge=3, le=5000),
+    db: Session = Depends(get_db),
+    price_history: PriceHistory = Depends(get_price_history)
+):
+    """Recent prices of the bot's symbol, downsampled to `points`, with its candles and open grid orders"""
+    bot = db.query(Bot).filter(Bot.id == bot_id).first()
+    if not bot:
+        raise HTTPException(status_code=404, detail="Bot not found")
+
+    try:
+        candles = price_history.candles(bot.symbol, resolution, points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    times, prices = price_history.ticks(bot.symbol)
+
+    cycle = db.query(TradingCycle).filter(
+        TradingCycle.bot_id == bot.id,
+        TradingCycle.status == CycleStatusType.ACTIVE
+    ).first()
+    orders = cycle.orders.filter(
+        Order.status.in_([OrderStatusType.NEW, OrderStatusType.PARTIALLY_FILLED])
+    ).order_by(Order.number).all() if cycle else []
+
+    return {
+        "symbol": bot.symbol,
+        "resolution": resolution,
+        "prices": [[timestamp, to_price(price)] for timestamp, price in lttb(times, prices, points)],
+        "candles": [[start, *map(to_price, ohlc)] for start, *ohlc in candles],
+        "cycle_price": cycle.price if cycle else None,
+        "grid": [{"number": order.number, "side": order.side, "price": order.price, "status": order.status}
+                 for order in orders],
+    }
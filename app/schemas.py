@@ -1,6 +1,6 @@
 from pydantic import BaseModel, UUID4, Field
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from .enums import *
 
 class BotBase(BaseModel):
@@ -15,16 +15,15 @@ class BotBase(BaseModel):
     profit_percentage: float
     price_change_percentage: float
     upper_price_limit: float
-    status: BotStatusType
     is_active: bool = True
-    user_id: UUID4
-    exchange_key_id: UUID4
 
 class BotCreate(BotBase):
-    pass
+    api_key: str = Field(..., max_length=100)
+    api_secret: str = Field(..., max_length=100)
 
 class BotResponse(BotBase):
     id: UUID4
+    status: BotStatusType
     created_at: datetime
     updated_at: datetime
 
@@ -67,7 +66,8 @@ class OrderBase(BaseModel):
     quantity: float = Field(..., gt=0)
     status: OrderStatusType
     number: int
-    exchange_order_id: str
+    exchange_order_id: int
+    client_order_id: Optional[str] = None
     exchange_order_data: Optional[dict] = None
     cycle_id: UUID4
 
@@ -81,3 +81,11 @@ class OrderResponse(OrderBase):
 
     class Config:
         from_attributes = True
+
+class TradingCyclePage(BaseModel):
+    items: List[TradingCycleResponse]
+    next_cursor: Optional[str] = None
+
+class OrderPage(BaseModel):
+    items: List[OrderResponse]
+    next_cursor: Optional[str] = None
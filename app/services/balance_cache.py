@@ -0,0 +1,217 @@
+import threading
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Set, Tuple
+
+from binance.spot import Spot
+from binance.websocket.spot.websocket_stream import SpotWebsocketStreamClient
+
+from .market_data import stream_url
+from .stream_messages import AccountPosition, ExecutionReport, decode
+
+AssetBalance = Tuple[Decimal, Decimal, int]  # free, locked, and the time of the update in ms
+
+
+class InsufficientBalanceError(Exception):
+    """Orders can't be funded from the free balance of the account"""
+
+
+class Reservation:
+    """Funds set aside for orders about to be sent, whatever is not settled is released on exit"""
+
+    def __init__(self, cache: Optional['BalanceCache'], api_key: str, asset: str, amount: Decimal):
+        self.cache = cache  # None when the account's balances are not known, nothing is checked then
+        self.api_key = api_key
+        self.asset = asset
+        self.amount = amount
+
+    def settle(self, amount: Decimal, update_time: int):
+        """An order of `amount` was accepted at `update_time` (ms), its funds are now locked"""
+        if self.cache:
+            self.cache._settle(self, amount, update_time)
+
+    def release(self):
+        if self.cache:
+            self.cache._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class BalanceCache:
+    """Balances of the accounts in use, by API key, kept in memory
+
+    An account is seeded from the REST API, then kept current by the
+    `outboundAccountPosition` events of its user data streams. Once its last stream is
+    closed nothing keeps it current, so it is seeded again when a stream is opened again;
+    the owners of the streams also reseed it periodically, in case events were missed.
+    Every asset remembers the time of its last update, so events and the REST snapshot
+    can arrive in any order.
+
+    It is also the ledger of the pre-trade checks: orders reserve their funds before they
+    are sent, and the orders placed, filled and cancelled are applied right away, ahead
+    of the account events that confirm them. Such a change is only applied when it is
+    newer than the asset's last update, so that it never counts twice.
+    """
+
+    def __init__(self):
+        self.accounts: Dict[str, Dict[str, AssetBalance]] = {}
+        self.seeded: Set[str] = set()  # accounts loaded from the REST API, the others only have the updates
+        self.streams: Counter = Counter()  # open user data streams by account
+        self.reserved: Dict[str, Dict[str, Decimal]] = defaultdict(lambda: defaultdict(Decimal))
+        self.lock = threading.Lock()
+
+    def seed(self, api_key: str, client: Spot, refresh: bool = False):
+        """Load the account's balances from the REST API, unless they are cached already"""
+        if api_key in self.seeded and not refresh:
+            return
+        account = client.account(omitZeroBalances="true")
+        self._update(api_key, account.get("updateTime", 0),
+                     ((balance["asset"], balance["free"], balance["locked"]) for balance in account["balances"]))
+        self.seeded.add(api_key)
+
+    def stream_opened(self, api_key: str):
+        with self.lock:
+            self.streams[api_key] += 1
+
+    def stream_closed(self, api_key: str):
+        """Without any stream left the account is no longer current, the next seed loads it again"""
+        with self.lock:
+            self.streams[api_key] -= 1
+            if self.streams[api_key] <= 0:
+                del self.streams[api_key]
+                self.seeded.discard(api_key)
+
+    def apply(self, api_key: str, position: AccountPosition):
+        """Apply an account update event, it carries the assets that changed"""
+        self._update(api_key, position.event_time,
+                     ((balance.asset, balance.free, balance.locked) for balance in position.balances or ()))
+
+    def _update(self, api_key: str, update_time: int, balances):
+        with self.lock:
+            account = self.accounts.setdefault(api_key, {})
+            for asset, free, locked in balances:
+                if asset not in account or account[asset][2] <= update_time:
+                    account[asset] = (Decimal(free), Decimal(locked), update_time)
+
+    def _move(self, api_key: str, asset: str, free: Decimal, locked: Decimal, update_time: int):
+        """Apply a change of the free and locked balances made at `update_time`, unless already reported"""
+        account = self.accounts[api_key]
+        current_free, current_locked, current_time = account.get(asset, (Decimal(0), Decimal(0), 0))
+        if update_time > current_time:
+            account[asset] = (current_free + free, current_locked + locked, update_time)
+
+    def _check(self, api_key: str, asset: str, amount: Decimal):
+        free = self.accounts[api_key].get(asset, (Decimal(0),))[0]
+        available = free - self.reserved[api_key][asset]
+        if amount > available:
+            raise InsufficientBalanceError(f"{amount} {asset} needed, {available} available")
+
+    def check(self, api_key: str, asset: str, amount: Decimal):
+        """Raise InsufficientBalanceError unless `amount` is available, without setting it aside"""
+        with self.lock:
+            if api_key in self.seeded:
+                self._check(api_key, asset, amount)
+
+    def reserve(self, api_key: str, asset: str, amount: Decimal) -> Reservation:
+        """Set aside `amount` of the free balance, InsufficientBalanceError when it is not there"""
+        with self.lock:
+            if api_key not in self.seeded:
+                return Reservation(None, api_key, asset, amount)
+            self._check(api_key, asset, amount)
+            self.reserved[api_key][asset] += amount
+            return Reservation(self, api_key, asset, amount)
+
+    def _settle(self, reservation: Reservation, amount: Decimal, update_time: int):
+        with self.lock:
+            settled = min(amount, reservation.amount)
+            reservation.amount -= settled
+            self.reserved[reservation.api_key][reservation.asset] -= settled
+            self._move(reservation.api_key, reservation.asset, -amount, amount, update_time)
+
+    def _release(self, reservation: Reservation):
+        with self.lock:
+            self.reserved[reservation.api_key][reservation.asset] -= reservation.amount
+            reservation.amount = Decimal(0)
+
+    def unlock(self, api_key: str, asset: str, amount: Decimal, update_time: int):
+        """An order was cancelled at `update_time`, its remaining funds are free again"""
+        with self.lock:
+            if api_key in self.seeded:
+                self._move(api_key, asset, amount, -amount, update_time)
+
+    def apply_execution(self, api_key: str, report: ExecutionReport, base_asset: str, quote_asset: str):
+        """Apply the trade of an execution report, if any, to the balances of both assets and of the fee"""
+        quantity = Decimal(report.last_quantity)
+        if not quantity:
+            return
+        cost = quantity * Decimal(report.last_price)
+        changes = defaultdict(lambda: [Decimal(0), Decimal(0)])  # free and locked, by asset
+        if report.side == "BUY":
+            changes[quote_asset][1] -= cost
+            changes[base_asset][0] += quantity
+        else:
+            changes[base_asset][1] -= quantity
+            changes[quote_asset][0] += cost
+        if report.commission_asset:
+            changes[report.commission_asset][0] -= Decimal(report.commission)
+
+        with self.lock:
+            if api_key in self.seeded:
+                for asset, (free, locked) in changes.items():
+                    self._move(api_key, asset, free, locked, report.transaction_time)
+
+    def balances(self, api_key: str) -> Optional[List[dict]]:
+        """Non-zero balances of the account, in the format of the REST API; None when not cached"""
+        with self.lock:
+            if api_key not in self.seeded:
+                return None
+            account = self.accounts[api_key]
+            return [{"asset": asset, "free": f"{free:f}", "locked": f"{locked:f}"}
+                    for asset, (free, locked, _) in sorted(account.items())
+                    if free or locked]
+
+    def free(self, api_key: str, asset: str) -> Optional[Decimal]:
+        """Free balance of an asset, None when the account is not cached"""
+        with self.lock:
+            if api_key not in self.seeded:
+                return None
+            account = self.accounts[api_key]
+            return account[asset][0] if asset in account else Decimal(0)
+
+
+class AccountStream:
+    """User data stream of one account feeding the balance cache, for processes that trade no bot on it"""
+
+    def __init__(self, client: Spot, balances: BalanceCache):
+        self.client = client
+        self.balances = balances
+        self.listen_key: Optional[str] = None
+        self.ws_client: Optional[SpotWebsocketStreamClient] = None
+
+    def start(self):
+        self.listen_key = self.client.new_listen_key()["listenKey"]
+        self.ws_client = SpotWebsocketStreamClient(stream_url=stream_url(), on_message=self._on_message)
+        self.ws_client.user_data(listen_key=self.listen_key)
+        self.balances.stream_opened(self.client.api_key)
+        # Seeded once subscribed, the updates made in between are in the stream
+        self.balances.seed(self.client.api_key, self.client)
+
+    def keepalive(self):
+        """Extend the listen key, which expires after an hour without it, and reseed the balances"""
+        self.client.renew_listen_key(self.listen_key)
+        self.balances.seed(self.client.api_key, self.client, refresh=True)
+
+    def stop(self):
+        if self.ws_client:
+            self.ws_client.stop()
+            self.ws_client = None
+            self.balances.stream_closed(self.client.api_key)
+
+    def _on_message(self, _, raw):
+        message = decode(raw)
+        if isinstance(message, AccountPosition):
+            self.balances.apply(self.client.api_key, message)
@@ -1,81 +1,229 @@
 import asyncio
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set
 from decimal import Decimal
 from binance.websocket.spot.websocket_stream import SpotWebsocketStreamClient
+from sqlalchemy.orm.attributes import set_committed_value
 from ..models import Bot, Order
+from .balance_cache import BalanceCache
+from .event_dispatcher import EventDispatcher
+from .market_data import MarketDataFeed, stream_url
+from .order_writer import OrderWriter
+from .stream_messages import AccountPosition, ExecutionReport, Ticker, decode
+from .stream_recorder import StreamRecorder, user_source
 from .trading_service import TradingService
-from sqlalchemy.orm import Session
-from ..enums import OrderStatusType, SideType, SymbolType
+from ..client_order_ids import parse_client_order_id, tag
+from ..enums import OrderStatusType, SideType
+from ..fixed_point import SYMBOL_ASSETS, from_units, parse_units
 import logging
 import os
 import json
+import threading
+
+ORDER_WRITE_TIMEOUT = float(os.getenv("ORDER_WRITE_TIMEOUT", "5"))
+UNSUBSCRIBE = SpotWebsocketStreamClient.ACTION_UNSUBSCRIBE
 
 class BotEventsHandler:
-    def __init__(self, bot: Bot, trading_service: TradingService, db: Session, listen_key: str):
+    def __init__(self, bot: Bot, trading_service: TradingService, listen_key: str,
+                 order_writer: Optional[OrderWriter] = None, market_data: Optional[MarketDataFeed] = None,
+                 balances: Optional[BalanceCache] = None, recorder: Optional[StreamRecorder] = None,
+                 dispatcher: Optional[EventDispatcher] = None):
         self.bot = bot
         self.trading_service = trading_service
-        self.db = db
-        self.active_symbols: Set[str] = {symbol.value for symbol in SymbolType}
+        self.order_writer = order_writer
+        # Prices come from the engine's shared feed; without one, from tickers on the bot's own connection
+        self.market_data = market_data
+        self.balances = balances  # kept current from the account updates of the user data stream
+        self.recorder = recorder  # of the raw messages of the bot's connection
+        # Runs the events off the websocket threads; without one they are handled as they are read
+        self.dispatcher = dispatcher
+        self.active_symbols: Set[str] = set()  # symbols with a ticker subscription
+        self.subscriptions_lock = threading.Lock()
         self.listen_key = listen_key
+        self.credentials = trading_service.credentials  # the listen key belongs to
+        self.last_event_time = 0  # of the last processed execution report, in ms
         self.ws_client = SpotWebsocketStreamClient(
             stream_url=self._stream_url(),
             on_message=self.message_handler
         )
 
     def _stream_url(self):
-        return "wss://stream.testnet.binance.vision" if os.getenv("BINANCE_TESTNET") else "wss://stream.binance.com"
+        return stream_url()
 
     async def start(self):
         """Start WebSocket connection and subscribe to relevant streams"""
 
         self.ws_client.user_data(listen_key=self.listen_key)
+        if self.balances:
+            self.balances.stream_opened(self.credentials[0])
+        self.sync_subscriptions()
+
+    def trading_symbol(self) -> str:
+        """Symbol traded right now: the one of the running cycle, the bot's own between cycles"""
+        cycle = self.trading_service.cycle
+        return cycle.symbol if cycle else self.trading_service.bot.symbol
+
+    def sync_subscriptions(self):
+        """Subscribe to the tickers the bot needs and drop the others, leaving unchanged ones alone"""
+        with self.subscriptions_lock:
+            wanted = {self.trading_symbol(), self.trading_service.bot.symbol}
+            for symbol in wanted - self.active_symbols:
+                if self.market_data:
+                    self.market_data.subscribe(symbol, self._on_price)
+                else:
+                    self.ws_client.ticker(symbol=symbol)
+            for symbol in self.active_symbols - wanted:
+                if self.market_data:
+                    self.market_data.unsubscribe(symbol, self._on_price)
+                else:
+                    self.ws_client.ticker(symbol=symbol, action=UNSUBSCRIBE)
+            self.active_symbols = wanted
 
-        for symbol in self.active_symbols:
-            self.ws_client.ticker(symbol=symbol)
+    def stop(self):
+        """Close the bot's connection and drop its price subscriptions"""
+        if self.market_data:
+            with self.subscriptions_lock:
+                for symbol in self.active_symbols:
+                    self.market_data.unsubscribe(symbol, self._on_price)
+                self.active_symbols = set()
+        self.ws_client.stop()
+        if self.balances:
+            self.balances.stream_closed(self.credentials[0])
+        if self.dispatcher:
+            self.dispatcher.discard(self.bot.id)
+
+    def change_listen_key(self, listen_key: str):
+        """Move the user data subscription to the listen key of new credentials, on the same connection"""
+        if listen_key == self.listen_key:
+            return
+        self.ws_client.user_data(listen_key=listen_key)
+        self.ws_client.user_data(listen_key=self.listen_key, action=UNSUBSCRIBE)
+        self.listen_key = listen_key
+
+    def sync_listen_key(self):
+        """Follow the trading service onto new credentials, once its running cycle is done with the old ones"""
+        credentials = self.trading_service.credentials
+        if credentials == self.credentials:
+            return
+        self.change_listen_key(self.trading_service.client.new_listen_key()["listenKey"])
+        if self.balances:
+            self.balances.stream_opened(credentials[0])
+            self.balances.stream_closed(self.credentials[0])
+        self.credentials = credentials
+        if self.balances:
+            try:
+                self.balances.seed(self.trading_service.api_key, self.trading_service.client)
+            except Exception as e:
+                logging.error(f"Failed to load the balances of bot {self.bot.id}: {e}")
 
     def message_handler(self, _, msg):
-        json_msg = json.loads(msg)
-        
-        match json_msg.get("e"):
-            case "executionReport":
+        if self.recorder:
+            self.recorder.record(user_source(self.bot.id), msg)
+        message = decode(msg)
+
+        match message:
+            case Ticker():
+                self._on_price(message.symbol, message.price)
+            case ExecutionReport():
                 if os.getenv("ENV") == "development": logging.info(msg)
-                self._handle_execution_report(json_msg)
-            case "24hrTicker":
-                self._handle_price_update(json_msg)
+                self._dispatch(self._handle_execution_report, message, json.loads(msg))
+            case AccountPosition():
+                if self.balances:
+                    self._dispatch(self.balances.apply, self.trading_service.api_key, message)
             case _:
                 if os.getenv("ENV") == "development": logging.info(msg)
 
-    def _handle_price_update(self, msg: dict):
+    def _dispatch(self, function, *args, key=None):
+        """Run an event on the dispatcher's workers, after the earlier events of the bot"""
+        if self.dispatcher:
+            self.dispatcher.dispatch(self.bot.id, function, *args, key=key)
+        else:
+            function(*args)
+
+    def _on_price(self, symbol: str, last_price: str):
+        """Price listener, a pending update of the same symbol is superseded"""
+        self._dispatch(self._handle_price_update, symbol, last_price, key=symbol)
+
+    def _handle_price_update(self, symbol: str, last_price: str):
         """Handle price updates and check if grid needs to be updated"""
-        symbol = msg.get("s")
-        price = Decimal(msg.get("c", 0))
-        
-        if self.bot.symbol == symbol:
-            self.trading_service.check_grid_update(price)
+        if self.trading_symbol() == symbol:
+            price_units = parse_units(last_price)
+            price = from_units(price_units)
+            self.trading_service.publish("price", symbol=symbol, price=price)
+            # Most ticks don't move the grid, those are handled without a database session
+            if self.trading_service.grid_update_due(price_units):
+                with self.trading_service.unit_of_work():
+                    self.trading_service.check_grid_update(price)
+
+    def _handle_execution_report(self, report: ExecutionReport, data: dict):
+        """Process order execution updates and manage take profit orders
+
+        `data` is the whole report as received, kept with the order.
+        """
+        # Before the take profit order is checked against the bought quantity
+        if self.balances and report.symbol in SYMBOL_ASSETS:
+            self.balances.apply_execution(self.trading_service.api_key, report, *SYMBOL_ASSETS[report.symbol])
+        # Bots sharing an account all get its reports, those of the other bots are told apart by their ids
+        own_order = parse_client_order_id(report.orig_client_order_id or report.client_order_id)
+        if own_order and own_order.bot != tag(self.bot.id):
+            return
+
+        with self.trading_service.unit_of_work():
+            self._process_execution_report(report, data)
+            self.last_event_time = max(self.last_event_time, report.event_time)
+        # A completed cycle may have been followed by one on the bot's new symbol or credentials
+        self.sync_subscriptions()
+        self.sync_listen_key()
 
-    def _handle_execution_report(self, msg: dict):
-        """Process order execution updates and manage take profit orders"""
+    def replay(self, exchange_orders: List[dict]):
+        """Process orders as returned by the REST API like execution reports, after a warm restart
 
-        order_id = msg.get("i")
-        status = msg.get("X")
-        quantity_filled = Decimal(msg.get("z"))
+        They are posted like the reports of the stream, after the events already received.
+        """
+        for exchange_order in exchange_orders:
+            report = ExecutionReport(
+                symbol=exchange_order["symbol"], side=exchange_order["side"], status=exchange_order["status"],
+                order_id=exchange_order["orderId"], quantity_filled=exchange_order["executedQty"],
+                client_order_id=exchange_order.get("clientOrderId", ""),
+                event_time=exchange_order.get("updateTime", 0)
+            )
+            self._dispatch(self._handle_execution_report, report, exchange_order)
+
+    def _process_execution_report(self, report: ExecutionReport, data: dict):
+        order_id = report.order_id
+        status = report.status
+        quantity_filled = Decimal(report.quantity_filled)
         
-        # Find order in the database
-        order = self.trading_service.cycle.orders.filter(
-            Order.exchange_order_id == str(order_id)
-        ).first()
+        order = self.trading_service.find_order(report.orig_client_order_id or report.client_order_id, order_id)
 
         if not order:
             logging.info(f"Order not found: {order_id}")
 
         if order and status in ("CANCELED", "PARTIALLY_FILLED", "FILLED"):
             # Update order
-            order.status = status
-            order.quantity_filled = quantity_filled
-            order.exchange_order_data = msg
-            self.db.commit()
+            ticket = self._update_order(order, status=status, quantity_filled=quantity_filled,
+                                        exchange_order_data=data)
+            self.trading_service.publish_order(order)
             
             if order.side == SideType.BUY:
+                self._wait_durable(ticket)  # the take profit order is placed from the stored fills
                 self.trading_service.update_take_profit_order()
             elif order.side == SideType.SELL and status == "FILLED":
+                self._wait_durable(ticket)
                 self.trading_service.check_cycle_completion()
+
+    def _update_order(self, order: Order, **values) -> Optional[int]:
+        """Store an order update, through the group-commit writer when there is one"""
+        if not self.order_writer:
+            for key, value in values.items():
+                setattr(order, key, value)
+            self.trading_service.db.commit()
+            return None
+
+        # Keep the loaded order in line with what will be written, without marking it dirty
+        for key, value in values.items():
+            set_committed_value(order, key, value)
+        return self.order_writer.submit(order.id, **values)
+
+    def _wait_durable(self, ticket: Optional[int]):
+        if ticket is not None:
+            self.order_writer.wait(ticket, timeout=ORDER_WRITE_TIMEOUT)
@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional, Set
+from uuid import UUID
+
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import Bot, BotLease, EngineWorker
+
+
+class BotLeaseCoordinator:
+    """Shares the active bots between engine workers through leases stored in Postgres
+
+    Every heartbeat the worker renews its leases, computes its fair share of the active bots
+    among the live workers, claims free or expired leases up to that share and gives up the
+    ones above it. All lease times use the database clock. A worker stops trading its bots as
+    soon as it could not renew their leases for `ttl - safety_margin` seconds (measured locally),
+    before any other worker is allowed to take them over, so a bot is never owned twice. A
+    draining worker gives up all its bots and isn't counted in the fair share of the others.
+    """
+
+    def __init__(
+        self,
+        worker_id: str,
+        bot_manager,
+        session_factory: Callable[[], Session] = SessionLocal,
+        ttl: float = 30,
+        heartbeat_interval: float = 10,
+        safety_margin: float = 5
+    ):
+        # A heartbeat may take up to an interval, then the next one starts an interval later
+        if 2 * heartbeat_interval >= ttl - safety_margin:
+            raise ValueError(f"The lease heartbeat interval ({heartbeat_interval}s) must be less than half "
+                             f"of the lease ttl minus the safety margin ({ttl}s - {safety_margin}s)")
+        self.worker_id = worker_id
+        self.bot_manager = bot_manager
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl)
+        self.heartbeat_interval = heartbeat_interval
+        self.safety_margin = safety_margin
+        self.draining = False
+        self.owned: Set[UUID] = set()
+        self.valid_until: Optional[float] = None  # local monotonic deadline of the owned leases
+        self.expiry: Optional[asyncio.TimerHandle] = None
+        self.running = False
+
+    @staticmethod
+    def _db_now(db: Session) -> datetime:
+        now = db.execute(select(func.current_timestamp())).scalar()
+        if isinstance(now, datetime) and now.tzinfo:
+            now = now.astimezone(timezone.utc).replace(tzinfo=None)
+        return now
+
+    def heartbeat(self) -> Set[UUID]:
+        """Renew, rebalance and claim leases, return the ids of the bots this worker owns"""
+        started = time.monotonic()
+        db = self.session_factory()
+        try:
+            now = self._db_now(db)
+            expires_at = now + self.ttl
+
+            worker = db.get(EngineWorker, self.worker_id) or EngineWorker(id=self.worker_id)
+            worker.heartbeat_at = now
+            worker.draining = self.draining
+            db.add(worker)
+
+            # Leases of stopped bots are not needed anymore
+            active_bots = set(db.execute(select(Bot.id).where(Bot.is_active)).scalars())
+            db.execute(delete(BotLease).where(BotLease.worker_id == self.worker_id,
+                                              BotLease.bot_id.not_in(active_bots)))
+
+            db.execute(update(BotLease).where(BotLease.worker_id == self.worker_id,
+                                              BotLease.expires_at > now).values(expires_at=expires_at))
+            owned = set(db.execute(select(BotLease.bot_id).where(BotLease.worker_id == self.worker_id,
+                                                                 BotLease.expires_at == expires_at)).scalars())
+            db.commit()
+
+            live_workers = db.execute(select(func.count()).select_from(EngineWorker).where(
+                EngineWorker.heartbeat_at > now - self.ttl,
+                EngineWorker.draining.is_(False)
+            )).scalar()
+            fair_share = 0 if self.draining else math.ceil(len(active_bots) / max(live_workers, 1))
+
+            if len(owned) > fair_share:
+                released = set(sorted(owned, key=str)[fair_share:])
+                self._release(db, released)
+                owned -= released
+            elif len(owned) < fair_share:
+                owned |= self._claim(db, now, expires_at, active_bots - owned, fair_share - len(owned))
+
+            self.owned = owned
+            self.valid_until = started + self.ttl.total_seconds() - self.safety_margin
+            return owned
+        finally:
+            db.close()
+
+    def _claim(self, db: Session, now: datetime, expires_at: datetime, candidates: Set[UUID], limit: int) -> Set[UUID]:
+        taken = {
+            lease.bot_id: lease.expires_at
+            for lease in db.execute(select(BotLease).where(BotLease.bot_id.in_(candidates))).scalars()
+        }
+        claimed = set()
+        for bot_id in sorted(candidates, key=str):
+            if len(claimed) >= limit:
+                break
+            if bot_id not in taken:
+                db.add(BotLease(bot_id=bot_id, worker_id=self.worker_id, expires_at=expires_at))
+                try:
+                    db.commit()
+                except IntegrityError:  # another worker claimed it first
+                    db.rollback()
+                    continue
+            elif taken[bot_id] < now:
+                # Compare-and-set on the expired lease, only one worker can win it
+                result = db.execute(update(BotLease).where(BotLease.bot_id == bot_id, BotLease.expires_at < now)
+                                    .values(worker_id=self.worker_id, expires_at=expires_at))
+                db.commit()
+                if result.rowcount != 1:
+                    continue
+            else:
+                continue
+            claimed.add(bot_id)
+        return claimed
+
+    def _release(self, db: Session, bot_ids: Set[UUID]):
+        # Stop trading first, only then let other workers claim the bots
+        for bot_id in bot_ids:
+            self.bot_manager.release_id(bot_id)
+        db.execute(delete(BotLease).where(BotLease.worker_id == self.worker_id, BotLease.bot_id.in_(bot_ids)))
+        db.commit()
+
+    def leave(self):
+        """Release every bot and remove the worker so that the others take over right away"""
+        self.bot_manager.release_all(keep_snapshots=True)  # written for the next start of the engine
+        self.owned = set()
+        db = self.session_factory()
+        try:
+            db.execute(delete(BotLease).where(BotLease.worker_id == self.worker_id))
+            db.execute(delete(EngineWorker).where(EngineWorker.id == self.worker_id))
+            db.commit()
+        finally:
+            db.close()
+
+    def _expire(self):
+        logging.error(f"Leases of worker {self.worker_id} could not be renewed in time, releasing its bots")
+        self.bot_manager.release_all()
+        self.owned = set()
+        self.valid_until = None
+        self.expiry = None
+
+    def _schedule_expiry(self):
+        # On a timer rather than in the loop, which may be stuck in a heartbeat past the deadline
+        if self.expiry:
+            self.expiry.cancel()
+        self.expiry = asyncio.get_running_loop().call_later(self.valid_until - time.monotonic(), self._expire)
+
+    async def run(self):
+        self.running = True
+        while self.running:
+            try:
+                owned = await asyncio.wait_for(asyncio.to_thread(self.heartbeat), timeout=self.heartbeat_interval)
+                self._schedule_expiry()
+                await self.bot_manager.sync(owned)
+            except Exception as e:
+                logging.error(f"Lease heartbeat of worker {self.worker_id} failed: {e!r}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    async def drain(self):
+        """Hand every bot over to the other workers, which stop counting this one right away"""
+        self.draining = True
+        owned = await asyncio.to_thread(self.heartbeat)
+        await self.bot_manager.sync(owned)
+
+    async def stop(self):
+        self.running = False
+        if self.expiry:
+            self.expiry.cancel()
+        await asyncio.to_thread(self.leave)
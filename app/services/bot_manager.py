@@ -1,11 +1,20 @@
 import asyncio
-from typing import Type, Optional
+import logging
+from typing import Optional, Set, Type
+from uuid import UUID
 
 from sqlalchemy.orm import Session
 
-from ..database import get_db
+from ..database import EngineSessionLocal
 from ..models import Bot
+from .balance_cache import BalanceCache
 from .bot_events_handler import BotEventsHandler
+from .engine_events import EngineEvents
+from .engine_snapshots import EngineSnapshots
+from .event_dispatcher import EventDispatcher
+from .market_data import MarketDataFeed
+from .order_writer import OrderWriter
+from .stream_recorder import StreamRecorder
 from .trading_service import TradingService
 
 
@@ -14,11 +23,25 @@ class BotManager:
         self,
         trading_service_class: Type[TradingService] = TradingService,
         events_handler_class: Type[BotEventsHandler] = BotEventsHandler,
-        db: Optional[Session] = None
+        db: Optional[Session] = None,
+        order_writer: Optional[OrderWriter] = None,
+        events: Optional[EngineEvents] = None,
+        market_data: Optional[MarketDataFeed] = None,
+        snapshots: Optional[EngineSnapshots] = None,
+        balances: Optional[BalanceCache] = None,
+        recorder: Optional[StreamRecorder] = None,
+        dispatcher: Optional[EventDispatcher] = None
     ):
         self.trading_service_class = trading_service_class
         self.events_handler_class = events_handler_class
         self.db = db
+        self.order_writer = order_writer
+        self.events = events
+        self.market_data = market_data
+        self.snapshots = snapshots
+        self.balances = balances
+        self.recorder = recorder
+        self.dispatcher = dispatcher
         self.active_bots = []
         self.events_handlers = {}
 
@@ -26,30 +49,137 @@ class BotManager:
         if not bot.is_active:
             return
 
-        db = self.db or next(get_db())
-        bot = db.merge(bot)
-
-        self.active_bots.append(bot)
-        trading_service = self.trading_service_class(db=db, bot=bot)
-        listen_key = trading_service.client.new_listen_key()["listenKey"]
-
-        trading_service.launch(lambda bot: self.release(bot))
+        # The warmup blocks on the exchange (listen key, prices, the orders of a new cycle), so it
+        # runs on a thread: the bots warm up side by side and the event loop keeps serving meanwhile
+        bot, trading_service, listen_key, snapshot, changed_orders = await asyncio.to_thread(self._warm_up, bot)
+        if not trading_service.bot.is_active:  # the last cycle was over, launch() stopped the bot
+            return
 
         events_handler = self.events_handler_class(
-            bot=bot, trading_service=trading_service, db=db, listen_key=listen_key
+            bot=bot, trading_service=trading_service, listen_key=listen_key, order_writer=self.order_writer,
+            market_data=self.market_data, balances=self.balances, recorder=self.recorder,
+            dispatcher=self.dispatcher
         )
         self.events_handlers[bot.id] = events_handler
         await events_handler.start()
+        if self.balances:  # once the stream is subscribed, so that no update is missed
+            try:
+                await asyncio.to_thread(self.balances.seed, trading_service.bot.api_key, trading_service.client)
+            except Exception as e:
+                logging.error(f"Failed to load the balances of bot {bot.id}: {e}")
+
+        if changed_orders is not None:  # warm restart, only catch up with what changed since the snapshot
+            events_handler.last_event_time = snapshot.get("last_event_time", 0)
+            events_handler.replay(changed_orders)
+
+    def _warm_up(self, bot: Bot):
+        """Load the bot's state, from its snapshot or by launching it, and get its listen key"""
+        # A shared session is only given in tests; otherwise every handled event gets its own
+        # short-lived session, so open connections are bounded by concurrency, not by bot count
+        session_factory = None if self.db else EngineSessionLocal
+        db = self.db or EngineSessionLocal()
+        try:
+            # The engine loads the bot as stored: a merged copy counts as modified, which the unit of
+            # work can't re-bind to its sessions
+            bot = db.merge(bot) if self.db else db.get(Bot, bot.id)
+            trading_service = self.trading_service_class(db=db, bot=bot, session_factory=session_factory,
+                                                         events=self.events, balances=self.balances,
+                                                         snapshots=self.snapshots)
+        finally:
+            if session_factory:
+                db.close()
+
+        self.active_bots.append(bot)
+        snapshot = self.snapshots.read(bot.id) if self.snapshots else None
+        changed_orders = None
+        with trading_service.unit_of_work():
+            listen_key = trading_service.client.new_listen_key()["listenKey"]
+            if snapshot:
+                changed_orders = trading_service.restore(snapshot)
+            if changed_orders is None:
+                trading_service.launch(lambda bot: self.release(bot))
+            trading_service.publish_snapshot()
+        return bot, trading_service, listen_key, snapshot, changed_orders
+
+    def save_snapshots(self):
+        """Write the snapshot of every running bot"""
+        for bot_id, events_handler in list(self.events_handlers.items()):
+            trading_service = events_handler.trading_service
+            try:
+                with trading_service.unit_of_work():
+                    state = trading_service.snapshot_state()
+                self.snapshots.write(bot_id, {**state, "last_event_time": events_handler.last_event_time})
+            except Exception as e:
+                logging.error(f"Failed to write the snapshot of bot {bot_id}: {e}")
+
+    def reseed_balances(self):
+        """Load the balances of the accounts of the running bots again, in case stream events were missed"""
+        # Once per account, through any of its bots
+        accounts = {events_handler.trading_service.api_key: events_handler
+                    for events_handler in list(self.events_handlers.values())}
+        for api_key, events_handler in accounts.items():
+            try:
+                self.balances.seed(api_key, events_handler.trading_service.client, refresh=True)
+            except Exception as e:
+                logging.error(f"Failed to reload the balances of bot {events_handler.bot.id}: {e}")
 
     async def install_bots(self, bots):
         await asyncio.gather(*(self.install(bot) for bot in bots))
 
-    def release(self, bot):
-        ws_manager = self.events_handlers[bot.id]
-        ws_manager.ws_client.stop()
-        del self.events_handlers[bot.id]
-        self.active_bots.remove(bot)
+    async def sync(self, bot_ids: Set[UUID]):
+        """Run exactly the given bots: release the ones not listed, install the missing ones"""
+        for bot in list(self.active_bots):
+            if bot.id not in bot_ids:
+                self.release(bot)
+
+        missing = bot_ids - {bot.id for bot in self.active_bots}
+        if not missing:
+            return
+
+        db = self.db or EngineSessionLocal()
+        try:
+            bots = db.query(Bot).filter(Bot.id.in_(missing)).all()
+        finally:
+            if not self.db:
+                db.close()
+
+        results = await asyncio.gather(*(self.install(bot) for bot in bots), return_exceptions=True)
+        for bot, result in zip(bots, results):
+            if isinstance(result, Exception):
+                logging.error(f"Failed to install bot {bot.id}: {result}")
+                self.release(bot)
+
+    def reconfigure(self, bot_id: UUID) -> Optional[Set[str]]:
+        """Apply the settings of a running bot changed in the database without reinstalling it
+
+        Returns the changed settings, or None if the bot isn't running here. Only the affected
+        subscriptions of the bot's stream move; the connection and the trading state are kept.
+        """
+        events_handler = self.events_handlers.get(bot_id)
+        if not events_handler:
+            return None
+
+        trading_service = events_handler.trading_service
+        changed = trading_service.reload_bot()
+        if changed & {"api_key", "api_secret"}:
+            events_handler.sync_listen_key()
+        if "symbol" in changed:
+            events_handler.sync_subscriptions()
+        return changed
+
+    def release_id(self, bot_id: UUID):
+        self.release(next((bot for bot in self.active_bots if bot.id == bot_id), Bot(id=bot_id)))
+
+    def release(self, bot, keep_snapshot: bool = False):
+        """Stop running the bot here, its snapshot is only kept for a warm restart of the engine"""
+        events_handler = self.events_handlers.pop(bot.id, None)
+        if events_handler:
+            events_handler.stop()
+        # Bot objects are re-bound to a new session on every event, so match them by id
+        self.active_bots = [active_bot for active_bot in self.active_bots if active_bot.id != bot.id]
+        if self.snapshots and not keep_snapshot:
+            self.snapshots.remove(bot.id)
 
-    def release_all(self):
+    def release_all(self, keep_snapshots: bool = False):
         for bot in reversed(self.active_bots):
-            self.release(bot)
+            self.release(bot, keep_snapshots)
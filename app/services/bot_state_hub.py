@@ -0,0 +1,130 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Optional, Set
+from uuid import UUID
+
+from ..enums import OrderStatusType, SideType
+
+OPEN_STATUSES = (OrderStatusType.NEW, OrderStatusType.PARTIALLY_FILLED)
+
+
+def encode(message: dict) -> str:
+    return json.dumps(message, default=str)
+
+
+class BotStateHub:
+    """Latest known state of every bot, kept from engine events and pushed to dashboard subscribers
+
+    Each engine event is folded into the bot's state and the resulting delta is sent, encoded
+    once, to every open subscription of that bot. New subscribers start from `snapshot`, so
+    open dashboards never have to query the database.
+    """
+
+    def __init__(self, queue_size: int = 1000):
+        self.queue_size = queue_size
+        self.states: Dict[UUID, dict] = {}
+        self.subscribers: Dict[UUID, Set[asyncio.Queue]] = defaultdict(set)
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        """Set the event loop serving the subscriptions, deltas are handed over to it from engine threads"""
+        self.loop = loop
+
+    def publish(self, bot_id: UUID, event: str, data: dict):
+        with self.lock:
+            state = self.states.setdefault(bot_id, self._empty_state())
+            delta = self._apply(state, event, data)
+
+        if delta and self.loop and self.subscribers.get(bot_id):
+            self.loop.call_soon_threadsafe(self._fanout, bot_id, encode(delta))
+
+    def snapshot(self, bot_id: UUID) -> dict:
+        with self.lock:
+            return self._snapshot(self.states.get(bot_id) or self._empty_state())
+
+    def subscribe(self, bot_id: UUID) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[bot_id].add(queue)
+        return queue
+
+    def unsubscribe(self, bot_id: UUID, queue: asyncio.Queue):
+        self.subscribers[bot_id].discard(queue)
+        if not self.subscribers[bot_id]:
+            del self.subscribers[bot_id]
+
+    def _fanout(self, bot_id: UUID, message: str):
+        for queue in list(self.subscribers.get(bot_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A subscriber that can't keep up gets a fresh snapshot instead of the backlog
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(encode(self.snapshot(bot_id)))
+
+    @staticmethod
+    def _empty_state() -> dict:
+        return {"cycle": None, "orders": {}, "price": None, "position": None}
+
+    def _apply(self, state: dict, event: str, data: dict) -> Optional[dict]:
+        match event:
+            case "snapshot":
+                state["cycle"] = data.get("cycle")
+                state["orders"] = {order["id"]: order for order in data.get("orders", [])}
+                state["position"] = None
+                return self._snapshot(state)
+            case "cycle":
+                if not state["cycle"] or state["cycle"]["id"] != data["id"]:
+                    state["orders"] = {}  # a new cycle starts without orders
+                    state["position"] = None
+                state["cycle"] = data
+                return {"type": "cycle", "cycle": data, **self._position(state)}
+            case "order":
+                state["orders"][data["id"]] = data
+                state["position"] = None
+                return {"type": "order", "order": data, **self._position(state)}
+            case "price":
+                if state["price"] == data["price"]:
+                    return None
+                state["price"] = data["price"]
+                return {"type": "price", "price": data["price"], **self._position(state)}
+        return None
+
+    def _snapshot(self, state: dict) -> dict:
+        return {
+            "type": "snapshot",
+            "cycle": state["cycle"],
+            "orders": list(state["orders"].values()),
+            "price": state["price"],
+            **self._position(state),
+        }
+
+    def _position(self, state: dict) -> dict:
+        """Held quantity, average entry, take profit price and unrealized PnL of the current cycle"""
+        if state["position"] is None:
+            bought = cost = sold = Decimal(0)
+            take_profit_price = None
+            for order in state["orders"].values():
+                filled = Decimal(order["quantity_filled"])
+                if order["side"] == SideType.BUY:
+                    bought += filled
+                    cost += filled * Decimal(order["price"])
+                else:
+                    sold += filled
+                    if order["status"] in OPEN_STATUSES:
+                        take_profit_price = order["price"]
+            state["position"] = {
+                "quantity": bought - sold,
+                "average_price": round(cost / bought, 8) if bought else None,
+                "take_profit_price": take_profit_price,
+            }
+
+        position = state["position"]
+        unrealized_pnl = None
+        if state["price"] is not None and position["average_price"] is not None:
+            unrealized_pnl = round((Decimal(state["price"]) - position["average_price"]) * position["quantity"], 2)
+        return {**position, "unrealized_pnl": unrealized_pnl}
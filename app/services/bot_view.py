@@ -0,0 +1,114 @@
+import threading
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Dict, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, case, func, select, union_all
+from sqlalchemy.orm import Session
+
+from ..enums import CycleStatusType, OrderStatusType, SideType
+from ..models import Bot, Order, OrderArchive, TradingCycle
+
+
+@dataclass
+class BotView:
+    bot: Bot
+    cycle: Optional[TradingCycle]
+    completed_cycles: int
+    profit: Decimal
+    mismatched_cycles: int  # completed cycles whose sells don't match the bought quantity, left out of `profit`
+
+
+class BotQueries:
+    """Read side for pages and APIs: loads what a bot page shows without a TradingService or exchange client"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def bot_view(self, bot_id: UUID) -> Optional[BotView]:
+        row = self.db.execute(
+            select(Bot, TradingCycle)
+            .outerjoin(TradingCycle, and_(TradingCycle.bot_id == Bot.id,
+                                          TradingCycle.status == CycleStatusType.ACTIVE))
+            .where(Bot.id == bot_id)
+        ).first()
+        if not row:
+            return None
+
+        bot, cycle = row
+        completed_cycles, profit, mismatched_cycles = self.completed_cycles_stats(bot_id)
+        return BotView(bot=bot, cycle=cycle, completed_cycles=completed_cycles, profit=profit,
+                       mismatched_cycles=mismatched_cycles)
+
+    def completed_cycles_stats(self, bot_id: UUID):
+        """Count and total profit of the bot's completed cycles in one aggregate query
+
+        Profit is computed like TradingCycle.profit(), over both the hot and the archived orders.
+        """
+        completed = select(TradingCycle.id).where(
+            TradingCycle.bot_id == bot_id,
+            TradingCycle.status == CycleStatusType.COMPLETED
+        ).scalar_subquery()
+        orders = union_all(*(
+            select(model.cycle_id, model.side, model.status, model.price, model.quantity_filled)
+            .where(model.cycle_id.in_(completed))
+            for model in (Order, OrderArchive)
+        )).subquery()
+
+        is_buy = and_(orders.c.side == SideType.BUY,
+                      orders.c.status.in_([OrderStatusType.FILLED, OrderStatusType.PARTIALLY_FILLED]))
+        is_sell = orders.c.side == SideType.SELL
+        rows = self.db.execute(
+            select(
+                TradingCycle.quantity,
+                func.coalesce(func.sum(case((is_buy, orders.c.price * orders.c.quantity_filled), else_=0)), 0),
+                func.coalesce(func.sum(case((is_sell, orders.c.price * orders.c.quantity_filled), else_=0)), 0),
+                func.coalesce(func.sum(case((is_sell, orders.c.quantity_filled), else_=0)), 0),
+            )
+            .outerjoin(orders, orders.c.cycle_id == TradingCycle.id)
+            .where(TradingCycle.bot_id == bot_id, TradingCycle.status == CycleStatusType.COMPLETED)
+            .group_by(TradingCycle.id, TradingCycle.quantity)
+        ).all()
+
+        profit = Decimal(0)
+        mismatched = 0
+        for quantity, bought, sold, sold_quantity in rows:
+            if Decimal(sold_quantity) != quantity:
+                mismatched += 1
+            else:
+                profit += round(Decimal(sold) - Decimal(bought), 2)
+
+        return len(rows), profit, mismatched
+
+
+class ViewCache:
+    """Rendered page fragments per bot, dropped whenever the engine changes the bot's orders or cycle
+
+    A fragment rendered from data read before an invalidation would put the stale page back, so
+    callers take the bot's generation before reading and `put` drops fragments of an older one.
+    """
+
+    def __init__(self):
+        self.fragments: Dict[UUID, str] = {}
+        self.generations: Dict[UUID, int] = {}
+        self.lock = threading.Lock()
+
+    def get(self, bot_id: UUID) -> Optional[str]:
+        return self.fragments.get(bot_id)
+
+    def generation(self, bot_id: UUID) -> int:
+        return self.generations.get(bot_id, 0)
+
+    def put(self, bot_id: UUID, fragment: str, generation: int):
+        with self.lock:
+            if self.generations.get(bot_id, 0) == generation:
+                self.fragments[bot_id] = fragment
+
+    def invalidate(self, bot_id: UUID, event: str = None, data: dict = None):
+        """Engine event listener; price ticks don't change what the pages show"""
+        if event == "price":
+            return
+        with self.lock:
+            self.generations[bot_id] = self.generations.get(bot_id, 0) + 1
+            self.fragments.pop(bot_id, None)
@@ -0,0 +1,153 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+from uuid import UUID
+
+import psycopg2
+from sqlalchemy import func, select as sql_select
+from sqlalchemy.engine import Engine
+
+from ..database import engine as database_engine
+from .bot_state_hub import encode
+
+COMMANDS_CHANNEL = "bot_commands"
+EVENTS_CHANNEL = "engine_events"
+
+# Postgres refuses NOTIFY payloads of 8000 bytes or more
+MAX_PAYLOAD = 7900
+
+Handler = Callable[[dict], None]
+
+
+class ControlBus:
+    """Messages between the web tier and the trading engine over Postgres LISTEN/NOTIFY
+
+    The web tier sends bot commands ("start", "stop", "update", "snapshot") on the
+    bot_commands channel; the engine sends its engine events back on engine_events.
+    Messages are JSON objects. They are sent from a background thread, several per
+    transaction, and received on a dedicated connection that reconnects by itself;
+    `on_connect` callbacks run after every (re)connection so that receivers can catch
+    up on what they may have missed.
+    """
+
+    def __init__(self, engine: Engine = database_engine, poll_interval: float = 1, reconnect_delay: float = 1):
+        self.engine = engine
+        self.dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+        self.handlers: Dict[str, List[Handler]] = defaultdict(list)
+        self.on_connect: List[Callable[[], None]] = []
+        self.outbox: queue.SimpleQueue = queue.SimpleQueue()
+        self.threads: List[threading.Thread] = []
+        self.running = False
+
+    def subscribe(self, channel: str, handler: Handler):
+        self.handlers[channel].append(handler)
+
+    def start(self):
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self._listen, name="control-bus-listener", daemon=True),
+            threading.Thread(target=self._send, name="control-bus-sender", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.outbox.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def send(self, channel: str, message: dict):
+        payload = encode(message)
+        if len(payload.encode()) > MAX_PAYLOAD:
+            raise ValueError(f"Message too large for {channel}: {len(payload)} bytes")
+        self.outbox.put((channel, payload))
+
+    def send_command(self, command: str, bot_id: Optional[UUID] = None):
+        self.send(COMMANDS_CHANNEL, {"command": command, "bot_id": str(bot_id) if bot_id else None})
+
+    def publish_event(self, bot_id: UUID, event: str, data: dict):
+        """Engine event listener forwarding the events to the web tier"""
+        message = {"bot_id": str(bot_id), "event": event, "data": data}
+        if event == "snapshot" and len(encode(message).encode()) > MAX_PAYLOAD:
+            # Send a large snapshot as the bare cycle followed by its orders one by one
+            self.send(EVENTS_CHANNEL, {**message, "data": {**data, "orders": []}})
+            for order in data.get("orders", []):
+                self.send(EVENTS_CHANNEL, {"bot_id": str(bot_id), "event": "order", "data": order})
+            return
+        self.send(EVENTS_CHANNEL, message)
+
+    def _dispatch(self, channel: str, payload: str):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            logging.error(f"Ignoring malformed message on {channel}: {payload[:200]}")
+            return
+
+        for handler in self.handlers.get(channel, ()):
+            try:
+                handler(message)
+            except Exception as e:
+                logging.error(f"Control bus handler failed on {channel}: {e}")
+
+    def _send(self):
+        while True:
+            item = self.outbox.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= 100:
+                    break
+                try:
+                    item = self.outbox.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                try:
+                    with self.engine.begin() as connection:
+                        for channel, payload in batch:
+                            connection.execute(sql_select(func.pg_notify(channel, payload)))
+                except Exception as e:
+                    logging.error(f"Failed to send {len(batch)} control bus messages: {e}")
+
+            if item is None and not self.running:
+                return
+
+    def _listen(self):
+        while self.running:
+            connection = None
+            try:
+                connection = psycopg2.connect(self.dsn)
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    for channel in self.handlers:
+                        cursor.execute(f'LISTEN "{channel}"')
+
+                for callback in self.on_connect:
+                    try:
+                        callback()
+                    except Exception as e:
+                        logging.error(f"Control bus connect callback failed: {e}")
+
+                while self.running:
+                    if select.select([connection], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        notify = connection.notifies.pop(0)
+                        self._dispatch(notify.channel, notify.payload)
+            except Exception as e:
+                logging.error(f"Control bus connection lost: {e}")
+                time.sleep(self.reconnect_delay)
+            finally:
+                if connection is not None:
+                    connection.close()
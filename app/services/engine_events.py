@@ -0,0 +1,26 @@
+import logging
+from typing import Callable, List
+from uuid import UUID
+
+Listener = Callable[[UUID, str, dict], None]
+
+
+class EngineEvents:
+    """In-process fan-out of the state changes the trading engine makes to its bots
+
+    Events are published from the websocket threads as the engine processes them:
+    "order", "cycle", "price" and "snapshot", each with a plain dict of values.
+    """
+
+    def __init__(self):
+        self.listeners: List[Listener] = []
+
+    def subscribe(self, listener: Listener):
+        self.listeners.append(listener)
+
+    def publish(self, bot_id: UUID, event: str, data: dict):
+        for listener in self.listeners:
+            try:
+                listener(bot_id, event, data)
+            except Exception as e:
+                logging.error(f"Engine event listener failed on {event} for bot {bot_id}: {e}")
@@ -0,0 +1,59 @@
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import Optional
+from uuid import UUID
+
+# Bumped whenever the content of the snapshots changes, older snapshots are then ignored
+SNAPSHOT_VERSION = 1
+
+
+class EngineSnapshots:
+    """Per bot snapshots of the engine's in-memory state, for warm restarts
+
+    A snapshot holds the bot's active cycle, its open orders as last seen by the engine,
+    the cycle's ledger totals, the grid trigger price and the time of the last processed
+    execution report. It is one small JSON file per bot, replaced atomically.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, bot_id: UUID) -> str:
+        return os.path.join(self.directory, f"{bot_id}.json")
+
+    def write(self, bot_id: UUID, state: dict):
+        snapshot = {"version": SNAPSHOT_VERSION, "bot_id": str(bot_id), "written_at": datetime.now().isoformat(),
+                    **state}
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(snapshot, file, default=str, separators=(",", ":"))
+            os.replace(tmp_path, self.path(bot_id))
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    def read(self, bot_id: UUID) -> Optional[dict]:
+        try:
+            with open(self.path(bot_id)) as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logging.error(f"Ignoring unreadable snapshot of bot {bot_id}: {e}")
+            return None
+
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            logging.info(f"Ignoring snapshot of bot {bot_id} with version {snapshot.get('version')}")
+            return None
+        return snapshot
+
+    def remove(self, bot_id: UUID):
+        try:
+            os.remove(self.path(bot_id))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Hashable, List, Optional
+from uuid import UUID
+
+
+class Mailbox:
+    """Pending events of one bot, with the statistics of its queue"""
+
+    def __init__(self, bot_id: UUID):
+        self.bot_id = bot_id
+        self.events: Deque[list] = deque()  # [enqueued at, function or None once superseded, args, key]
+        self.latest: Dict[Hashable, list] = {}  # pending event by key, for coalescing
+        self.scheduled = False  # in the run queue, or being run by a worker
+        self.discarded = False  # to be removed once no worker holds it anymore
+        self.depth = 0  # pending events, the superseded ones excluded
+        self.processed = 0
+        self.coalesced = 0
+        self.last_wait = 0.0  # seconds the last event run waited in the queue
+        self.max_wait = 0.0
+
+
+class EventDispatcher:
+    """Runs the events of the bots on a pool of worker threads, in order for each bot
+
+    The websocket threads only decode the messages and post them here, so that a slow
+    exchange request or database write never holds up the reading of a socket. A bot with
+    pending events is in the run queue once, and taken by one worker at a time: the events
+    of a bot run one after the other, those of different bots in parallel. A worker runs
+    at most `batch` events of a bot before giving way to the next one.
+
+    Events posted with a key supersede the pending event with the same key, e.g. a price
+    update the previous one is not worth handling anymore.
+    """
+
+    def __init__(self, workers: int = 8, batch: int = 32):
+        self.workers = workers
+        self.batch = batch
+        self.mailboxes: Dict[UUID, Mailbox] = {}
+        self.ready: Deque[Mailbox] = deque()
+        self.condition = threading.Condition()
+        self.threads: List[threading.Thread] = []
+        self.running = False
+        self.stopped = False
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._run, name=f"event-worker-{i}", daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Run the events already posted, then stop the workers; later events are dropped"""
+        with self.condition:
+            self.running = False
+            self.stopped = True
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def dispatch(self, bot_id: UUID, function: Callable, *args, key: Optional[Hashable] = None):
+        with self.condition:
+            if self.stopped:
+                return
+            mailbox = self.mailboxes.get(bot_id)
+            if mailbox is None:
+                mailbox = self.mailboxes[bot_id] = Mailbox(bot_id)
+            mailbox.discarded = False
+            event = [time.monotonic(), function, args, key]
+            if key is not None:
+                superseded = mailbox.latest.get(key)
+                if superseded:
+                    superseded[1] = None
+                    mailbox.depth -= 1
+                    mailbox.coalesced += 1
+                mailbox.latest[key] = event
+            mailbox.events.append(event)
+            mailbox.depth += 1
+            if not mailbox.scheduled:
+                mailbox.scheduled = True
+                self.ready.append(mailbox)
+                self.condition.notify()
+
+    def discard(self, bot_id: UUID):
+        """Drop the pending events and the queue of a bot, the event being run completes"""
+        with self.condition:
+            mailbox = self.mailboxes.get(bot_id)
+            if mailbox:
+                mailbox.events.clear()
+                mailbox.latest.clear()
+                mailbox.depth = 0
+                # A scheduled mailbox is kept until its worker is done, so that the events of
+                # the bot posted meanwhile still run after it
+                if mailbox.scheduled:
+                    mailbox.discarded = True
+                else:
+                    del self.mailboxes[bot_id]
+
+    def _take(self, mailbox: Mailbox) -> List[list]:
+        now = time.monotonic()
+        events = []
+        while mailbox.events and len(events) < self.batch:
+            event = mailbox.events.popleft()
+            if event[1] is None:
+                continue
+            if event[3] is not None and mailbox.latest.get(event[3]) is event:
+                del mailbox.latest[event[3]]
+            mailbox.depth -= 1
+            mailbox.last_wait = now - event[0]
+            mailbox.max_wait = max(mailbox.max_wait, mailbox.last_wait)
+            events.append(event)
+        return events
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.ready or not self.running)
+                if not self.ready:
+                    return
+                mailbox = self.ready.popleft()
+                events = self._take(mailbox)
+
+            for _, function, args, _ in events:
+                try:
+                    function(*args)
+                except Exception as e:
+                    logging.error(f"Event of bot {mailbox.bot_id} failed: {e}")
+
+            with self.condition:
+                mailbox.processed += len(events)
+                if mailbox.events:
+                    self.ready.append(mailbox)
+                    self.condition.notify()
+                else:
+                    mailbox.scheduled = False
+                    if mailbox.discarded:
+                        del self.mailboxes[mailbox.bot_id]
+
+    def stats(self) -> Dict[UUID, dict]:
+        """Queue of every bot: pending events, how long the oldest one has waited, and past waits (seconds)"""
+        now = time.monotonic()
+        with self.condition:
+            return {
+                bot_id: {
+                    "depth": mailbox.depth,
+                    "oldest_wait": next((now - event[0] for event in mailbox.events if event[1]), 0.0),
+                    "last_wait": mailbox.last_wait,
+                    "max_wait": mailbox.max_wait,
+                    "processed": mailbox.processed,
+                    "coalesced": mailbox.coalesced,
+                }
+                for bot_id, mailbox in self.mailboxes.items()
+            }
@@ -0,0 +1,341 @@
+"""Retries, timeouts and hedging of the exchange REST calls
+
+ExchangeClient wraps a Spot client and applies the RetryPolicy of each endpoint to its
+calls. Failures are classified before they are retried:
+
+- rejected: the exchange did not act on the request (rate limits, clock skew, connection
+  not established), any call can be sent again;
+- unknown outcome: timeouts, 5xx and the exchange's own internal timeouts. Only calls
+  that are idempotent are sent again: reads, orders with a client order id, which are
+  looked up before they are resent, and cancels, whose "unknown order" answer is checked
+  against the order's state.
+
+Anything else (invalid parameters, insufficient balance...) is raised at once.
+
+The Spot clients themselves come from the ClientRegistry, one per account, so that the bots
+of an account and the page views share its keep-alive connections.
+"""
+import copy
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures import wait
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+import requests
+from binance.error import ClientError, ServerError
+from binance.spot import Spot
+
+from .price_history import RingBuffer
+
+REJECTED, UNKNOWN_OUTCOME = "rejected", "unknown outcome"
+
+RATE_LIMITED = (-1003, -1015)  # too many requests, too many orders
+REJECTED_CODES = RATE_LIMITED + (-1021,)  # and timestamp outside of the receive window
+UNKNOWN_OUTCOME_CODES = (-1001, -1006, -1007)  # disconnected, unexpected response, timeout waiting for the backend
+NEW_ORDER_REJECTED = -2010
+UNKNOWN_ORDER = -2011
+NO_SUCH_ORDER = -2013
+
+
+def classify(error: Exception) -> Optional[str]:
+    """REJECTED or UNKNOWN_OUTCOME for the transient errors, None for the others"""
+    if isinstance(error, ClientError):
+        if error.status_code == 429 or error.error_code in REJECTED_CODES:
+            return REJECTED
+        if error.error_code in UNKNOWN_OUTCOME_CODES:
+            return UNKNOWN_OUTCOME
+        return None
+    if isinstance(error, ServerError):
+        return UNKNOWN_OUTCOME
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return REJECTED
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return UNKNOWN_OUTCOME
+    return None
+
+
+def retry_after(error: Exception) -> float:
+    """Seconds the exchange asked to wait before the next request, 0 when it didn't"""
+    header = getattr(error, "header", None) or {}
+    try:
+        return float(header.get("Retry-After", 0))
+    except (TypeError, ValueError):
+        return 0
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    attempts: int = 4
+    base_delay: float = 0.1  # seconds, doubled at every attempt
+    max_delay: float = 2.0
+    timeout: float = 10.0  # of each request
+    idempotent: bool = False  # whether requests with an unknown outcome can be sent again
+    hedge_after: Optional[float] = None  # seconds after which a second, identical, request is sent
+
+    def delay(self, attempt: int) -> float:
+        """Backoff before the given retry, with full jitter so that bots don't retry in lockstep"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+_attempts = int(os.getenv("EXCHANGE_ATTEMPTS", "4"))
+_hedge_after = float(os.getenv("EXCHANGE_HEDGE_AFTER", "0")) or None  # hedging of cancels is off by default
+READ_POLICY = RetryPolicy(attempts=_attempts, idempotent=True, timeout=float(os.getenv("EXCHANGE_TIMEOUT", "10")))
+ORDER_POLICY = RetryPolicy(attempts=_attempts, timeout=float(os.getenv("EXCHANGE_ORDER_TIMEOUT", "5")))
+
+POLICIES: Dict[str, RetryPolicy] = {
+    "new_order": replace(ORDER_POLICY, idempotent=True),  # sent with a client order id
+    "cancel_order": replace(ORDER_POLICY, idempotent=True, hedge_after=_hedge_after),
+    "cancel_and_replace": ORDER_POLICY,
+    "cancel_open_orders": ORDER_POLICY,
+}
+
+_hedges = ThreadPoolExecutor(max_workers=int(os.getenv("EXCHANGE_HEDGE_THREADS", "16")),
+                             thread_name_prefix="exchange-hedge")
+
+
+class EndpointMetrics:
+    def __init__(self, capacity: int):
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.hedged = 0
+        self.latencies = RingBuffer("d", capacity)  # seconds, retries included
+
+
+class ExchangeMetrics:
+    """Calls, retries, failures, hedges and latency of every endpoint, over all the clients"""
+
+    def __init__(self, capacity: int = 1000):
+        self.capacity = capacity
+        self.endpoints: Dict[str, EndpointMetrics] = {}
+        self.lock = threading.Lock()
+
+    def _endpoint(self, name: str) -> EndpointMetrics:
+        endpoint = self.endpoints.get(name)
+        if endpoint is None:
+            endpoint = self.endpoints[name] = EndpointMetrics(self.capacity)
+        return endpoint
+
+    def record(self, name: str, seconds: float, retries: int, failed: bool):
+        with self.lock:
+            endpoint = self._endpoint(name)
+            endpoint.calls += 1
+            endpoint.retries += retries
+            endpoint.failures += failed
+            endpoint.latencies.append(seconds)
+
+    def hedge(self, name: str):
+        with self.lock:
+            self._endpoint(name).hedged += 1
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Counters and latency percentiles (seconds, over the last `capacity` calls) by endpoint"""
+        with self.lock:
+            endpoints = {name: (endpoint.calls, endpoint.retries, endpoint.failures, endpoint.hedged,
+                                sorted(endpoint.latencies.to_list()))
+                         for name, endpoint in self.endpoints.items()}
+
+        def percentile(latencies, fraction):
+            return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] if latencies else 0.0
+
+        return {
+            name: {"calls": calls, "retries": retries, "failures": failures, "hedged": hedged,
+                   "p50": percentile(latencies, 0.5), "p99": percentile(latencies, 0.99),
+                   "max": latencies[-1] if latencies else 0.0}
+            for name, (calls, retries, failures, hedged, latencies) in endpoints.items()
+        }
+
+
+exchange_metrics = ExchangeMetrics()
+
+
+def default_base_url() -> str:
+    return "https://testnet.binance.vision" if os.getenv("BINANCE_TESTNET") else "https://api.binance.com"
+
+
+class ClientRegistry:
+    """One Spot client, so one pool of keep-alive connections, by API key and base URL
+
+    Clients without a request for `idle_timeout` seconds are closed and dropped when the next
+    client is handed out. One still held somewhere keeps working: its next request opens its
+    connections again and registers it back.
+    """
+
+    def __init__(self, idle_timeout: float = 600, pool_size: int = 20):
+        self.idle_timeout = idle_timeout
+        self.pool_size = pool_size  # connections kept open by client
+        self.clients: Dict[Tuple[str, str], Spot] = {}
+        self.last_used: Dict[Tuple[str, str], float] = {}
+        self.lock = threading.Lock()
+        self.swept = time.monotonic()
+
+    def get(self, api_key: Optional[str], api_secret: Optional[str], base_url: Optional[str] = None) -> Spot:
+        key = (api_key, base_url or default_base_url())
+        if time.monotonic() - self.swept > self.idle_timeout / 4:
+            self.close_idle()
+        with self.lock:
+            client = self.clients.get(key)
+            if client is None or client.api_secret != api_secret:
+                # A changed secret replaces the client, the holders of the old one get the new one on reload
+                client = self.clients[key] = self._new_client(key, api_secret)
+            self.last_used[key] = time.monotonic()
+            return client
+
+    def _new_client(self, key: Tuple[str, str], api_secret: Optional[str]) -> Spot:
+        api_key, base_url = key
+        client = Spot(api_key=api_key, api_secret=api_secret, base_url=base_url)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        client.session.mount("https://", adapter)
+        client.session.hooks["response"].append(partial(self._used, key, client))
+        logging.info(f"Using {base_url} for Binance API, {len(self.clients) + 1} clients")
+        return client
+
+    def _used(self, key: Tuple[str, str], client: Spot, response, **kwargs):
+        self.last_used[key] = time.monotonic()
+        if key not in self.clients:
+            with self.lock:
+                self.clients.setdefault(key, client)
+                self.last_used[key] = time.monotonic()
+
+    def close_idle(self) -> int:
+        """Close the connections of the clients idle for `idle_timeout` seconds, and drop them"""
+        now = time.monotonic()
+        with self.lock:
+            self.swept = now
+            idle = [key for key, used in self.last_used.items() if now - used > self.idle_timeout]
+            clients = [self.clients.pop(key) for key in idle if key in self.clients]
+            for key in idle:
+                del self.last_used[key]
+        for client in clients:
+            client.session.close()
+        return len(clients)
+
+    def close_all(self):
+        with self.lock:
+            clients = list(self.clients.values())
+            self.clients.clear()
+            self.last_used.clear()
+        for client in clients:
+            client.session.close()
+
+
+client_registry = ClientRegistry(idle_timeout=float(os.getenv("EXCHANGE_CLIENT_IDLE", "600")),
+                                 pool_size=int(os.getenv("EXCHANGE_POOL_SIZE", "20")))
+
+
+def new_client_order_id() -> str:
+    return f"x-{uuid4().hex}"
+
+
+class ExchangeClient:
+    """Spot client whose calls go through the retry policy of their endpoint
+
+    Attributes other than the API calls are those of the wrapped client.
+    """
+
+    def __init__(self, client: Spot, policies: Optional[Dict[str, RetryPolicy]] = None,
+                 default_policy: RetryPolicy = READ_POLICY, metrics: ExchangeMetrics = exchange_metrics):
+        self.client = client
+        self.policies = POLICIES if policies is None else policies
+        self.default_policy = default_policy
+        self.metrics = metrics
+        self.timed_clients: Dict[float, Spot] = {}  # copies of the client, sharing its session
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+        return partial(self.call, name)
+
+    def call(self, name: str, *args, **kwargs):
+        policy = self.policies.get(name, self.default_policy)
+        if name == "new_order":
+            kwargs.setdefault("newClientOrderId", new_client_order_id())
+
+        started = time.perf_counter()
+        attempt, failed = 1, True
+        try:
+            while True:
+                try:
+                    result = self._send(name, policy, args, kwargs)
+                    failed = False
+                    return result
+                except Exception as e:
+                    kind = classify(e)
+                    recovered = self._recover(name, e, kind, kwargs)
+                    if recovered is not None:
+                        failed = False
+                        return recovered
+                    if kind is None or attempt >= policy.attempts or \
+                            (kind == UNKNOWN_OUTCOME and not policy.idempotent):
+                        raise
+                    delay = max(policy.delay(attempt), retry_after(e))
+                    logging.warning(f"Exchange call {name} failed ({kind}): {e}, retry {attempt} in {delay:.2f}s")
+                    time.sleep(delay)
+                    attempt += 1
+        finally:
+            self.metrics.record(name, time.perf_counter() - started, attempt - 1, failed)
+
+    def _send(self, name: str, policy: RetryPolicy, args, kwargs):
+        method = getattr(self._timed_client(policy.timeout), name)
+        if not policy.hedge_after:
+            return method(*args, **kwargs)
+
+        first = _hedges.submit(method, *args, **kwargs)
+        try:
+            return first.result(timeout=policy.hedge_after)
+        except FutureTimeout:
+            pass
+        self.metrics.hedge(name)
+        pending = {first, _hedges.submit(method, *args, **kwargs)}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                # The request that lost the race may fail because the other one succeeded
+                error = error or future.exception()
+        raise error
+
+    def _timed_client(self, timeout: float) -> Spot:
+        if getattr(self.client, "timeout", None) == timeout:
+            return self.client
+        client = self.timed_clients.get(timeout)
+        if client is None:
+            client = copy.copy(self.client)
+            client.timeout = timeout
+            self.timed_clients[timeout] = client
+        return client
+
+    def _recover(self, name: str, error: Exception, kind: Optional[str], kwargs) -> Optional[dict]:
+        """Result of a call that failed, yet was carried out by the exchange, None when it wasn't"""
+        duplicate = getattr(error, "error_code", None) == NEW_ORDER_REJECTED and \
+            "Duplicate" in (getattr(error, "error_message", None) or "")
+        if name == "new_order" and (kind == UNKNOWN_OUTCOME or duplicate):
+            order = self._lookup(kwargs["symbol"], origClientOrderId=kwargs["newClientOrderId"])
+            if order:
+                return dict(order, transactTime=order.get("updateTime", 0))
+        elif name == "cancel_order" and getattr(error, "error_code", None) == UNKNOWN_ORDER:
+            # Already cancelled, by an earlier attempt or by the hedged request
+            order = self._lookup(kwargs["symbol"], orderId=kwargs.get("orderId"),
+                                 origClientOrderId=kwargs.get("origClientOrderId"))
+            if order and order["status"] == "CANCELED":
+                return order
+        return None
+
+    def _lookup(self, symbol: str, **ids) -> Optional[dict]:
+        try:
+            return self.call("get_order", symbol=symbol, **{key: value for key, value in ids.items() if value})
+        except ClientError as e:
+            if e.error_code == NO_SUCH_ORDER:
+                return None
+            raise
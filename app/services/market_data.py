@@ -0,0 +1,101 @@
+import logging
+import os
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set
+
+from binance.websocket.spot.websocket_stream import SpotWebsocketStreamClient
+
+from .stream_messages import AggTrade, BookTicker, MiniTicker, Ticker, combined_decoder
+from .stream_recorder import MARKET_SOURCE, StreamRecorder
+
+PriceListener = Callable[[str, str], None]
+
+# Price streams a deployment can choose from, with the stream name suffix and the message type
+PRICE_STREAMS = {
+    "miniTicker": ("miniTicker", MiniTicker),  # last price, every second
+    "bookTicker": ("bookTicker", BookTicker),  # best bid, in real time
+    "aggTrade": ("aggTrade", AggTrade),  # trade prices, in real time
+    "24hrTicker": ("ticker", Ticker),  # last price with the full 24h statistics, every second
+}
+
+
+def stream_url() -> str:
+    return "wss://stream.testnet.binance.vision" if os.getenv("BINANCE_TESTNET") else "wss://stream.binance.com"
+
+
+class MarketDataFeed:
+    """Price updates of the traded symbols, shared by all the bots of the engine
+
+    Every symbol is subscribed once, whatever the number of bots trading it, on combined
+    stream connections carrying up to `streams_per_socket` symbols each. Listeners get
+    the symbol and the price as the exchange sent it (a decimal string).
+    """
+
+    def __init__(self, stream: str = "miniTicker", streams_per_socket: int = 200,
+                 recorder: Optional[StreamRecorder] = None):
+        if stream not in PRICE_STREAMS:
+            raise ValueError(f"Unsupported price stream: {stream}, use one of {', '.join(PRICE_STREAMS)}")
+        self.stream_suffix, message_type = PRICE_STREAMS[stream]
+        self.decode = combined_decoder(message_type)
+        self.streams_per_socket = streams_per_socket
+        self.recorder = recorder  # of the raw messages, to replay them later
+        self.listeners: Dict[str, List[PriceListener]] = defaultdict(list)
+        self.sockets: Dict[SpotWebsocketStreamClient, Set[str]] = {}  # open connections and their symbols
+        self.lock = threading.Lock()
+
+    def _stream_name(self, symbol: str) -> str:
+        return f"{symbol.lower()}@{self.stream_suffix}"
+
+    def subscribe(self, symbol: str, listener: PriceListener):
+        with self.lock:
+            self.listeners[symbol].append(listener)
+            if len(self.listeners[symbol]) > 1:
+                return
+
+            socket = next((socket for socket, symbols in self.sockets.items()
+                           if len(symbols) < self.streams_per_socket), None)
+            if socket is None:
+                socket = SpotWebsocketStreamClient(stream_url=stream_url(), on_message=self._on_message,
+                                                   is_combined=True)
+                self.sockets[socket] = set()
+            socket.subscribe(self._stream_name(symbol))
+            self.sockets[socket].add(symbol)
+
+    def unsubscribe(self, symbol: str, listener: PriceListener):
+        with self.lock:
+            listeners = self.listeners.get(symbol, [])
+            if listener in listeners:
+                listeners.remove(listener)
+            if listeners:
+                return
+            self.listeners.pop(symbol, None)
+
+            for socket, symbols in list(self.sockets.items()):
+                if symbol in symbols:
+                    symbols.discard(symbol)
+                    if symbols:
+                        socket.unsubscribe(self._stream_name(symbol))
+                    else:
+                        del self.sockets[socket]
+                        socket.stop()
+
+    def stop(self):
+        with self.lock:
+            for socket in self.sockets:
+                socket.stop()
+            self.sockets = {}
+            self.listeners.clear()
+
+    def _on_message(self, _, raw):
+        if self.recorder:
+            self.recorder.record(MARKET_SOURCE, raw)
+        message = self.decode(raw)
+        if message is None:
+            return
+
+        for listener in tuple(self.listeners.get(message.symbol, ())):
+            try:
+                listener(message.symbol, message.price)
+            except Exception as e:
+                logging.error(f"Price listener failed on {message.symbol}: {e}")
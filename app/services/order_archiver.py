@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Callable
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..enums import CycleStatusType
+from ..models import Order, OrderArchive, TradingCycle
+
+# Columns copied as they are from the hot table to the archive
+ARCHIVED_COLUMNS = [column.name for column in OrderArchive.__table__.columns]
+
+
+class OrderArchiver:
+    """Background job moving the orders of finished cycles to the orders_archive table
+
+    Live bots only query the orders of their active cycle, so the hot orders table stays
+    limited to the cycles that are still running (or were finished less than `min_age` ago).
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        min_age: timedelta = timedelta(hours=24),
+        batch_size: int = 100
+    ):
+        self.session_factory = session_factory
+        self.min_age = min_age
+        self.batch_size = batch_size
+
+    def archive_batch(self) -> int:
+        """Archive the orders of up to `batch_size` finished cycles, return the number of archived cycles"""
+        db = self.session_factory()
+        try:
+            # updated_at is stamped by the database clock, in the session's time zone: compare with the same
+            now = db.execute(select(func.now())).scalar().replace(tzinfo=None)
+            cycle_ids = db.execute(
+                select(TradingCycle.id).where(
+                    TradingCycle.status.in_([CycleStatusType.COMPLETED, CycleStatusType.CANCELLED]),
+                    TradingCycle.archived_at.is_(None),
+                    TradingCycle.updated_at < now - self.min_age
+                ).limit(self.batch_size).with_for_update(skip_locked=True)
+            ).scalars().all()
+
+            if not cycle_ids:
+                return 0
+
+            db.execute(
+                insert(OrderArchive).from_select(
+                    ARCHIVED_COLUMNS,
+                    select(*(Order.__table__.c[name] for name in ARCHIVED_COLUMNS)).where(Order.cycle_id.in_(cycle_ids))
+                )
+            )
+            db.execute(delete(Order).where(Order.cycle_id.in_(cycle_ids)))
+            db.execute(
+                update(TradingCycle).where(TradingCycle.id.in_(cycle_ids)).values(archived_at=func.now())
+            )
+            db.commit()
+
+            return len(cycle_ids)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def archive_completed_cycles(self) -> int:
+        archived = 0
+        while True:
+            count = self.archive_batch()
+            archived += count
+            if count < self.batch_size:
+                return archived
+
+    async def run(self, interval: float):
+        while True:
+            try:
+                archived = await asyncio.to_thread(self.archive_completed_cycles)
+                if archived:
+                    logging.info(f"Archived orders of {archived} finished cycles")
+            except Exception as e:
+                logging.error(f"Failed to archive orders: {e}")
+            await asyncio.sleep(interval)
@@ -0,0 +1,126 @@
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional
+from uuid import UUID
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import Order
+
+
+class OrderWriter:
+    """Write-behind buffer that group-commits order updates coming from all bots
+
+    Updates are coalesced per order and flushed in one transaction every `max_delay`
+    seconds or as soon as `max_rows` orders are pending. `submit` returns a ticket
+    that callers pass to `wait` when they need the update to be durable.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        max_delay: float = 0.005,
+        max_rows: int = 500
+    ):
+        self.session_factory = session_factory
+        self.max_delay = max_delay
+        self.max_rows = max_rows
+        self.pending: Dict[UUID, dict] = {}
+        self.submitted = 0  # ticket of the last submitted update
+        self.flushed = 0  # ticket of the last update known to be committed
+        self.condition = threading.Condition()
+        self.flush_lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.flush()
+
+    def submit(self, order_id: UUID, **values) -> int:
+        """Queue an update of the given order, later values for the same order win"""
+        with self.condition:
+            self.pending.setdefault(order_id, {}).update(values)
+            self.submitted += 1
+            self.condition.notify_all()
+            return self.submitted
+
+    def wait(self, ticket: Optional[int] = None, timeout: Optional[float] = None):
+        """Block until the update with the given ticket (or everything submitted so far) is committed"""
+        if self.thread is None:
+            self.flush()
+            return
+
+        with self.condition:
+            ticket = ticket or self.submitted
+            if not self.condition.wait_for(lambda: self.flushed >= ticket, timeout=timeout):
+                raise TimeoutError(f"Order updates up to #{ticket} were not committed in {timeout}s")
+
+    def flush(self):
+        """Write all pending updates in a single transaction"""
+        with self.flush_lock:
+            with self.condition:
+                rows, self.pending = self.pending, {}
+                ticket = self.submitted
+
+            if rows:
+                try:
+                    self._write(rows)
+                except Exception as e:
+                    logging.error(f"Failed to write {len(rows)} order updates: {e}")
+                    with self.condition:
+                        # Keep updates that arrived meanwhile, they are newer than the failed ones
+                        for order_id, values in rows.items():
+                            self.pending[order_id] = {**values, **self.pending.get(order_id, {})}
+                    raise
+
+            with self.condition:
+                self.flushed = max(self.flushed, ticket)
+                self.condition.notify_all()
+
+    def _write(self, rows: Dict[UUID, dict]):
+        db = self.session_factory()
+        try:
+            # A Core executemany doesn't check row counts: an order archived or deleted meanwhile is
+            # skipped instead of failing the whole batch. Each statement sets the same columns.
+            batches: Dict[frozenset, list] = {}
+            for order_id, values in rows.items():
+                batches.setdefault(frozenset(values), []).append({"_id": order_id, **values})
+            statement = update(Order.__table__).where(Order.__table__.c.id == bindparam("_id"))
+            for params in batches.values():
+                db.execute(statement, params)
+            db.commit()
+        finally:
+            db.close()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or not self.running)
+                if not self.running:
+                    return
+                # Give other bots a few milliseconds to join the batch
+                deadline = time.monotonic() + self.max_delay
+                while len(self.pending) < self.max_rows and self.running:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.max_delay)
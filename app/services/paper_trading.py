@@ -0,0 +1,305 @@
+"""Paper trading: shadow bots matched against the live prices, without touching the exchange
+
+Every paper bot takes its decisions (grid levels and quantities, take profit price, grid
+shift trigger) from the TradingService code of the real bots. Their resting orders live in
+one PaperBook per symbol, as parallel integer arrays kept sorted by price, so a tick only
+looks at the orders it crosses. One process can then run thousands of paper bots next to
+the real ones. Completed cycles are written to the paper_cycles table.
+"""
+import asyncio
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy.orm import Session
+
+from ..enums import CycleStatusType
+from ..fixed_point import PERCENT_PLACES, SCALE, from_units, parse_units, price_change_trigger, to_units
+from ..models import PaperBot, PaperCycle
+from .market_data import MarketDataFeed
+from .trading_service import TradingService
+
+BUY, SELL, SHIFT = 0, 1, 2  # SHIFT entries are the grid shift triggers, crossed upwards like sell orders
+FREE = -1
+
+
+class PaperBook:
+    """Resting paper orders of one symbol
+
+    Orders are slots of parallel arrays (bot, side, price and quantity in fixed point
+    units). Bids are indexed by ascending price and fill when the price drops to theirs;
+    asks and shift triggers are indexed by ascending price and fire when the price rises
+    to theirs. A tick takes the crossed orders off the ends of the indexes.
+    """
+
+    def __init__(self):
+        self.bots = array("l")
+        self.sides = array("b")
+        self.prices = array("q")
+        self.quantities = array("q")
+        self.free_slots: List[int] = []
+        self.bid_prices, self.bid_slots = array("q"), array("l")
+        self.ask_prices, self.ask_slots = array("q"), array("l")
+
+    def __len__(self) -> int:
+        return len(self.bid_slots) + len(self.ask_slots)
+
+    def add(self, bot: int, side: int, price: int, quantity: int = 0) -> int:
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.bots[slot], self.sides[slot], self.prices[slot], self.quantities[slot] = bot, side, price, quantity
+        else:
+            slot = len(self.bots)
+            self.bots.append(bot)
+            self.sides.append(side)
+            self.prices.append(price)
+            self.quantities.append(quantity)
+
+        prices, slots = (self.bid_prices, self.bid_slots) if side == BUY else (self.ask_prices, self.ask_slots)
+        position = bisect_right(prices, price)
+        prices.insert(position, price)
+        slots.insert(position, slot)
+        return slot
+
+    def cancel(self, slot: int):
+        side = self.sides[slot]
+        if side == FREE:
+            return
+        prices, slots = (self.bid_prices, self.bid_slots) if side == BUY else (self.ask_prices, self.ask_slots)
+        position = bisect_left(prices, self.prices[slot])
+        while slots[position] != slot:
+            position += 1
+        del prices[position]
+        del slots[position]
+        self.release(slot)
+
+    def release(self, slot: int):
+        """Free the slot of an order out of the indexes"""
+        self.sides[slot] = FREE
+        self.free_slots.append(slot)
+
+    def match(self, price: int) -> List[int]:
+        """Take the orders crossed by `price` out of the indexes, their slots stay readable until released"""
+        crossed = []
+        position = bisect_left(self.bid_prices, price)
+        if position < len(self.bid_prices):
+            crossed.extend(self.bid_slots[position:])
+            del self.bid_prices[position:]
+            del self.bid_slots[position:]
+        position = bisect_right(self.ask_prices, price)
+        if position:
+            crossed.extend(self.ask_slots[:position])
+            del self.ask_prices[:position]
+            del self.ask_slots[:position]
+        return crossed
+
+
+class PaperTradingService(TradingService):
+    """Decisions of TradingService for a paper bot, without exchange client nor database session"""
+
+    def __init__(self, bot: PaperBot):
+        self.bot = bot
+        self.cycle: Optional[PaperCycle] = None
+        self.balances = None
+        self.events = None
+        self._grid_trigger = None
+
+    def buy_orders(self):
+        return []  # grids are only placed before the first fill of a cycle
+
+    def new_cycle(self, price: Decimal) -> PaperCycle:
+        bot = self.bot
+        self.cycle = PaperCycle(
+            paper_bot_id=bot.id, symbol=bot.symbol, amount=bot.amount, grid_length=bot.grid_length,
+            first_order_offset=bot.first_order_offset, num_orders=bot.num_orders,
+            next_order_volume=bot.next_order_volume, price=price, profit_percentage=bot.profit_percentage,
+            price_change_percentage=bot.price_change_percentage, status=CycleStatusType.ACTIVE,
+            started_at=datetime.now()
+        )
+        return self.cycle
+
+    def grid(self, price: Decimal) -> List[Tuple[int, int]]:
+        """Rounded (price, quantity) units of the grid orders for a market price"""
+        prices = self.calculate_grid_prices(price)
+        quantities = self.calculate_grid_quantities(prices)
+        return [tuple(map(to_units, self._order_values(price, quantity))) for price, quantity in zip(prices, quantities)]
+
+
+class PaperTrading:
+    """The paper bots of the engine, fed by its market data feed
+
+    The per-bot state of the running cycles (bought quantity and cost, sold quantity, the
+    take profit and shift trigger slots) is kept in arrays indexed by the bot's number.
+    """
+
+    def __init__(self, market_data: MarketDataFeed, session_factory: Callable[[], Session]):
+        self.market_data = market_data
+        self.session_factory = session_factory
+        self.services: List[PaperTradingService] = []
+        self.indexes: Dict[UUID, int] = {}  # of the bots, by id
+        self.grid_slots: List[List[int]] = []
+        self.bought = array("q")
+        self.cost = array("q")
+        self.sold = array("q")
+        self.proceeds = array("q")
+        self.buy_fills = array("l")
+        self.take_profit_slots = array("l")
+        self.trigger_slots = array("l")
+        self.books: Dict[str, PaperBook] = {}
+        self.locks: Dict[str, threading.Lock] = {}
+        self.pending: Dict[str, List[int]] = {}  # bots waiting for a first price to start
+        self.completed: List[PaperCycle] = []
+        self.completed_lock = threading.Lock()
+
+    def load(self):
+        with self.session_factory() as db:
+            bots = db.query(PaperBot).filter(PaperBot.is_active).all()
+            for bot in bots:
+                db.expunge(bot)
+        for bot in bots:
+            self.add(bot)
+        logging.info(f"Paper trading {len(bots)} bots on {len(self.books)} symbols")
+
+    def add(self, bot: PaperBot) -> int:
+        index = len(self.services)
+        self.indexes[bot.id] = index
+        self.services.append(PaperTradingService(bot))
+        self.grid_slots.append([])
+        for state in (self.bought, self.cost, self.sold, self.proceeds, self.buy_fills):
+            state.append(0)
+        self.take_profit_slots.append(FREE)
+        self.trigger_slots.append(FREE)
+
+        if bot.symbol not in self.books:
+            self.books[bot.symbol] = PaperBook()
+            self.locks[bot.symbol] = threading.Lock()
+            self.pending[bot.symbol] = []
+            self.market_data.subscribe(bot.symbol, self.on_price)
+        with self.locks[bot.symbol]:
+            self.pending[bot.symbol].append(index)
+        return index
+
+    def stop(self):
+        for symbol in self.books:
+            self.market_data.unsubscribe(symbol, self.on_price)
+        self.flush()
+
+    def on_price(self, symbol: str, price: str):
+        price_units = parse_units(price)
+        book = self.books[symbol]
+        with self.locks[symbol]:
+            pending, self.pending[symbol] = self.pending[symbol], []
+            for index in pending:
+                self._start_cycle(book, index, price_units)
+
+            for slot in book.match(price_units):
+                index, side = book.bots[slot], book.sides[slot]
+                order_price, quantity = book.prices[slot], book.quantities[slot]
+                book.release(slot)
+                try:
+                    if side == BUY:
+                        self._bought(book, index, slot, order_price, quantity)
+                    elif side == SELL:
+                        self._sold(book, index, order_price, quantity, price_units)
+                    else:
+                        self.trigger_slots[index] = FREE
+                        self._place_grid(book, index, price_units)
+                except Exception as e:
+                    logging.error(f"Paper bot {self.services[index].bot.id} failed: {e}")
+
+    def _start_cycle(self, book: PaperBook, index: int, price: int):
+        self.services[index].new_cycle(from_units(price))
+        for state in (self.bought, self.cost, self.sold, self.proceeds, self.buy_fills):
+            state[index] = 0
+        try:
+            self._place_grid(book, index, price)
+        except Exception as e:
+            logging.error(f"Paper bot {self.services[index].bot.id} can't place its grid: {e}")
+
+    def _place_grid(self, book: PaperBook, index: int, price: int):
+        """Place the grid for `price`, replacing the current one, with the trigger of its next shift"""
+        service = self.services[index]
+        for slot in self.grid_slots[index]:
+            book.cancel(slot)
+        service.cycle.price = from_units(price)
+        self.grid_slots[index] = [book.add(index, BUY, level_price, quantity)
+                                  for level_price, quantity in service.grid(service.cycle.price)]
+        trigger = price_change_trigger(price, to_units(service.cycle.price_change_percentage, PERCENT_PLACES))
+        self.trigger_slots[index] = book.add(index, SHIFT, trigger)
+
+    def _bought(self, book: PaperBook, index: int, slot: int, price: int, quantity: int):
+        self.grid_slots[index].remove(slot)
+        self.bought[index] += quantity
+        self.cost[index] += quantity * price // SCALE
+        self.buy_fills[index] += 1
+        if self.trigger_slots[index] != FREE:  # a grid with fills doesn't shift anymore
+            book.cancel(self.trigger_slots[index])
+            self.trigger_slots[index] = FREE
+
+        if self.take_profit_slots[index] != FREE:
+            book.cancel(self.take_profit_slots[index])
+            self.take_profit_slots[index] = FREE
+        service = self.services[index]
+        remaining = from_units(self.bought[index] - self.sold[index])
+        take_profit_price = service.take_profit_price(from_units(self.bought[index]), from_units(self.cost[index]))
+        take_profit_price, remaining = service._order_values(take_profit_price, remaining)
+        self.take_profit_slots[index] = book.add(index, SELL, to_units(take_profit_price), to_units(remaining))
+
+    def _sold(self, book: PaperBook, index: int, price: int, quantity: int, market_price: int):
+        self.take_profit_slots[index] = FREE
+        self.sold[index] += quantity
+        self.proceeds[index] += quantity * price // SCALE
+        if self.sold[index] < self.bought[index]:
+            return
+
+        cycle = self.services[index].cycle
+        cycle.status = CycleStatusType.COMPLETED
+        cycle.quantity = from_units(self.bought[index])
+        cycle.cost = from_units(self.cost[index])
+        cycle.proceeds = from_units(self.proceeds[index])
+        cycle.buy_fills = self.buy_fills[index]
+        cycle.completed_at = datetime.now()
+        with self.completed_lock:
+            self.completed.append(cycle)
+
+        for slot in self.grid_slots[index]:
+            book.cancel(slot)
+        self.grid_slots[index] = []
+        self._start_cycle(book, index, market_price)
+
+    def flush(self):
+        """Write the cycles completed since the last flush, in one transaction"""
+        with self.completed_lock:
+            completed, self.completed = self.completed, []
+        if not completed:
+            return
+        with self.session_factory() as db:
+            db.add_all(completed)
+            db.commit()
+
+    async def run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logging.error(f"Failed to write the paper cycles: {e}")
+
+    def stats(self, bot_id: UUID) -> Optional[dict]:
+        """State of the running cycle of a paper bot"""
+        index = self.indexes.get(bot_id)
+        if index is None:
+            return None
+        cycle = self.services[index].cycle
+        return {
+            "cycle_price": cycle.price if cycle else None,
+            "bought": from_units(self.bought[index]),
+            "cost": from_units(self.cost[index]),
+            "sold": from_units(self.sold[index]),
+            "open_orders": len(self.grid_slots[index]) + (self.take_profit_slots[index] != FREE),
+        }
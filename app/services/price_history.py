@@ -0,0 +1,158 @@
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from ..fixed_point import SCALE, parse_units
+
+
+class RingBuffer:
+    """The last `capacity` values appended, in a preallocated typed array"""
+
+    def __init__(self, typecode: str, capacity: int):
+        self.values = array(typecode, [0]) * capacity
+        self.capacity = capacity
+        self.size = 0
+        self.end = 0  # where the next value goes
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, value):
+        self.values[self.end] = value
+        self.end = (self.end + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    @property
+    def last(self):
+        return self.values[self.end - 1]
+
+    @last.setter
+    def last(self, value):
+        self.values[self.end - 1] = value
+
+    def to_list(self, count: Optional[int] = None) -> list:
+        """The last `count` values (all by default), oldest first"""
+        count = self.size if count is None else min(count, self.size)
+        start = self.end - count
+        if start >= 0:
+            return self.values[start:self.end].tolist()
+        return self.values[start:].tolist() + self.values[:self.end].tolist()
+
+
+class CandleSeries:
+    """OHLC candles of one resolution, updated in place by every tick"""
+
+    def __init__(self, resolution: int, capacity: int):
+        self.resolution = resolution
+        self.starts = RingBuffer("q", capacity)  # seconds
+        self.opens, self.highs, self.lows, self.closes = (RingBuffer("q", capacity) for _ in range(4))
+
+    def update(self, timestamp: float, price: int):
+        start = int(timestamp) // self.resolution * self.resolution
+        if self.starts.size and start <= self.starts.last:  # late ticks go to the current candle
+            self.highs.last = max(self.highs.last, price)
+            self.lows.last = min(self.lows.last, price)
+            self.closes.last = price
+        else:
+            self.starts.append(start)
+            for series in (self.opens, self.highs, self.lows, self.closes):
+                series.append(price)
+
+    def to_list(self, count: Optional[int] = None) -> List[tuple]:
+        return list(zip(*(series.to_list(count) for series in (self.starts, self.opens, self.highs, self.lows,
+                                                                self.closes))))
+
+
+class SymbolHistory:
+    def __init__(self, tick_capacity: int, candle_capacity: int, resolutions: Iterable[int]):
+        self.times = RingBuffer("d", tick_capacity)
+        self.prices = RingBuffer("q", tick_capacity)  # fixed point units
+        self.candles = {resolution: CandleSeries(resolution, candle_capacity) for resolution in resolutions}
+
+    def record(self, timestamp: float, price: int):
+        self.times.append(timestamp)
+        self.prices.append(price)
+        for series in self.candles.values():
+            series.update(timestamp, price)
+
+
+class PriceHistory:
+    """Recent ticks and candles of every symbol, kept in memory for the dashboard charts
+
+    Memory is bounded: each symbol holds the last `tick_capacity` ticks and the last
+    `candle_capacity` candles of each resolution (in seconds), in preallocated arrays.
+    """
+
+    def __init__(self, tick_capacity: int = 10000, candle_capacity: int = 1000,
+                 resolutions: Sequence[int] = (60, 300, 3600)):
+        self.tick_capacity = tick_capacity
+        self.candle_capacity = candle_capacity
+        self.resolutions = tuple(resolutions)
+        self.symbols: Dict[str, SymbolHistory] = {}
+        self.lock = threading.Lock()
+
+    def record(self, symbol: str, price: str, timestamp: Optional[float] = None):
+        """Market data listener, takes the price as the exchange sent it"""
+        units = parse_units(price)
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            history = self.symbols.get(symbol)
+            if history is None:
+                history = self.symbols[symbol] = SymbolHistory(self.tick_capacity, self.candle_capacity,
+                                                               self.resolutions)
+            history.record(timestamp, units)
+
+    def ticks(self, symbol: str) -> Tuple[List[float], List[int]]:
+        """Times and prices, in fixed point units, of the recorded ticks, oldest first"""
+        with self.lock:
+            history = self.symbols.get(symbol)
+            if history is None:
+                return [], []
+            return history.times.to_list(), history.prices.to_list()
+
+    def candles(self, symbol: str, resolution: int, count: Optional[int] = None) -> List[tuple]:
+        """(start, open, high, low, close) of the last `count` candles, prices in fixed point units"""
+        if resolution not in self.resolutions:
+            raise ValueError(f"Unsupported resolution: {resolution}, use one of {self.resolutions}")
+        with self.lock:
+            history = self.symbols.get(symbol)
+            return history.candles[resolution].to_list(count) if history else []
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[Tuple[float, float]]:
+    """Downsample a series to `threshold` points with Largest-Triangle-Three-Buckets
+
+    The first and last points are kept; in between, each bucket keeps the point forming
+    the largest triangle with the previously kept point and the average of the next
+    bucket, which preserves the visual shape (peaks and troughs) of the series.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(zip(xs, ys))
+
+    sampled = [(xs[0], ys[0])]
+    bucket_size = (n - 2) / (threshold - 2)
+    kept = 0
+    for i in range(threshold - 2):
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        average_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        average_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        kept_x, kept_y = xs[kept], ys[kept]
+        largest_area, candidate = -1, next_start
+        for j in range(int(i * bucket_size) + 1, next_start):
+            area = abs((kept_x - average_x) * (ys[j] - kept_y) - (kept_x - xs[j]) * (average_y - kept_y))
+            if area > largest_area:
+                largest_area, candidate = area, j
+        sampled.append((xs[candidate], ys[candidate]))
+        kept = candidate
+
+    sampled.append((xs[-1], ys[-1]))
+    return sampled
+
+
+def to_price(units: int) -> float:
+    """Chart value of a fixed point price"""
+    return units / SCALE
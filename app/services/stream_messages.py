@@ -0,0 +1,86 @@
+"""Typed decoding of the Binance websocket messages handled by the engine
+
+Only the fields the engine reads are declared, the others are skipped while decoding.
+The messages are decoded by the compiled JSON decoder of msgspec straight into structs.
+"""
+from typing import Callable, List, Optional, Union
+
+import msgspec
+from msgspec import Struct, field
+
+
+class ExecutionReport(Struct, tag_field="e", tag="executionReport"):
+    symbol: str = field(name="s", default="")
+    side: str = field(name="S", default="")
+    status: str = field(name="X", default="")
+    order_id: int = field(name="i", default=0)
+    quantity_filled: str = field(name="z", default="0")  # cumulative filled quantity
+    client_order_id: str = field(name="c", default="")
+    orig_client_order_id: str = field(name="C", default="")  # set on cancellations
+    event_time: int = field(name="E", default=0)
+    last_quantity: str = field(name="l", default="0")  # of the trade the report is about
+    last_price: str = field(name="L", default="0")
+    commission: str = field(name="n", default="0")
+    commission_asset: Optional[str] = field(name="N", default=None)
+    transaction_time: int = field(name="T", default=0)
+
+
+class Ticker(Struct, tag_field="e", tag="24hrTicker"):
+    symbol: str = field(name="s", default="")
+    price: str = field(name="c", default="0")  # last price
+
+
+class MiniTicker(Struct):
+    symbol: str = field(name="s", default="")
+    price: str = field(name="c", default="0")  # last price
+
+
+class BookTicker(Struct):
+    symbol: str = field(name="s", default="")
+    price: str = field(name="b", default="0")  # best bid, the price a position could be sold at
+
+
+class AggTrade(Struct):
+    symbol: str = field(name="s", default="")
+    price: str = field(name="p", default="0")
+
+
+class Balance(Struct):
+    asset: str = field(name="a", default="")
+    free: str = field(name="f", default="0")
+    locked: str = field(name="l", default="0")
+
+
+class AccountPosition(Struct, tag_field="e", tag="outboundAccountPosition"):
+    event_time: int = field(name="E", default=0)
+    balances: List[Balance] = field(name="B", default=None)
+
+
+Message = Union[ExecutionReport, Ticker, AccountPosition]
+
+_decoder = msgspec.json.Decoder(Message, strict=False)  # like int(), accept ids sent as strings
+
+
+def decode(raw: Union[str, bytes]) -> Optional[Message]:
+    """Decode a stream message, None for the event types the engine doesn't handle"""
+    try:
+        return _decoder.decode(raw)
+    except msgspec.ValidationError:  # another event type, or a subscription response
+        return None
+
+
+def combined_decoder(message_type) -> Callable[[Union[str, bytes]], Optional[Struct]]:
+    """Decoder of combined stream messages, `{"stream": ..., "data": ...}`, carrying `message_type`
+
+    The decoder returns None for subscription responses.
+    """
+    combined = msgspec.defstruct(f"Combined{message_type.__name__}", [("data", message_type)])
+    decoder = msgspec.json.Decoder(combined, strict=False)
+
+    def decode_combined(raw):
+        try:
+            return decoder.decode(raw).data
+        except msgspec.ValidationError:
+            return None
+
+    return decode_combined
@@ -0,0 +1,170 @@
+"""Recording of the raw websocket messages, and their replay into a bot's events handler
+
+A recording is a directory of gzip segments, each one a sequence of lines
+
+    <receive time in ns> <source> <raw message>
+
+where the source is `market` for the shared price feed and `user:<bot id>` for the
+connection of a bot (its user data, and its tickers when there is no shared feed).
+Segments are only ever appended to, then closed for good when the next one starts; they
+sort by name in time order. A segment cut short by a crash reads up to its last complete
+line. The oldest closed segments are deleted past the recorder's maximum age or size.
+"""
+import gzip
+import logging
+import os
+import threading
+import time
+from functools import partial
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Union
+from uuid import UUID
+
+from .stream_messages import combined_decoder
+
+MARKET_SOURCE = "market"
+
+
+def user_source(bot_id: UUID) -> str:
+    return f"user:{bot_id}"
+
+
+class Record(NamedTuple):
+    time: int  # ns
+    source: str
+    raw: str
+
+
+class StreamRecorder:
+    """Append-only writer of a recording, safe to share between the websocket threads"""
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, compresslevel: int = 1,
+                 max_age: Optional[float] = None, max_bytes: Optional[int] = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes  # of raw messages, before compression
+        self.compresslevel = compresslevel
+        self.max_age = max_age  # seconds since the last write of a closed segment
+        self.max_bytes = max_bytes  # of the segments on disk, compressed
+        self.segment: Optional[gzip.GzipFile] = None
+        self.written = 0  # bytes in the current segment
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def record(self, source: str, raw: Union[str, bytes]):
+        received = time.time_ns()
+        if isinstance(raw, str):
+            raw = raw.encode()
+        line = b"%d %s %s\n" % (received, source.encode(), raw.replace(b"\n", b" "))
+        with self.lock:
+            if self.segment is None or self.written >= self.segment_bytes:
+                self._next_segment(received)
+            self.segment.write(line)
+            self.written += len(line)
+
+    def _next_segment(self, start: int):
+        if self.segment:
+            self.segment.close()
+        path = os.path.join(self.directory, f"segment-{start:020d}.gz")
+        self.segment = gzip.open(path, "ab", compresslevel=self.compresslevel)
+        self.written = 0
+        self._prune(path)
+
+    def _prune(self, current: str):
+        """Delete the oldest closed segments beyond the maximum age and size"""
+        if self.max_age is None and self.max_bytes is None:
+            return
+        closed = [path for path in segments(self.directory) if path != current]
+        sizes = {path: os.path.getsize(path) for path in closed}
+        total = sum(sizes.values())
+        now = time.time()
+        for path in closed:
+            too_old = self.max_age is not None and now - os.path.getmtime(path) > self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                break
+            try:
+                os.remove(path)
+            except OSError as e:
+                logging.error(f"Failed to delete recording segment {path}: {e}")
+                break
+            total -= sizes[path]
+
+    def close(self):
+        with self.lock:
+            if self.segment:
+                self.segment.close()
+                self.segment = None
+
+
+def segments(directory: str) -> List[str]:
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                  if name.startswith("segment-") and name.endswith(".gz"))
+
+
+def read_recording(directory: str) -> Iterator[Record]:
+    """Records of all the segments, in the order they were received"""
+    for path in segments(directory):
+        with gzip.open(path, "rb") as segment:
+            try:
+                for line in segment:
+                    if not line.endswith(b"\n"):
+                        break  # last line of a segment cut short
+                    received, source, raw = line.rstrip(b"\n").split(b" ", 2)
+                    yield Record(int(received), source.decode(), raw.decode())
+            except EOFError:
+                logging.warning(f"Recording segment {path} is truncated")
+
+
+class ReplayStats(NamedTuple):
+    messages: int
+    errors: int
+    seconds: float
+
+    @property
+    def rate(self) -> float:
+        """Messages handled per second"""
+        return self.messages / self.seconds if self.seconds else float("inf")
+
+
+class StreamReplayer:
+    """Feeds a recording to a BotEventsHandler as its websocket connections would
+
+    User data goes to `message_handler`, prices of the shared feed to the listener the
+    handler subscribes to the feed. `source` selects the user data of another bot than the
+    handler's own, e.g. a production bot replayed into a test one.
+    """
+
+    def __init__(self, handler, price_stream: str = "miniTicker", source: Optional[str] = None):
+        from .market_data import PRICE_STREAMS  # which records its stream with this module
+
+        self.handler = handler
+        self.decode_price = combined_decoder(PRICE_STREAMS[price_stream][1])
+        self.source = source or user_source(handler.bot.id)
+
+    def replay(self, records: Iterable[Record], speed: Optional[float] = 1.0) -> ReplayStats:
+        """Deliver the records `speed` times faster than they were received, or as fast as possible with None"""
+        messages = errors = 0
+        first = None
+        started = time.perf_counter()
+        for record in records:
+            if record.source == MARKET_SOURCE:
+                message = self.decode_price(record.raw)
+                if message is None:
+                    continue
+                deliver = partial(self.handler._on_price, message.symbol, message.price)
+            elif record.source == self.source:
+                deliver = partial(self.handler.message_handler, None, record.raw)
+            else:
+                continue
+
+            if speed:
+                first = record.time if first is None else first
+                delay = (record.time - first) / 1e9 / speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                deliver()
+            except Exception as e:
+                errors += 1
+                logging.error(f"Replayed message failed: {e}")
+            messages += 1
+        return ReplayStats(messages, errors, time.perf_counter() - started)
@@ -0,0 +1,220 @@
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional, Tuple
+from uuid import UUID
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..database import SessionLocal
+from ..models import Bot, ExportWatermark, Order, OrderArchive, TradingCycle
+
+FORMATS = ("parquet", "arrow")
+TABLES = ("cycles", "orders")
+
+
+def _pyarrow():
+    # pyarrow is only needed by analytics exports, so it is not required to run the bot
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is required for trade history exports, install it with `pip install pyarrow`")
+    return pyarrow
+
+
+def _schemas():
+    pa = _pyarrow()
+    price = pa.decimal128(20, 8)
+    percentage = pa.decimal128(10, 2)
+    timestamp = pa.timestamp("us")
+
+    cycles = pa.schema([
+        ("id", pa.string()),
+        ("bot_id", pa.string()),
+        ("exchange", pa.string()),
+        ("symbol", pa.string()),
+        ("status", pa.string()),
+        ("amount", price),
+        ("price", price),
+        ("quantity", price),
+        ("grid_length", percentage),
+        ("first_order_offset", percentage),
+        ("num_orders", pa.int32()),
+        ("next_order_volume", percentage),
+        ("profit_percentage", percentage),
+        ("price_change_percentage", percentage),
+        ("archived_at", timestamp),
+        ("created_at", timestamp),
+        ("updated_at", timestamp),
+    ])
+    orders = pa.schema([
+        ("id", pa.string()),
+        ("cycle_id", pa.string()),
+        ("bot_id", pa.string()),
+        ("exchange", pa.string()),
+        ("symbol", pa.string()),
+        ("side", pa.string()),
+        ("time_in_force", pa.string()),
+        ("type", pa.string()),
+        ("status", pa.string()),
+        ("number", pa.int32()),
+        ("exchange_order_id", pa.int64()),
+        ("client_order_id", pa.string()),
+        ("price", price),
+        ("amount", price),
+        ("quantity", price),
+        ("quantity_filled", price),
+        ("exchange_order_data", pa.string()),
+        ("created_at", timestamp),
+        ("updated_at", timestamp),
+    ])
+    return {"cycles": cycles, "orders": orders}
+
+
+class TradeExporter:
+    """Streams the cycles and orders of a bot or of an account (API key) into Parquet or Arrow IPC files
+
+    Rows are read through server-side cursors and written `chunk_size` rows at a time, so memory
+    use does not depend on the size of the history.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session] = SessionLocal, chunk_size: int = 10000,
+                 safety_lag: timedelta = timedelta(seconds=float(os.getenv("EXPORT_SAFETY_LAG", "300")))):
+        self.session_factory = session_factory
+        self.chunk_size = chunk_size
+        self.safety_lag = safety_lag
+
+    @staticmethod
+    def scope(bot_id: Optional[UUID] = None, api_key: Optional[str] = None) -> str:
+        if bool(bot_id) == bool(api_key):
+            raise ValueError("Export either a bot or an account")
+        return f"bot:{bot_id}" if bot_id else f"account:{api_key}"
+
+    def _db_now(self) -> datetime:
+        db = self.session_factory()
+        try:
+            # In the session's time zone, as the updated_at stamps
+            return db.execute(select(func.now())).scalar().replace(tzinfo=None)
+        finally:
+            db.close()
+
+    def watermark(self, scope: str) -> Optional[datetime]:
+        db = self.session_factory()
+        try:
+            watermark = db.get(ExportWatermark, scope)
+            return watermark.exported_until if watermark else None
+        finally:
+            db.close()
+
+    def export_incremental(self, out_dir: str, format: str = "parquet",
+                           bot_id: Optional[UUID] = None, api_key: Optional[str] = None) -> dict:
+        """Export rows changed since the last watermark of the scope and move the watermark forward
+
+        The watermark is the latest `updated_at` written, so it follows the database clock. Rows are
+        stamped with the start of their transaction, and the bots keep some open across exchange
+        calls, so a row may commit well after its `updated_at`: only the rows older than
+        `safety_lag` are exported, the later ones are left to the next run.
+        """
+        scope = self.scope(bot_id, api_key)
+        since = self.watermark(scope)
+        until = self._db_now() - self.safety_lag
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        name = scope.replace(":", "-")
+
+        paths = {}
+        latest = since
+        for table in TABLES:
+            path = os.path.join(out_dir, f"{name}-{table}-{stamp}.{format}")
+            rows, table_latest = self.export(path, table, format, bot_id=bot_id, api_key=api_key, since=since,
+                                             until=until)
+            paths[table] = path
+            if table_latest and (latest is None or table_latest > latest):
+                latest = table_latest
+
+        if latest != since:
+            db = self.session_factory()
+            try:
+                db.merge(ExportWatermark(scope=scope, exported_until=latest))
+                db.commit()
+            finally:
+                db.close()
+
+        return paths
+
+    def export(self, path: str, table: str, format: str = "parquet",
+               bot_id: Optional[UUID] = None, api_key: Optional[str] = None,
+               since: Optional[datetime] = None, until: Optional[datetime] = None) -> Tuple[int, Optional[datetime]]:
+        """Write the rows of `table` updated after `since`, and up to `until`, to `path`
+
+        Returns the number of rows written and the latest `updated_at` among them.
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported export format: {format}")
+        if table not in TABLES:
+            raise ValueError(f"Unsupported export table: {table}")
+        self.scope(bot_id, api_key)
+
+        pa = _pyarrow()
+        schema = _schemas()[table]
+        if format == "parquet":
+            writer = pa.parquet.ParquetWriter(path, schema)
+        else:
+            writer = pa.ipc.new_file(path, schema)
+
+        rows = 0
+        latest = None
+        try:
+            for chunk in self._chunks(table, bot_id, api_key, since, until):
+                writer.write_batch(pa.RecordBatch.from_pylist(chunk, schema=schema))
+                rows += len(chunk)
+                chunk_latest = max(row["updated_at"] for row in chunk)
+                if latest is None or chunk_latest > latest:
+                    latest = chunk_latest
+        finally:
+            writer.close()
+
+        return rows, latest
+
+    def _statements(self, table, bot_id, api_key, since, until):
+        models = [TradingCycle] if table == "cycles" else [OrderArchive, Order]
+        for model in models:
+            columns = [column for column in model.__table__.columns if column.name in _schemas()[table].names]
+            if model is not TradingCycle:
+                columns.append(TradingCycle.bot_id)
+            statement = select(*columns)
+            if model is not TradingCycle:
+                statement = statement.join(TradingCycle, TradingCycle.id == model.cycle_id)
+
+            if bot_id:
+                statement = statement.where(TradingCycle.bot_id == bot_id)
+            else:
+                statement = statement.join(Bot, Bot.id == TradingCycle.bot_id).where(Bot.api_key == api_key)
+            if since:
+                statement = statement.where(model.updated_at > since)
+            if until:
+                statement = statement.where(model.updated_at <= until)
+
+            yield statement.order_by(model.updated_at, model.id)
+
+    def _chunks(self, table, bot_id, api_key, since, until) -> Iterator[list]:
+        db = self.session_factory()
+        try:
+            for statement in self._statements(table, bot_id, api_key, since, until):
+                result = db.execute(statement.execution_options(yield_per=self.chunk_size))
+                for partition in result.mappings().partitions():
+                    yield [self._row(row) for row in partition]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _row(row) -> dict:
+        values = dict(row)
+        for key in ("id", "bot_id", "cycle_id"):
+            if values.get(key) is not None:
+                values[key] = str(values[key])
+        if values.get("exchange_order_data") is not None:
+            values["exchange_order_data"] = json.dumps(values["exchange_order_data"])
+        return values
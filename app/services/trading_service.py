@@ -1,28 +1,140 @@
+from collections import Counter
+from contextlib import contextmanager, nullcontext
 from decimal import Decimal, ROUND_DOWN
-from typing import List, Callable
-from binance.spot import Spot
+from typing import Dict, List, Callable, Optional, Set, Tuple
+from ..client_order_ids import client_order_id, parse_client_order_id
 from ..models import Bot, TradingCycle, Order
 from ..enums import OrderType, SideType, TimeInForceType, OrderStatusType, CycleStatusType, BotStatusType
+from ..fixed_point import PERCENT_PLACES, from_units, price_change_trigger, symbol_assets, symbol_precision, to_units
+from ..grid_shift import GridLevel, GridShift, plan_grid_shift
+from .balance_cache import BalanceCache, Reservation
+from .engine_events import EngineEvents
+from .engine_snapshots import EngineSnapshots
+from .exchange_client import ExchangeClient, client_registry
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 import logging
 import os
+import threading
 import time
+from uuid import UUID
+
+# Dead band of a grid shift: open orders within this many price ticks and quantity steps of a
+# level of the new grid are kept as they are
+GRID_SHIFT_PRICE_TOLERANCE = int(os.getenv("GRID_SHIFT_PRICE_TOLERANCE", "1"))
+GRID_SHIFT_QUANTITY_TOLERANCE = int(os.getenv("GRID_SHIFT_QUANTITY_TOLERANCE", "1"))
 
 class TradingService:
-    def __init__(self, db: Session, bot: Bot):
-        self.client = Spot(
-            api_key=bot.api_key,
-            api_secret=bot.api_secret,
-            base_url='https://testnet.binance.vision' if os.getenv("BINANCE_TESTNET") else 'https://api.binance.com'
-        )
+    def __init__(self, db: Session, bot: Bot, session_factory: Optional[Callable[[], Session]] = None,
+                 events: Optional[EngineEvents] = None, balances: Optional[BalanceCache] = None,
+                 snapshots: Optional[EngineSnapshots] = None):
+        self.client = self._new_client(bot)
+        self.credentials = (bot.api_key, bot.api_secret)  # of the client, kept until the running cycle completes
         self.db = db
         self.bot = bot
+        self.session_factory = session_factory
+        self.events = events
+        self.balances = balances  # for the pre-trade balance checks, skipped without
+        self.snapshots = snapshots  # of the engine, the one of a completed cycle is dropped
+        self._grid_trigger = None  # (cycle id, price and percentage, trigger price in fixed point units)
+        # Orders of the cycle by client order id, and the next attempt by side and level, see _index_orders
+        self._indexed_cycle = None
+        self._order_ids: Dict[str, UUID] = {}
+        self._attempts: Counter = Counter()
+        # Held for each unit of work, engine events and control commands may come from different threads
+        self.lock = threading.RLock()
         self.cycle = bot.trading_cycles.filter(
             TradingCycle.status == CycleStatusType.ACTIVE
         ).first()
 
-    def launch(self, on_stop: Callable[['Bot'], None]):
+    @staticmethod
+    def _new_client(bot: Bot) -> ExchangeClient:
+        return ExchangeClient(client_registry.get(bot.api_key, bot.api_secret))
+
+    @contextmanager
+    def unit_of_work(self):
+        """Bind the service to a fresh session for one event or batch and release it afterwards
+
+        Without a session factory the service keeps working on the session it was created with.
+        """
+        with self.lock:
+            if self.session_factory is None:
+                yield self.db
+                return
+
+            db = self.session_factory()
+            try:
+                self.db = db
+                self.bot = db.merge(self.bot, load=False)
+                if self.cycle is not None:
+                    self.cycle = db.merge(self.cycle, load=False)
+                yield db
+            except Exception:
+                db.rollback()
+                raise
+            finally:
+                # The bot and cycle stay usable as detached objects until the next unit of work
+                db.expunge_all()
+                db.close()
+                self.db = None
+
+    def reload_bot(self) -> Set[str]:
+        """Read the bot settings again after they were changed outside the engine, return the changed ones
+
+        The running cycle keeps the settings it was started with, the new ones apply from the next cycle.
+        This includes the credentials: the orders of the running cycle live on the previous account.
+        """
+        with self.unit_of_work() as db:
+            before = {column.key: getattr(self.bot, column.key) for column in Bot.__table__.columns}
+            db.refresh(self.bot)
+            changed = {key for key, value in before.items() if getattr(self.bot, key) != value}
+
+        if changed & {"api_key", "api_secret"} and (self.cycle is None or self.cycle.status != CycleStatusType.ACTIVE):
+            self.switch_credentials()
+        return changed
+
+    @property
+    def api_key(self) -> str:
+        """Account traded on now, the bot's previous one until the running cycle completes"""
+        return self.credentials[0]
+
+    def switch_credentials(self) -> bool:
+        """Trade on the bot's current credentials if they changed, return whether they did"""
+        credentials = (self.bot.api_key, self.bot.api_secret)
+        if credentials == self.credentials:
+            return False
+        self.client = self._new_client(self.bot)
+        self.credentials = credentials
+        return True
+
+    def publish(self, event: str, **data):
+        """Report a state change to the engine event listeners, such as open dashboards"""
+        if self.events:
+            self.events.publish(self.bot.id, event, data)
+
+    def publish_order(self, order: Order):
+        self.publish("order", **self._order_state(order))
+
+    def publish_cycle(self):
+        self.publish("cycle", **self._cycle_state())
+
+    def publish_snapshot(self):
+        """Publish the whole state of the current cycle, once when the bot is installed"""
+        orders = self.cycle.orders.order_by(Order.number).all() if self.cycle else []
+        self.publish("snapshot", cycle=self._cycle_state() if self.cycle else None,
+                     orders=[self._order_state(order) for order in orders])
+
+    def _cycle_state(self) -> dict:
+        return dict(id=str(self.cycle.id), status=self.cycle.status, symbol=self.cycle.symbol,
+                    price=self.cycle.price, quantity=self.cycle.quantity)
+
+    @staticmethod
+    def _order_state(order: Order) -> dict:
+        return dict(id=str(order.id), cycle_id=str(order.cycle_id), side=order.side, price=order.price,
+                    quantity=order.quantity, quantity_filled=order.quantity_filled, status=order.status,
+                    number=order.number)
+
+    def launch(self, on_stop: Optional[Callable[['Bot'], None]] = None):
         """Launch a new trading cycle for the bot"""
 
         if not self.bot.is_active:  # bot was stopped
@@ -37,12 +149,77 @@ class TradingService:
             self.bot.status = BotStatusType.STOPPED
             self.bot.is_active = False
             self.db.commit()
-            on_stop(self.bot)
+            if on_stop:
+                on_stop(self.bot)
             return
 
         else:  # bot should automatically start a new cycle
             self.start_new_cycle()
 
+    def snapshot_state(self) -> dict:
+        """In-memory state of the bot worth keeping across a restart, see EngineSnapshots"""
+        if not self.cycle:
+            return {"cycle_id": None}
+
+        orders = self.cycle.orders.order_by(Order.number).all()
+        return {
+            "cycle_id": str(self.cycle.id),
+            "cycle_price": self.cycle.price,
+            "grid_trigger": self._grid_trigger[1] if self._grid_trigger else None,
+            "open_orders": {
+                str(order.exchange_order_id): [order.status, order.quantity_filled]
+                for order in orders if order.status in (OrderStatusType.NEW, OrderStatusType.PARTIALLY_FILLED)
+            },
+            "ledger": self._ledger(orders),
+        }
+
+    @staticmethod
+    def _ledger(orders: List[Order]) -> dict:
+        bought_quantity = sum((order.quantity_filled for order in orders if order.side == SideType.BUY), Decimal(0))
+        bought_cost = sum((order.price * order.quantity_filled for order in orders if order.side == SideType.BUY),
+                          Decimal(0))
+        sold_quantity = sum((order.quantity_filled for order in orders if order.side == SideType.SELL), Decimal(0))
+        return {"bought_quantity": str(bought_quantity), "bought_cost": str(bought_cost),
+                "sold_quantity": str(sold_quantity)}
+
+    def restore(self, snapshot: dict) -> Optional[List[dict]]:
+        """Resume the active cycle from an engine snapshot instead of launching it
+
+        Returns the exchange orders that changed since the snapshot, to be processed like
+        execution reports, or None when the snapshot doesn't match the stored cycle and the
+        bot has to be launched. Only one request lists the open orders; orders are queried
+        one by one only if they are no longer open.
+        """
+        if not self.bot.is_active or not self.cycle or snapshot.get("cycle_id") != str(self.cycle.id):
+            return None
+
+        orders = self.cycle.orders.order_by(Order.number).all()
+        if not orders:  # the grid still has to be placed
+            return None
+        if self._ledger(orders) != snapshot["ledger"]:
+            logging.info(f"Snapshot of bot {self.bot.id} is behind the stored orders, launching instead")
+            return None
+
+        known = snapshot["open_orders"]
+        open_orders = {str(order["orderId"]): order for order in self.client.get_open_orders(symbol=self.cycle.symbol)}
+        changed = []
+        for order in orders:
+            if order.status not in (OrderStatusType.NEW, OrderStatusType.PARTIALLY_FILLED):
+                continue
+
+            exchange_order_id = str(order.exchange_order_id)
+            exchange_order = open_orders.get(exchange_order_id) or self.client.get_order(
+                symbol=order.symbol, orderId=order.exchange_order_id
+            )
+            status, quantity_filled = known.get(exchange_order_id, (order.status, order.quantity_filled))
+            if exchange_order["status"] != status or Decimal(exchange_order["executedQty"]) != Decimal(quantity_filled):
+                changed.append(exchange_order)
+
+        if snapshot.get("grid_trigger") is not None and Decimal(snapshot["cycle_price"]) == self.cycle.price:
+            self._grid_trigger = ((self.cycle.id, self.cycle.price, self.cycle.price_change_percentage),
+                                  snapshot["grid_trigger"])
+        return changed
+
     def calculate_grid_prices(self, market_price: Decimal) -> List[Decimal]:
         """Calculate grid order prices"""
         first_order_price = market_price * (Decimal('1') - self.cycle.first_order_offset / Decimal('100'))
@@ -56,17 +233,9 @@ class TradingService:
         
         return prices
 
-    # TODO: we need to get the step size from the client dynamically
     def _step_size(self, symbol: str) -> Decimal:
         """Get the step size for a symbol"""
-        if symbol == "BTCUSDT":
-            return Decimal('0.00001')
-        elif symbol == "ETHUSDT":
-            return Decimal('0.0001')
-        elif symbol == "PEPEUSDT":
-            return Decimal('0.00000001')
-        else:
-            raise ValueError(f"Unsupported symbol: {symbol}")
+        return symbol_precision(symbol).step_size
 
     def calculate_grid_quantities(self, prices: List[Decimal]) -> List[Decimal]:
         """Calculate quantities for each grid level"""        
@@ -89,9 +258,52 @@ class TradingService:
         
         return quantities
 
-    def create_binance_order(self, side: str, price: Decimal, quantity: Decimal, number: int):
-        """Create a Binance order and corresponding Order record"""
+    def create_binance_order(self, side: str, price: Decimal, quantity: Decimal, number: int,
+                             reservation: Optional[Reservation] = None):
+        """Create a Binance order and corresponding Order record
+
+        The record is committed as soon as the exchange accepted the order, so that a later
+        failure of the caller can't roll back an order that is live. The order's funds are
+        checked before it is sent, unless the caller reserved them already.
+        """
+
+        price, quantity = self._order_values(price, quantity)
+        funds = self.order_funds(side, price, quantity)
+
+        client_id = self.next_client_order_id(side, number)
+        # A reservation of the caller covers more orders, it is released by the caller
+        with nullcontext(reservation) if reservation else self.reserve(side, funds) as reservation:
+            try:
+                binance_order = self.client.new_order(
+                    symbol=self.cycle.symbol,
+                    side=side,
+                    type="LIMIT",
+                    timeInForce="GTC",
+                    quantity=str(quantity),
+                    price=str(price),
+                    newClientOrderId=client_id
+                )
+                reservation.settle(funds, binance_order.get("transactTime", 0))
+                self._add_order(side, price, quantity, number, binance_order, client_id)
 
+            except Exception as e:
+                raise Exception(f"Failed to create order: {e}")
+
+    @staticmethod
+    def order_funds(side: str, price: Decimal, quantity: Decimal) -> Decimal:
+        """Amount of its funding asset an order locks: the quote asset to buy, the base asset to sell"""
+        return price * quantity if side == "BUY" else quantity
+
+    def reserve(self, side: str, funds: Decimal) -> Reservation:
+        """Set aside the funds of orders about to be sent, InsufficientBalanceError when the account lacks them"""
+        base_asset, quote_asset = symbol_assets(self.cycle.symbol)
+        asset = quote_asset if side == "BUY" else base_asset
+        if not self.balances:
+            return Reservation(None, self.api_key, asset, funds)
+        return self.balances.reserve(self.api_key, asset, funds)
+
+    def _order_values(self, price: Decimal, quantity: Decimal) -> Tuple[Decimal, Decimal]:
+        """Check the notional value of an order and round its price and quantity to the symbol's precision"""
         notional_value = price * quantity
         if self.cycle.symbol == "PEPEUSDT" and notional_value < 1:  # TODO: Make this dynamic
             raise Exception(f"Order notional value {notional_value} is below minimum {1}")
@@ -99,42 +311,73 @@ class TradingService:
             raise Exception(f"Order notional value {notional_value} is below minimum {5}")
 
         # rounding
-        quantity = Decimal(quantity).quantize(self._step_size(self.cycle.symbol), rounding=ROUND_DOWN)
-        if self.cycle.symbol == "PEPEUSDT":
-            price = round(price, 8)
-        else:
-            price = round(price, 2)
-
-        try:
-            binance_order = self.client.new_order(
-                symbol=self.cycle.symbol,
-                side=side,
-                type="LIMIT",
-                timeInForce="GTC",
-                quantity=str(quantity),
-                price=str(price)
-            )
-            
-            order = Order(
-                exchange=self.bot.exchange,
-                symbol=self.cycle.symbol,
-                side=SideType.BUY if side == "BUY" else SideType.SELL,
-                time_in_force=TimeInForceType.GTC,
-                type=OrderType.LIMIT,
-                price=price,
-                quantity=quantity,
-                amount=price * quantity,
-                status=OrderStatusType.NEW,
-                number=number,
-                exchange_order_id=binance_order["orderId"],
-                exchange_order_data=binance_order,
-                cycle_id=self.cycle.id
-            )
-            self.db.add(order)
-            self.db.commit()
-            
-        except Exception as e:
-            raise Exception(f"Failed to create order: {e}")
+        precision = symbol_precision(self.cycle.symbol)
+        quantity = Decimal(quantity).quantize(precision.step_size, rounding=ROUND_DOWN)
+        price = round(price, precision.price_places)
+        return price, quantity
+
+    def _index_orders(self):
+        """Load the client order ids of the cycle's orders, once per cycle"""
+        if self._indexed_cycle == self.cycle.id:
+            return
+        rows = self.db.query(Order.id, Order.client_order_id).filter(Order.cycle_id == self.cycle.id).all()
+        self._order_ids = {client_id: order_id for order_id, client_id in rows if client_id}
+        self._attempts = Counter()
+        for client_id in self._order_ids:
+            self._count_attempt(client_id)
+        self._indexed_cycle = self.cycle.id
+
+    def _count_attempt(self, client_id: str):
+        # By the level in the id: a grid shift may have moved the order to another one since
+        parsed = parse_client_order_id(client_id)
+        if parsed:
+            key = (parsed.side, parsed.number)
+            self._attempts[key] = max(self._attempts[key], parsed.attempt + 1)
+
+    def next_client_order_id(self, side: str, number: int) -> str:
+        """Client order id of the next order on a side and level of the cycle, the same until it is stored"""
+        self._index_orders()
+        return client_order_id(self.bot.id, self.cycle.id, side, number, self._attempts[(side, number)])
+
+    def find_order(self, client_order_id: str, exchange_order_id: int) -> Optional[Order]:
+        """Order of the cycle an execution report is about, by the order id its client order id maps to
+
+        The session's identity map answers without a query when the order is loaded already.
+        """
+        self._index_orders()
+        order_id = self._order_ids.get(client_order_id)
+        if order_id is not None:
+            return self.db.get(Order, order_id)
+        # Orders placed before client order ids were
+        return self.cycle.orders.filter(Order.exchange_order_id == str(exchange_order_id)).first()
+
+    def _add_order(self, side: str, price: Decimal, quantity: Decimal, number: int, binance_order: dict,
+                   client_id: Optional[str] = None) -> Order:
+        self._index_orders()
+        order = Order(
+            exchange=self.bot.exchange,
+            symbol=self.cycle.symbol,
+            side=SideType.BUY if side == "BUY" else SideType.SELL,
+            time_in_force=TimeInForceType.GTC,
+            type=OrderType.LIMIT,
+            price=price,
+            quantity=quantity,
+            quantity_filled=Decimal(0),
+            amount=price * quantity,
+            status=OrderStatusType.NEW,
+            number=number,
+            exchange_order_id=binance_order["orderId"],
+            client_order_id=client_id,
+            exchange_order_data=binance_order,
+            cycle_id=self.cycle.id
+        )
+        self.db.add(order)
+        self.db.commit()
+        if order.client_order_id:
+            self._count_attempt(order.client_order_id)
+            self._order_ids[order.client_order_id] = order.id
+        self.publish_order(order)
+        return order
 
     # this is a hack to ensure the market price is above 60000 on BTCUSDT pair
     # to avoid failures "Filter failure: PERCENT_PRICE_BY_SIDE"
@@ -155,15 +398,24 @@ class TradingService:
         market_price = self.fetch_market_price()
         prices = self.calculate_grid_prices(market_price)
         quantities = self.calculate_grid_quantities(prices)
-        
-        for i, (price, quantity) in enumerate(zip(prices, quantities)):
-            self.create_binance_order(
-                side="BUY",
-                price=price,
-                quantity=quantity,
-                number=i + 1
-            )
+        orders = [self._order_values(price, quantity) for price, quantity in zip(prices, quantities)]
+
+        # The whole grid is funded, or no order is sent
+        with self.reserve("BUY", sum(price * quantity for price, quantity in orders)) as reservation:
+            for i, (price, quantity) in enumerate(orders):
+                self.create_binance_order(
+                    side="BUY",
+                    price=price,
+                    quantity=quantity,
+                    number=i + 1,
+                    reservation=reservation
+                )
+
+        self._update_cycle_quantity()
+        self.db.commit()
+        self.publish_cycle()
 
+    def _update_cycle_quantity(self):
         self.cycle.quantity = self.db.query(
             func.sum(Order.quantity)
         ).filter(
@@ -172,8 +424,6 @@ class TradingService:
             Order.status == OrderStatusType.NEW
         ).scalar()
 
-        self.db.commit()
-
     def sell_quantity_filled(self) -> Decimal:
         return self.db.query(
             func.sum(Order.quantity_filled)
@@ -192,18 +442,19 @@ class TradingService:
         # Calculate average buy price and total quantity
         total_quantity = sum(order.quantity_filled for order in self.buy_orders())
         total_cost = sum(order.price * order.quantity_filled for order in self.buy_orders())
-        avg_price = total_cost / total_quantity
 
-        # Calculate take profit price
-        take_profit_price = avg_price * (1 + self.cycle.profit_percentage / 100)
-        
         self.create_binance_order(
             side = "SELL",
-            price = take_profit_price,
+            price = self.take_profit_price(total_quantity, total_cost),
             quantity = total_quantity - self.sell_quantity_filled(),
             number = len(self.buy_orders()) + 1
         )
 
+    def take_profit_price(self, total_quantity: Decimal, total_cost: Decimal) -> Decimal:
+        """Price selling the bought quantity at the cycle's profit percentage over the average buy price"""
+        avg_price = total_cost / total_quantity
+        return avg_price * (1 + self.cycle.profit_percentage / 100)
+
     def start_new_cycle(self) -> TradingCycle:
         """Start a new trading cycle for the bot"""
         # Check for existing active cycle
@@ -233,6 +484,7 @@ class TradingService:
         
         self.db.add(self.cycle)
         self.db.commit()
+        self.publish_cycle()
         
         # Place initial grid orders
         self.place_grid_orders()
@@ -251,13 +503,24 @@ class TradingService:
                     symbol=order.symbol,
                     orderId=order.exchange_order_id
                 )
-                if response["status"] == "CANCELED":
-                    order.quantity_filled = Decimal(response["executedQty"])
-                    order.status = OrderStatusType.CANCELED
-                    self.db.commit()
+                self._order_canceled(order, response)
             except Exception as e:
                 logging.error(f"Failed to cancel order {order.exchange_order_id}: {e}")
 
+        self.db.commit()
+
+    def _order_canceled(self, order: Order, response: dict):
+        if response["status"] == "CANCELED":
+            order.quantity_filled = Decimal(response["executedQty"])
+            order.status = OrderStatusType.CANCELED
+            self.publish_order(order)
+            if self.balances:
+                side = "BUY" if order.side == SideType.BUY else "SELL"
+                base_asset, quote_asset = symbol_assets(order.symbol)
+                self.balances.unlock(self.api_key, quote_asset if side == "BUY" else base_asset,
+                                     self.order_funds(side, order.price, order.quantity - order.quantity_filled),
+                                     response.get("transactTime", 0))
+
     def update_take_profit_order(self):
         """Update or place take profit order after a buy order is filled"""
         tp_order = self.cycle.orders.filter(
@@ -272,10 +535,9 @@ class TradingService:
                     orderId=tp_order.exchange_order_id
                 )
 
-                if response["status"] == "CANCELED":
-                    tp_order.quantity_filled = Decimal(response["executedQty"])
-                    tp_order.status = OrderStatusType.CANCELED
-                    self.db.commit()
+                # Its remaining quantity is free again for the new take profit order
+                self._order_canceled(tp_order, response)
+                self.db.commit()
 
             except Exception as e:
                 logging.error(f"Failed to cancel take profit order: {e}")
@@ -291,29 +553,148 @@ class TradingService:
             # Mark cycle as completed
             self.cycle.status = CycleStatusType.COMPLETED
             self.db.commit()
-            
+            self.publish_cycle()
+            if self.snapshots:
+                self.snapshots.remove(self.bot.id)
+            # Nothing runs on the previous credentials anymore
+            self.switch_credentials()
+
             # Start new cycle if bot is still active
             if self.bot.is_active:
                 self.start_new_cycle()
 
+    def grid_update_due(self, price_units: int) -> bool:
+        """Whether a price, in fixed point units, moved up enough from the cycle price to shift the grid
+
+        Called on every tick: the trigger price is computed once per cycle price and then
+        compared as an integer.
+        """
+        if not self.cycle:
+            return False
+
+        key = (self.cycle.id, self.cycle.price, self.cycle.price_change_percentage)
+        if self._grid_trigger is None or self._grid_trigger[0] != key:
+            self._grid_trigger = (key, price_change_trigger(
+                to_units(self.cycle.price), to_units(self.cycle.price_change_percentage, PERCENT_PLACES)
+            ))
+        return price_units >= self._grid_trigger[1]
+
     def check_grid_update(self, current_price: Decimal):
         """Check if grid needs to be updated based on price movement"""
-        if not self.cycle:
+        if not self.grid_update_due(to_units(current_price)):
             return
 
-        price_increase = (current_price - self.cycle.price) / self.cycle.price * 100
         order_statuses = [status[0] for status in self.db.query(
             func.distinct(Order.status)
         ).filter(Order.cycle_id == self.cycle.id).all()]
 
-        if price_increase >= self.cycle.price_change_percentage and order_statuses == [OrderStatusType.NEW]:
+        if order_statuses == [OrderStatusType.NEW]:
             # Update cycle price
             self.cycle.price = current_price
             self.db.commit()
+            self.publish_cycle()
 
-            # Cancel existing orders and create new grid
-            self.cancel_cycle_orders()
-            self.place_grid_orders()
+            self.shift_grid(current_price)
+
+    def plan_grid_shift(self, market_price: Decimal) -> GridShift[Order]:
+        """Diff the open grid orders against the grid for `market_price`"""
+        prices = self.calculate_grid_prices(market_price)
+        quantities = self.calculate_grid_quantities(prices)
+        levels = []
+        for i, (price, quantity) in enumerate(zip(prices, quantities)):
+            price, quantity = self._order_values(price, quantity)
+            levels.append(GridLevel(i + 1, to_units(price), to_units(quantity)))
+
+        orders = self.cycle.orders.filter(
+            Order.side == SideType.BUY,
+            Order.status == OrderStatusType.NEW
+        ).all()
+        precision = symbol_precision(self.cycle.symbol)
+        return plan_grid_shift(
+            [(order, GridLevel(order.number, to_units(order.price), to_units(order.quantity))) for order in orders],
+            levels,
+            price_tolerance=GRID_SHIFT_PRICE_TOLERANCE * to_units(precision.tick_size),
+            quantity_tolerance=GRID_SHIFT_QUANTITY_TOLERANCE * to_units(precision.step_size),
+        )
+
+    def shift_grid(self, market_price: Decimal):
+        """Move the grid to `market_price`, only touching the levels that changed
+
+        Moved orders are cancelled and replaced in one request each, so the other levels
+        stay in the market during the shift.
+        """
+        shift = self.plan_grid_shift(market_price)
+        replacements = [(order, self._order_values(from_units(level.price), from_units(level.quantity)), level.number)
+                        for order, level in shift.replace]
+        placements = [self._order_values(from_units(level.price), from_units(level.quantity)) + (level.number,)
+                      for level in shift.place]
+
+        # Fail before any request when the account can't fund the shifted grid
+        released = sum(order.price * (order.quantity - order.quantity_filled)
+                       for order in shift.cancel + [order for order, _, _ in replacements])
+        needed = sum(price * quantity for _, (price, quantity), _ in replacements) + \
+            sum(price * quantity for price, quantity, _ in placements)
+        if self.balances and needed > released:
+            self.balances.check(self.api_key, symbol_assets(self.cycle.symbol)[1], needed - released)
+
+        for order, level in shift.keep:
+            if order.number != level.number:
+                order.number = level.number
+                self.publish_order(order)
+        self.db.commit()
+
+        # Cancelled first, their funds may be needed by the other levels. Every change made on the
+        # exchange is committed right away, a later failure must not roll it back
+        for order in shift.cancel:
+            try:
+                self._order_canceled(order, self.client.cancel_order(
+                    symbol=order.symbol,
+                    orderId=order.exchange_order_id
+                ))
+                self.db.commit()
+            except Exception as e:
+                logging.error(f"Failed to cancel order {order.exchange_order_id}: {e}")
+
+        for order, (price, quantity), number in replacements:
+            funds = price * quantity
+            client_id = self.next_client_order_id("BUY", number)
+            with self.reserve("BUY", max(funds - order.price * (order.quantity - order.quantity_filled), 0)) \
+                    as reservation:
+                try:
+                    response = self.client.cancel_and_replace(
+                        symbol=self.cycle.symbol,
+                        side="BUY",
+                        type="LIMIT",
+                        cancelReplaceMode="STOP_ON_FAILURE",
+                        cancelOrderId=order.exchange_order_id,
+                        timeInForce="GTC",
+                        quantity=str(quantity),
+                        price=str(price),
+                        newClientOrderId=client_id
+                    )
+                except Exception as e:
+                    # The old order may have been filled meanwhile, or cancelled without its replacement
+                    logging.error(f"Failed to replace order {order.exchange_order_id}: {e}")
+                    cancel_response = (getattr(e, "error_data", None) or {}).get("cancelResponse")
+                    if cancel_response:
+                        self._order_canceled(order, cancel_response)
+                        self.db.commit()
+                    continue
+                self._order_canceled(order, response["cancelResponse"])
+                reservation.settle(funds, response["newOrderResponse"].get("transactTime", 0))
+                self._add_order("BUY", price, quantity, number, response["newOrderResponse"], client_id)
+
+        for price, quantity, number in placements:
+            self.create_binance_order(
+                side="BUY",
+                price=price,
+                quantity=quantity,
+                number=number
+            )
+
+        self._update_cycle_quantity()
+        self.db.commit()
+        self.publish_cycle()
 
     def query_open_orders(self):
         """Query open orders for the cycle"""
@@ -330,11 +711,13 @@ class TradingService:
 
                 order.status = binance_order["status"]
                 order.quantity_filled = Decimal(binance_order["executedQty"])
-                self.db.commit()
+                self.publish_order(order)
 
             except Exception as e:
                 logging.error(f"Failed to query order {order.exchange_order_id}: {e}")
 
+        self.db.commit()
+
         return orders
 
     def old_cycles_profit(self):
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Per tick cost of the grid update check, with Decimal and with fixed point units
+
+    python -m benchmarks.fixed_point [--ticks 1000000]
+"""
+import argparse
+import random
+import timeit
+from decimal import Decimal
+
+from app.fixed_point import PERCENT_PLACES, parse_units, price_change_trigger, to_units
+
+
+def ticks(count: int):
+    rng = random.Random(0)
+    return [f"{rng.uniform(95000, 105000):.8f}" for _ in range(count)]
+
+
+def decimal_check(messages, reference: Decimal, percentage: Decimal):
+    due = 0
+    for text in messages:
+        price = Decimal(text)
+        if (price - reference) / reference * 100 >= percentage:
+            due += 1
+    return due
+
+
+def fixed_point_check(messages, reference: Decimal, percentage: Decimal):
+    trigger = price_change_trigger(to_units(reference), to_units(percentage, PERCENT_PLACES))
+    due = 0
+    for text in messages:
+        if parse_units(text) >= trigger:
+            due += 1
+    return due
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ticks", type=int, default=1000000)
+    args = parser.parse_args()
+
+    messages = ticks(args.ticks)
+    reference, percentage = Decimal("100000.00000000"), Decimal("1.00")
+    assert decimal_check(messages, reference, percentage) == fixed_point_check(messages, reference, percentage)
+
+    results = {}
+    for name, check in (("decimal", decimal_check), ("fixed point", fixed_point_check)):
+        seconds = min(timeit.repeat(lambda: check(messages, reference, percentage), number=1, repeat=3))
+        results[name] = seconds
+        print(f"{name:>12}: {seconds / args.ticks * 1e9:7.1f} ns/tick, {args.ticks / seconds:12,.0f} ticks/s")
+    print(f"     speedup: {results['decimal'] / results['fixed point']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
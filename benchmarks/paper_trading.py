@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""Per tick cost of paper trading with many bots on one symbol
+
+    python -m benchmarks.paper_trading [--bots 5000] [--ticks 20000]
+
+Bots get random grid and take profit settings, the ticks are a random walk.
+"""
+import argparse
+import logging
+import random
+import time
+from decimal import Decimal
+from unittest.mock import Mock
+from uuid import uuid4
+
+from app.models import PaperBot
+from app.services.paper_trading import PaperTrading
+
+
+def paper_bots(count: int):
+    rng = random.Random(0)
+    return [PaperBot(
+        id=uuid4(), name=f"Paper {i}", symbol="BTCUSDT", amount=Decimal(rng.choice([1000, 5000, 10000])),
+        grid_length=Decimal(rng.choice([5, 10, 20])), first_order_offset=Decimal(rng.choice(["0.5", "1", "2"])),
+        num_orders=rng.choice([3, 5, 10]), next_order_volume=Decimal(rng.choice([0, 20, 50])),
+        profit_percentage=Decimal(rng.choice(["0.5", "1", "2"])),
+        price_change_percentage=Decimal(rng.choice(["0.5", "1", "2"])), is_active=True
+    ) for i in range(count)]
+
+
+def ticks(count: int):
+    rng = random.Random(1)
+    price = 100000.0
+    for _ in range(count):
+        price *= 1 + rng.gauss(0, 0.0005)
+        yield f"{price:.8f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bots", type=int, default=5000)
+    parser.add_argument("--ticks", type=int, default=20000)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)  # small remainders below the minimum notional
+
+    paper_trading = PaperTrading(Mock(), Mock())
+    for bot in paper_bots(args.bots):
+        paper_trading.add(bot)
+
+    messages = list(ticks(args.ticks))
+    paper_trading.on_price("BTCUSDT", messages[0])  # places every grid
+    started = time.perf_counter()
+    for message in messages[1:]:
+        paper_trading.on_price("BTCUSDT", message)
+    seconds = time.perf_counter() - started
+
+    print(f"{args.bots} bots, {len(paper_trading.books['BTCUSDT'])} resting orders, "
+          f"{len(paper_trading.completed)} completed cycles")
+    print(f"{seconds / args.ticks * 1e6:7.1f} us/tick, {args.ticks / seconds:10,.0f} ticks/s")
+
+
+if __name__ == "__main__":
+    main()
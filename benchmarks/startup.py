@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""Startup time of the web process, broken down into imports, schema and bot warmup
+
+    python -m benchmarks.startup [--bots 50] [--latency 0.05] [--database-url sqlite:///startup.db]
+
+- import: `import app.main` in a fresh interpreter, with the packages that take the most of it;
+- schema: `create_all` on an empty database, then on the existing schema, which is what
+  every start pays unless CREATE_TABLES=0;
+- warmup: installing the bots against a mocked exchange answering after --latency seconds,
+  with the time of each bot. Bots warm up side by side, the total is close to the slowest one;
+  on SQLite the writes of the bots queue up behind each other, use Postgres for real figures.
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from decimal import Decimal
+from unittest.mock import patch
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.enums import BotStatusType, ExchangeType
+from app.models import Base, Bot
+from app.services.bot_events_handler import BotEventsHandler
+from app.services.bot_manager import BotManager
+from app.services.trading_service import TradingService
+from benchmarks.stream_replay import mocked_exchange
+
+IMPORT_SCRIPT = "import time; started = time.perf_counter(); import app.main; print(time.perf_counter() - started)"
+
+
+def import_time(database_url: str):
+    """Seconds to import app.main, and microseconds spent by top level package"""
+    env = dict(os.environ, DATABASE_URL=database_url, LOG_LEVEL="ERROR")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT], env=env,
+                            capture_output=True, text=True, check=True)
+    packages = Counter()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "self [us]" not in line:
+            self_us, _, name = line[len("import time:"):].split("|")
+            packages[name.strip().split(".")[0]] += int(self_us)
+    return float(result.stdout.split()[-1]), packages
+
+
+ORDER_IDS = itertools.count(10000)  # unique over the exchanges of all the bots
+
+
+def slow_exchange(price: str, latency: float):
+    client = mocked_exchange(price)
+    client.new_listen_key.return_value = {"listenKey": "startup"}
+    client.new_order.side_effect = lambda **kwargs: {"orderId": next(ORDER_IDS), "status": "NEW",
+                                                     "executedQty": "0", "cummulativeQuoteQty": "0"}
+    for name in ("ticker_price", "new_order", "new_listen_key"):
+        method = getattr(client, name)
+
+        def delayed(*args, answer=method.side_effect, value=method.return_value, **kwargs):
+            time.sleep(latency)
+            return answer(*args, **kwargs) if answer else value
+
+        method.side_effect = delayed
+    return client
+
+
+def bots(count: int):
+    return [Bot(id=uuid4(), name=f"Startup {i}", exchange=ExchangeType.BINANCE, symbol="BTCUSDT",
+                amount=Decimal(1000), grid_length=Decimal(10), first_order_offset=Decimal(1), num_orders=5,
+                next_order_volume=Decimal(5), profit_percentage=Decimal(1), price_change_percentage=Decimal(1),
+                status=BotStatusType.RUNNING, upper_price_limit=Decimal(10 ** 9), is_active=True,
+                api_key=f"startup-{i}", api_secret="startup") for i in range(count)]
+
+
+async def warm_up(manager: BotManager, bots):
+    times = []
+
+    async def install(bot):
+        started = time.perf_counter()
+        await manager.install(bot)
+        times.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(install(bot) for bot in bots))
+    return time.perf_counter() - started, times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--bots", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds of every exchange call")
+    parser.add_argument("--database-url", help="empty database to use, a temporary SQLite file by default")
+    parser.add_argument("--top", type=int, default=8, help="packages listed in the import breakdown")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url or f"sqlite:///{os.path.join(directory, 'startup.db')}"
+
+        seconds, packages = import_time(database_url)
+        print(f"import app.main: {seconds:.3f}s")
+        for package, microseconds in packages.most_common(args.top):
+            print(f"  {package:<20} {microseconds / 1e6:.3f}s")
+
+        engine = create_engine(database_url)
+        started = time.perf_counter()
+        Base.metadata.create_all(bind=engine)
+        created = time.perf_counter() - started
+        started = time.perf_counter()
+        Base.metadata.create_all(bind=engine)
+        print(f"schema: {created:.3f}s to create, {time.perf_counter() - started:.3f}s to check")
+
+        session_factory = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+        with session_factory() as db:
+            db.add_all(bots(args.bots))
+            db.commit()
+            active_bots = db.query(Bot).all()
+
+        manager = BotManager(TradingService, BotEventsHandler)
+        with patch("app.services.bot_manager.EngineSessionLocal", session_factory), \
+                patch.object(TradingService, "_new_client",
+                             side_effect=lambda *_: slow_exchange("100000", args.latency)), \
+                patch("app.services.bot_events_handler.SpotWebsocketStreamClient"):
+            total, times = asyncio.run(warm_up(manager, active_bots))
+        manager.release_all()
+        engine.dispose()
+
+    times.sort()
+    print(f"warmup of {len(times)} bots ({args.latency * 1000:.0f}ms exchange latency): {total:.3f}s, "
+          f"per bot median {statistics.median(times):.3f}s, max {times[-1]:.3f}s, sum {sum(times):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
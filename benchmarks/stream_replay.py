@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Replay a stream recording into one bot, against a mocked exchange and an in-memory database
+
+    python -m benchmarks.stream_replay <recording dir> [--speed 10] [--symbol BTCUSDT] [--source user:<bot id>]
+
+Without --speed the messages are delivered as fast as the bot handles them, which gives
+its maximum sustainable event rate on the traffic shape of the recording. User data of
+the recorded bot (--source) refers to exchange orders the mocked exchange never placed;
+those reports are handled as unknown orders.
+"""
+import argparse
+import logging
+from decimal import Decimal
+from unittest.mock import Mock, patch
+from uuid import uuid4
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.enums import BotStatusType, ExchangeType
+from app.models import Base, Bot
+from app.services.bot_events_handler import BotEventsHandler
+from app.services.stream_recorder import StreamReplayer, read_recording
+from app.services.trading_service import TradingService
+
+
+def mocked_exchange(price: str) -> Mock:
+    client = Mock()
+    client.ticker_price.return_value = {"price": price}
+    order_ids = iter(range(10000, 10 ** 9))
+    client.new_order.side_effect = lambda **kwargs: {"orderId": next(order_ids), "status": "NEW", "executedQty": "0",
+                                                     "cummulativeQuoteQty": "0"}
+    client.cancel_and_replace.side_effect = lambda **kwargs: {
+        "cancelResponse": {"orderId": kwargs["cancelOrderId"], "status": "CANCELED", "executedQty": "0"},
+        "newOrderResponse": client.new_order.side_effect(),
+    }
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording")
+    parser.add_argument("--speed", type=float, help="multiple of real time, as fast as possible by default")
+    parser.add_argument("--symbol", default="BTCUSDT")
+    parser.add_argument("--price", default="100000", help="market price when the bot starts")
+    parser.add_argument("--source", help="user data to replay, of the bot itself by default")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # unknown orders
+
+    engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine, expire_on_commit=False)()
+    bot = Bot(id=uuid4(), name="Replay", exchange=ExchangeType.BINANCE, symbol=args.symbol, amount=Decimal(1000),
+              grid_length=Decimal(10), first_order_offset=Decimal(1), num_orders=5, next_order_volume=Decimal(5),
+              profit_percentage=Decimal(1), price_change_percentage=Decimal(1), status=BotStatusType.RUNNING,
+              upper_price_limit=Decimal(10 ** 9), is_active=True, api_key="replay", api_secret="replay")
+    db.add(bot)
+    db.commit()
+
+    with patch.object(TradingService, "_new_client", return_value=mocked_exchange(args.price)), \
+            patch("app.services.bot_events_handler.SpotWebsocketStreamClient"):
+        trading_service = TradingService(db=db, bot=bot)
+        trading_service.launch()
+        handler = BotEventsHandler(bot=bot, trading_service=trading_service, listen_key="replay")
+        stats = StreamReplayer(handler, source=args.source).replay(read_recording(args.recording), speed=args.speed)
+
+    print(f"{stats.messages} messages, {stats.errors} errors in {stats.seconds:.2f}s: {stats.rate:,.0f} messages/s")
+
+
+if __name__ == "__main__":
+    main()
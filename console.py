@@ -7,7 +7,7 @@ from app.models import Bot, TradingCycle, Order
 from app.services.trading_service import TradingService
 from app.enums import *
 from decimal import Decimal
-from binance.spot import Spot
+from app.services.exchange_client import client_registry
 import logging
 
 # Configure SQLAlchemy logging
@@ -17,12 +17,8 @@ import logging
 # Create a database session
 db = next(get_db())
 
-# Initialize Binance client
-client = Spot(
-    api_key=os.getenv("BINANCE_API_KEY"),
-    api_secret=os.getenv("BINANCE_API_SECRET"),
-    base_url='https://testnet.binance.vision' if os.getenv("BINANCE_TESTNET") == '1' else 'https://api.binance.com'
-)
+# Binance client, shared with the trading services of the same account
+client = client_registry.get(os.getenv("BINANCE_API_KEY"), os.getenv("BINANCE_API_SECRET"))
 
 bots = db.query(Bot)
 bot = bots.first()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+import argparse
+import os
+import uuid
+
+from app.services.trade_exporter import FORMATS, TradeExporter
+
+# Export the trade history changed since the previous run, e.g. from a daily cron job:
+#   ./export.py --bot <bot id> --out exports/
+#   ./export.py --account <api key> --format arrow --out exports/
+
+parser = argparse.ArgumentParser(description="Export cycles and orders into columnar files")
+scope = parser.add_mutually_exclusive_group(required=True)
+scope.add_argument("--bot", type=uuid.UUID, help="id of the bot to export")
+scope.add_argument("--account", help="API key of the account to export")
+parser.add_argument("--format", choices=FORMATS, default="parquet")
+parser.add_argument("--out", default="exports", help="output directory")
+parser.add_argument("--chunk-size", type=int, default=10000, help="rows fetched and written at once")
+args = parser.parse_args()
+
+os.makedirs(args.out, exist_ok=True)
+exporter = TradeExporter(chunk_size=args.chunk_size)
+paths = exporter.export_incremental(args.out, args.format, bot_id=args.bot, api_key=args.account)
+
+for table, path in paths.items():
+    print(f"{table}: {path}")
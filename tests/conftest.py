@@ -54,6 +54,16 @@ def mock_binance_client():
             "cummulativeQuoteQty": "0"
         }
     client.new_order.side_effect = new_order_side_effect
+
+    # Mock cancel_and_replace method, the new order takes the next order ID
+    def cancel_and_replace_side_effect(*args, **kwargs):
+        return {
+            "cancelResult": "SUCCESS",
+            "newOrderResult": "SUCCESS",
+            "cancelResponse": {"orderId": kwargs["cancelOrderId"], "status": "CANCELED", "executedQty": "0"},
+            "newOrderResponse": new_order_side_effect()
+        }
+    client.cancel_and_replace.side_effect = cancel_and_replace_side_effect
     
     # Mock cancel_order method
     client.cancel_order.return_value = {
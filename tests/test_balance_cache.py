@@ -0,0 +1,153 @@
+import pytest
+from decimal import Decimal
+from unittest.mock import Mock, patch
+
+from app.services.balance_cache import AccountStream, BalanceCache, InsufficientBalanceError
+from app.services.stream_messages import AccountPosition, Balance, ExecutionReport
+
+
+def account_position(event_time, **balances):
+    return AccountPosition(event_time=event_time,
+                           balances=[Balance(asset=asset, free=free, locked="0.00000000")
+                                     for asset, free in balances.items()])
+
+def test_seed_once_then_apply_updates(mock_binance_client):
+    mock_binance_client.account.return_value = {
+        "updateTime": 1000,
+        "balances": [{"asset": "BTC", "free": "0.10000000", "locked": "0.00000000"},
+                     {"asset": "USDT", "free": "500.00000000", "locked": "100.00000000"}]
+    }
+    cache = BalanceCache()
+    assert cache.balances("key") is None
+
+    cache.seed("key", mock_binance_client)
+    cache.seed("key", mock_binance_client)
+    mock_binance_client.account.assert_called_once_with(omitZeroBalances="true")
+    assert cache.free("key", "USDT") == Decimal("500")
+
+    cache.apply("key", account_position(2000, USDT="400.00000000", BTC="0.00000000"))
+    assert cache.free("key", "USDT") == Decimal("400")
+    assert cache.free("key", "ETH") == Decimal(0)
+    assert cache.balances("key") == [{"asset": "USDT", "free": "400.00000000", "locked": "0.00000000"}]
+
+def test_updates_before_seed_are_kept(mock_binance_client):
+    cache = BalanceCache()
+    cache.apply("key", account_position(2000, USDT="400.00000000"))
+    assert cache.free("key", "USDT") is None
+
+    # The REST snapshot was taken before the update
+    mock_binance_client.account.return_value = {
+        "updateTime": 1000,
+        "balances": [{"asset": "USDT", "free": "500.00000000", "locked": "0.00000000"},
+                     {"asset": "BTC", "free": "0.10000000", "locked": "0.00000000"}]
+    }
+    cache.seed("key", mock_binance_client)
+
+    assert cache.free("key", "USDT") == Decimal("400")
+    assert cache.free("key", "BTC") == Decimal("0.1")
+
+    cache.apply("key", account_position(500, BTC="0.50000000"))  # older than the snapshot
+    assert cache.free("key", "BTC") == Decimal("0.1")
+
+@patch('app.services.balance_cache.SpotWebsocketStreamClient')
+def test_account_stream(mock_ws_client_class, mock_binance_client):
+    mock_binance_client.api_key = "key"
+    mock_binance_client.account.return_value = {"updateTime": 1000, "balances": []}
+    cache = BalanceCache()
+    stream = AccountStream(mock_binance_client, cache)
+
+    stream.start()
+    mock_ws_client_class.return_value.user_data.assert_called_once_with(listen_key="test_listen_key")
+    assert cache.balances("key") == []
+
+    stream._on_message(None, '{"e": "outboundAccountPosition", "E": 2000, '
+                             '"B": [{"a": "USDT", "f": "10.00000000", "l": "0.00000000"}]}')
+    assert cache.free("key", "USDT") == Decimal("10")
+
+    stream.keepalive()
+    mock_binance_client.renew_listen_key.assert_called_once_with("test_listen_key")
+    assert mock_binance_client.account.call_count == 2  # reseeded with the keepalive
+
+    stream.stop()
+    assert cache.streams["key"] == 0
+    assert "key" not in cache.seeded
+
+def test_accounts_without_streams_are_seeded_again(mock_binance_client):
+    mock_binance_client.account.return_value = {
+        "updateTime": 1000, "balances": [{"asset": "USDT", "free": "500.00000000", "locked": "0.00000000"}]
+    }
+    cache = BalanceCache()
+    cache.stream_opened("key")
+    cache.stream_opened("key")
+    cache.seed("key", mock_binance_client)
+
+    # Still current through the other stream
+    cache.stream_closed("key")
+    cache.seed("key", mock_binance_client)
+    assert mock_binance_client.account.call_count == 1
+
+    # The events missed while no stream was open are in the new snapshot
+    cache.stream_closed("key")
+    mock_binance_client.account.return_value = {
+        "updateTime": 3000, "balances": [{"asset": "USDT", "free": "200.00000000", "locked": "0.00000000"}]
+    }
+    cache.stream_opened("key")
+    cache.seed("key", mock_binance_client)
+    assert mock_binance_client.account.call_count == 2
+    assert cache.free("key", "USDT") == Decimal("200")
+
+@pytest.fixture
+def seeded_cache(mock_binance_client):
+    mock_binance_client.account.return_value = {
+        "updateTime": 1000,
+        "balances": [{"asset": "BTC", "free": "0.01000000", "locked": "0.00000000"},
+                     {"asset": "USDT", "free": "500.00000000", "locked": "0.00000000"}]
+    }
+    cache = BalanceCache()
+    cache.seed("key", mock_binance_client)
+    return cache
+
+def test_reservations(seeded_cache):
+    with seeded_cache.reserve("key", "USDT", Decimal("300")) as reservation:
+        with pytest.raises(InsufficientBalanceError):
+            seeded_cache.reserve("key", "USDT", Decimal("201"))
+
+        reservation.settle(Decimal("100"), 2000)  # the first order was accepted
+        assert seeded_cache.free("key", "USDT") == Decimal("400")
+        assert seeded_cache.balances("key")[1] == {"asset": "USDT", "free": "400.00000000", "locked": "100.00000000"}
+        seeded_cache.check("key", "USDT", Decimal("200"))
+        with pytest.raises(InsufficientBalanceError):
+            seeded_cache.check("key", "USDT", Decimal("201"))
+
+    # The rest of the reservation was released
+    seeded_cache.check("key", "USDT", Decimal("400"))
+    with pytest.raises(InsufficientBalanceError):
+        seeded_cache.reserve("key", "BTC", Decimal("0.02"))
+
+    seeded_cache.unlock("key", "USDT", Decimal("100"), 3000)
+    assert seeded_cache.free("key", "USDT") == Decimal("500")
+
+def test_unknown_accounts_are_not_checked():
+    cache = BalanceCache()
+    with cache.reserve("key", "USDT", Decimal("1000000")) as reservation:
+        reservation.settle(Decimal("1000000"), 2000)
+    cache.check("key", "USDT", Decimal("1000000"))
+    assert cache.free("key", "USDT") is None
+
+def test_executions_count_once(seeded_cache):
+    fill = ExecutionReport(symbol="BTCUSDT", side="BUY", status="FILLED", last_quantity="0.01000000",
+                           last_price="30000.00000000", commission="0.00001000", commission_asset="BTC",
+                           transaction_time=2000)
+    seeded_cache.apply("key", account_position(1500, USDT="200.00000000"))  # the order was placed
+    seeded_cache.accounts["key"]["USDT"] = (Decimal("200"), Decimal("300"), 1500)
+
+    seeded_cache.apply_execution("key", fill, "BTC", "USDT")
+    assert seeded_cache.free("key", "BTC") == Decimal("0.01999")
+    assert seeded_cache.accounts["key"]["USDT"][:2] == (Decimal("200"), Decimal("0"))
+
+    # The same report on the stream of another bot of the account, then the account event
+    seeded_cache.apply_execution("key", fill, "BTC", "USDT")
+    assert seeded_cache.free("key", "BTC") == Decimal("0.01999")
+    seeded_cache.apply("key", account_position(2000, BTC="0.01999000"))
+    seeded_cache.apply_execution("key", fill, "BTC", "USDT")
+    assert seeded_cache.free("key", "BTC") == Decimal("0.01999")
@@ -1,11 +1,14 @@
 import pytest
-from unittest.mock import AsyncMock, Mock, patch
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+from app.client_order_ids import client_order_id
 from app.services.bot_events_handler import BotEventsHandler
+from app.services.stream_messages import decode
 from app.models import Order
 from app.enums import OrderStatusType, SideType
 from decimal import Decimal
 import os
 import json
+from uuid import uuid4
 
 @pytest.fixture
 def mock_ws_client():
@@ -16,13 +19,22 @@ def mock_ws_client():
         yield client_instance
 
 @pytest.fixture
-def mock_trading_service():
+def mock_trading_service(db_session, test_bot):
     service = Mock()
+    service.db = db_session
+    service.bot = test_bot
+    service.cycle = None
+    service.credentials = (test_bot.api_key, test_bot.api_secret)
+    service.api_key = test_bot.api_key
+    service.unit_of_work = MagicMock()
     service.update_take_profit_order = Mock()
     service.check_cycle_completion = Mock()
     service.cancel_cycle_orders = Mock()
     service.place_grid_orders = Mock(return_value=[])
     service.sell_quantity_filled = Mock(return_value=Decimal('0'))
+    service.find_order.side_effect = lambda client_order_id, order_id: service.cycle.orders.filter(
+        Order.exchange_order_id == str(order_id)
+    ).first()
     return service
 
 @pytest.fixture
@@ -30,7 +42,6 @@ def bot_events_handler(mock_trading_service, mock_ws_client, test_bot, db_sessio
     manager = BotEventsHandler(
         bot=test_bot,
         trading_service=mock_trading_service,
-        db=db_session,
         listen_key="test_listen_key"
     )
     return manager
@@ -63,7 +74,7 @@ async def test_message_handler_execution_report_buy_order_filled(bot_events_hand
         "z": "0.02"  # executed quantity
     }
 
-    bot_events_handler._handle_execution_report(msg)
+    bot_events_handler._handle_execution_report(decode(json.dumps(msg)), msg)
 
     # Verify order was updated - refresh from db to get latest status
     db_session.refresh(test_order)
@@ -100,7 +111,7 @@ async def test_message_handler_execution_report_sell_order_filled(bot_events_han
         "z": "0.02"  # executed quantity
     }
 
-    bot_events_handler._handle_execution_report(msg)
+    bot_events_handler._handle_execution_report(decode(json.dumps(msg)), msg)
 
     # Verify order was updated - refresh from db to get latest status
     db_session.refresh(test_order)
@@ -113,12 +124,7 @@ async def test_message_handler_execution_report_sell_order_filled(bot_events_han
 @pytest.mark.asyncio
 async def test_handle_price_update(bot_events_handler, mock_trading_service):
     # Simulate price update message
-    msg = {
-        "s": "BTCUSDT",
-        "c": "25200"  # Current price
-    }
-
-    bot_events_handler._handle_price_update(msg)
+    bot_events_handler._handle_price_update("BTCUSDT", "25200")  # Current price
     mock_trading_service.check_grid_update.assert_called_once()
 
 @pytest.mark.asyncio
@@ -134,3 +140,145 @@ async def test_message_handler_price_update(bot_events_handler, mock_trading_ser
 
     # Verify that the price update handler was called
     mock_trading_service.check_grid_update.assert_called_once_with(25200)
+
+@pytest.mark.asyncio
+async def test_execution_report_through_order_writer(bot_events_handler, mock_trading_service, test_cycle, test_order, db_session):
+    mock_trading_service.cycle = test_cycle
+    order_writer = Mock()
+    order_writer.submit.return_value = 7
+    bot_events_handler.order_writer = order_writer
+
+    msg = {
+        "e": "executionReport",
+        "i": test_order.exchange_order_id,
+        "X": "PARTIALLY_FILLED",
+        "s": "BTCUSDT",
+        "S": "BUY",
+        "z": "0.01"
+    }
+
+    bot_events_handler._handle_execution_report(decode(json.dumps(msg)), msg)
+
+    order_writer.submit.assert_called_once_with(
+        test_order.id, status="PARTIALLY_FILLED", quantity_filled=Decimal('0.01'), exchange_order_data=msg
+    )
+    # The take profit order is only updated once the fill is durable
+    order_writer.wait.assert_called_once_with(7, timeout=5)
+    mock_trading_service.update_take_profit_order.assert_called_once()
+    # The loaded order reflects the update without being left dirty in the session
+    assert test_order.status == "PARTIALLY_FILLED"
+    assert test_order not in db_session.dirty
+
+@pytest.mark.asyncio
+async def test_symbol_change_moves_ticker_subscription(bot_events_handler, mock_trading_service, mock_ws_client, test_bot):
+    await bot_events_handler.start()
+    mock_ws_client.ticker.assert_called_once_with(symbol="BTCUSDT")
+
+    test_bot.symbol = "ETHUSDT"
+    bot_events_handler.sync_subscriptions()
+
+    mock_ws_client.ticker.assert_any_call(symbol="ETHUSDT")
+    mock_ws_client.ticker.assert_any_call(symbol="BTCUSDT", action="UNSUBSCRIBE")
+    assert bot_events_handler.active_symbols == {"ETHUSDT"}
+
+@pytest.mark.asyncio
+async def test_running_cycle_keeps_its_ticker(bot_events_handler, mock_trading_service, mock_ws_client, test_bot, test_cycle):
+    mock_trading_service.cycle = test_cycle
+    await bot_events_handler.start()
+
+    test_bot.symbol = "ETHUSDT"
+    bot_events_handler.sync_subscriptions()
+
+    assert bot_events_handler.active_symbols == {"BTCUSDT", "ETHUSDT"}
+    # Prices of the cycle's symbol still drive the grid
+    bot_events_handler._handle_price_update("BTCUSDT", "25200")
+    mock_trading_service.check_grid_update.assert_called_once_with(25200)
+
+def test_change_listen_key(bot_events_handler, mock_ws_client):
+    bot_events_handler.change_listen_key("new_listen_key")
+
+    mock_ws_client.user_data.assert_any_call(listen_key="new_listen_key")
+    mock_ws_client.user_data.assert_any_call(listen_key="test_listen_key", action="UNSUBSCRIBE")
+    assert bot_events_handler.listen_key == "new_listen_key"
+
+def test_sync_listen_key(bot_events_handler, mock_trading_service, mock_ws_client):
+    bot_events_handler.sync_listen_key()
+    mock_ws_client.user_data.assert_not_called()
+
+    # The trading service moved to new credentials once its cycle completed
+    mock_trading_service.credentials = ("new_api_key", "new_api_secret")
+    mock_trading_service.api_key = "new_api_key"
+    mock_trading_service.client.new_listen_key.return_value = {"listenKey": "new_listen_key"}
+    bot_events_handler.balances = Mock()
+    bot_events_handler.sync_listen_key()
+
+    assert bot_events_handler.listen_key == "new_listen_key"
+    mock_ws_client.user_data.assert_any_call(listen_key="test_listen_key", action="UNSUBSCRIBE")
+    bot_events_handler.balances.seed.assert_called_once_with("new_api_key", mock_trading_service.client)
+
+@pytest.mark.asyncio
+async def test_prices_from_shared_feed(bot_events_handler, mock_trading_service, mock_ws_client):
+    market_data = Mock()
+    bot_events_handler.market_data = market_data
+    await bot_events_handler.start()
+
+    mock_ws_client.ticker.assert_not_called()
+    market_data.subscribe.assert_called_once_with("BTCUSDT", bot_events_handler._on_price)
+
+    bot_events_handler.stop()
+    market_data.unsubscribe.assert_called_once_with("BTCUSDT", bot_events_handler._on_price)
+    mock_ws_client.stop.assert_called_once()
+
+def test_message_handler_account_position(bot_events_handler, test_bot):
+    bot_events_handler.balances = Mock()
+    msg = {"e": "outboundAccountPosition", "E": 2000, "B": [{"a": "USDT", "f": "10.00000000", "l": "0.00000000"}]}
+
+    bot_events_handler.message_handler(None, json.dumps(msg))
+
+    bot_events_handler.balances.apply.assert_called_once_with(test_bot.api_key, decode(json.dumps(msg)))
+
+def test_message_handler_posts_events_to_dispatcher(bot_events_handler, test_bot, test_cycle, mock_trading_service):
+    mock_trading_service.cycle = test_cycle
+    bot_events_handler.dispatcher = Mock()
+    ticker = {"e": "24hrTicker", "s": "BTCUSDT", "c": "25200"}
+    report = {"e": "executionReport", "s": "BTCUSDT", "S": "BUY", "X": "NEW", "i": 1, "z": "0"}
+
+    bot_events_handler.message_handler(None, json.dumps(ticker))
+    bot_events_handler.message_handler(None, json.dumps(report))
+
+    # Nothing runs on the websocket thread
+    mock_trading_service.unit_of_work.assert_not_called()
+    dispatch = bot_events_handler.dispatcher.dispatch
+    dispatch.assert_any_call(test_bot.id, bot_events_handler._handle_price_update, "BTCUSDT", "25200", key="BTCUSDT")
+    dispatch.assert_any_call(test_bot.id, bot_events_handler._handle_execution_report, decode(json.dumps(report)),
+                             report, key=None)
+
+    bot_events_handler.stop()
+    bot_events_handler.dispatcher.discard.assert_called_once_with(test_bot.id)
+
+def test_replay_posts_reports_to_dispatcher(bot_events_handler, test_bot, mock_trading_service):
+    bot_events_handler.dispatcher = Mock()
+    exchange_order = {"symbol": "BTCUSDT", "side": "BUY", "status": "FILLED", "orderId": 123,
+                      "executedQty": "0.02000000", "updateTime": 2000}
+
+    bot_events_handler.replay([exchange_order])
+
+    mock_trading_service.unit_of_work.assert_not_called()
+    handler, report, data = bot_events_handler.dispatcher.dispatch.call_args.args[1:]
+    assert handler == bot_events_handler._handle_execution_report
+    assert (report.order_id, report.status, report.event_time) == (123, "FILLED", 2000)
+    assert data is exchange_order
+
+def test_reports_of_other_bots_of_the_account_are_skipped(bot_events_handler, mock_trading_service, test_cycle):
+    mock_trading_service.cycle = test_cycle
+    report = {"e": "executionReport", "s": "BTCUSDT", "S": "BUY", "X": "FILLED", "i": 1, "z": "0.02",
+              "c": client_order_id(uuid4(), test_cycle.id, "BUY", 1, 0)}
+
+    bot_events_handler._handle_execution_report(decode(json.dumps(report)), report)
+
+    mock_trading_service.unit_of_work.assert_not_called()
+    mock_trading_service.find_order.assert_not_called()
+
+    report["c"] = client_order_id(bot_events_handler.bot.id, test_cycle.id, "BUY", 1, 0)
+    bot_events_handler._handle_execution_report(decode(json.dumps(report)), report)
+    mock_trading_service.find_order.assert_called_once_with(report["c"], 1)
@@ -0,0 +1,120 @@
+import asyncio
+import itertools
+import pytest
+from datetime import timedelta
+from unittest.mock import AsyncMock, Mock
+from uuid import uuid4
+from sqlalchemy.orm import sessionmaker
+
+from app.models import Bot, BotLease, EngineWorker
+from app.services.bot_leases import BotLeaseCoordinator
+
+
+@pytest.fixture
+def session_factory(db_session):
+    return sessionmaker(bind=db_session.bind, autoflush=False)
+
+@pytest.fixture
+def bots(db_session, test_bot):
+    bots = [test_bot]
+    for _ in range(2):
+        bot = Bot(**{column.name: getattr(test_bot, column.name) for column in Bot.__table__.columns
+                     if column.name not in ("id", "created_at", "updated_at")})
+        bot.id = uuid4()
+        db_session.add(bot)
+        bots.append(bot)
+    db_session.commit()
+    return bots
+
+def coordinator(session_factory, worker_id):
+    return BotLeaseCoordinator(worker_id, Mock(), session_factory=session_factory)
+
+def test_single_worker_claims_all_active_bots(session_factory, bots, db_session):
+    worker = coordinator(session_factory, "worker-a")
+
+    assert worker.heartbeat() == {bot.id for bot in bots}
+    assert worker.valid_until is not None
+    assert db_session.get(EngineWorker, "worker-a").heartbeat_at is not None
+    # Renewing keeps the same bots
+    assert worker.heartbeat() == {bot.id for bot in bots}
+
+def test_workers_share_bots_fairly(session_factory, bots):
+    worker_a = coordinator(session_factory, "worker-a")
+    worker_b = coordinator(session_factory, "worker-b")
+
+    assert len(worker_a.heartbeat()) == 3
+    assert worker_b.heartbeat() == set()  # every lease is held
+
+    owned_a = worker_a.heartbeat()  # fair share is now 2
+    assert len(owned_a) == 2
+    assert worker_a.bot_manager.release_id.call_count == 1
+
+    owned_b = worker_b.heartbeat()
+    assert len(owned_b) == 1
+    assert owned_a.isdisjoint(owned_b)
+
+def test_expired_lease_is_taken_over(session_factory, bots, db_session):
+    worker_a = coordinator(session_factory, "worker-a")
+    worker_b = coordinator(session_factory, "worker-b")
+    worker_a.heartbeat()
+
+    lease = db_session.get(BotLease, bots[0].id)
+    lease.expires_at -= timedelta(minutes=5)
+    worker = db_session.get(EngineWorker, "worker-a")
+    worker.heartbeat_at -= timedelta(minutes=5)
+    db_session.commit()
+
+    assert worker_b.heartbeat() == {bot.id for bot in bots[:1]}
+    db_session.expire_all()
+    assert db_session.get(BotLease, bots[0].id).worker_id == "worker-b"
+    # The late worker doesn't renew the lease it lost
+    assert bots[0].id not in worker_a.heartbeat()
+
+def test_draining_worker_releases_its_bots(session_factory, bots, db_session):
+    worker = coordinator(session_factory, "worker-a")
+    worker.heartbeat()
+
+    worker.draining = True
+    assert worker.heartbeat() == set()
+    assert worker.bot_manager.release_id.call_count == 3
+    assert db_session.query(BotLease).count() == 0
+
+def test_leases_of_stopped_bots_are_dropped(session_factory, bots, db_session):
+    worker = coordinator(session_factory, "worker-a")
+    worker.heartbeat()
+
+    bots[0].is_active = False
+    db_session.commit()
+
+    assert worker.heartbeat() == {bot.id for bot in bots[1:]}
+    assert db_session.get(BotLease, bots[0].id) is None
+
+def test_heartbeat_interval_must_fit_in_the_lease(session_factory):
+    with pytest.raises(ValueError):
+        BotLeaseCoordinator("worker-a", Mock(), session_factory=session_factory, ttl=30, heartbeat_interval=15)
+
+async def test_bots_are_released_when_leases_are_not_renewed_in_time(session_factory, bots):
+    worker = BotLeaseCoordinator("worker-a", Mock(sync=AsyncMock()), session_factory=session_factory,
+                                 ttl=0.5, heartbeat_interval=0.1, safety_margin=0.1)
+    owned = worker.heartbeat()
+    # The database stops answering after the first heartbeat
+    worker.heartbeat = Mock(side_effect=itertools.chain([owned], itertools.repeat(OSError("unreachable"))))
+
+    task = asyncio.create_task(worker.run())
+    await asyncio.sleep(0.6)
+    worker.running = False
+    task.cancel()
+
+    worker.bot_manager.release_all.assert_called_once()
+    assert worker.owned == set()
+
+async def test_drain_hands_the_bots_over(session_factory, bots, db_session):
+    worker_a = BotLeaseCoordinator("worker-a", Mock(sync=AsyncMock()), session_factory=session_factory)
+    worker_b = coordinator(session_factory, "worker-b")
+    worker_a.heartbeat()
+
+    await worker_a.drain()
+
+    worker_a.bot_manager.sync.assert_awaited_once_with(set())
+    assert db_session.get(EngineWorker, "worker-a").draining
+    assert worker_b.heartbeat() == {bot.id for bot in bots}
@@ -1,4 +1,5 @@
 import asyncio
+import threading
 from typing import Type, cast
 from unittest.mock import AsyncMock, MagicMock, Mock, patch
 from uuid import uuid4
@@ -24,6 +25,9 @@ class MockTradingService:
         self.client = Mock()
         self.client.new_listen_key.return_value = {"listenKey": "test_listen_key"}
         self.launch = Mock()
+        self.publish_snapshot = Mock()
+        self.reload_bot = Mock(return_value=set())
+        self.unit_of_work = MagicMock()
         self.initialize = Mock()
         self.db = kwargs.get('db')
         self.bot = kwargs.get('bot')
@@ -33,10 +37,16 @@ class MockBotEventsHandler:
         self.ws_client = AsyncMock()
         self.ws_client.stop = MagicMock()
         self.start = AsyncMock()
+        self.sync_subscriptions = Mock()
+        self.sync_listen_key = Mock()
+        self.replay = Mock()
         self.db = kwargs.get('db')
         self.bot = kwargs.get('bot')
         self.trading_service = kwargs.get('trading_service')
 
+    def stop(self):
+        self.ws_client.stop()
+
 @pytest.mark.asyncio
 async def test_install_bot(bot_manager, test_bot):
     """Test if a bot is correctly installed"""
@@ -46,6 +56,21 @@ async def test_install_bot(bot_manager, test_bot):
     assert test_bot.id in bot_manager.events_handlers
     bot_manager.events_handlers[test_bot.id].start.assert_awaited_once()
 
+@pytest.mark.asyncio
+async def test_install_bot_with_a_session_per_event(db_session, test_bot, mock_binance_client):
+    """Test if a bot installed by the engine, which opens a session for each event, starts its cycle"""
+    session_factory = sessionmaker(bind=db_session.bind, autoflush=False, expire_on_commit=False)
+    bot_manager = BotManager(TradingService, cast(Type[BotEventsHandler], MockBotEventsHandler))
+
+    with patch("app.services.bot_manager.EngineSessionLocal", session_factory), \
+            patch.object(TradingService, "_new_client", return_value=mock_binance_client):
+        await bot_manager.install(test_bot)
+
+    trading_service = bot_manager.events_handlers[test_bot.id].trading_service
+    assert trading_service.session_factory is session_factory
+    assert trading_service.cycle is not None
+    assert mock_binance_client.new_order.called
+
 @pytest.mark.asyncio
 async def test_install_bots(bot_manager):
     """Test installing multiple bots"""
@@ -56,6 +81,25 @@ async def test_install_bots(bot_manager):
     assert len(bot_manager.active_bots) == 2
     assert all(bot.id in bot_manager.events_handlers for bot in bots)
 
+@pytest.mark.asyncio
+async def test_bots_warm_up_side_by_side(bot_manager):
+    """Test if the exchange calls of the bots' warmup run on threads, at the same time"""
+    barrier = threading.Barrier(2, timeout=5)  # broken unless both listen keys are requested together
+
+    class SlowTradingService(MockTradingService):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.client.new_listen_key.side_effect = lambda: (barrier.wait(), {"listenKey": "test_listen_key"})[1]
+
+    bot_manager.trading_service_class = SlowTradingService
+    bot_manager.db = None
+    with patch("app.services.bot_manager.EngineSessionLocal") as session_factory:
+        session_factory.return_value.get.side_effect = lambda model, bot_id: Bot(id=bot_id, is_active=True)
+        await bot_manager.install_bots([Bot(id=uuid4(), is_active=True), Bot(id=uuid4(), is_active=True)])
+
+    assert not barrier.broken
+    assert len(bot_manager.events_handlers) == 2
+
 def test_release_bot(bot_manager, test_bot):
     """Test releasing an active bot"""
     mock_trading_service = MockTradingService(bot=test_bot)
@@ -89,3 +133,79 @@ def test_release_all(bot_manager):
     assert not bot_manager.events_handlers
     for bot in bots:
         mock_handlers[bot.id].ws_client.stop.assert_called_once_with()
+
+@pytest.mark.asyncio
+async def test_sync_bots(bot_manager, test_bot):
+    """Test if owned bots are installed and the others released"""
+    await bot_manager.sync({test_bot.id})
+    assert [bot.id for bot in bot_manager.active_bots] == [test_bot.id]
+
+    await bot_manager.sync({test_bot.id})
+    bot_manager.events_handlers[test_bot.id].start.assert_awaited_once()
+
+    ws_client = bot_manager.events_handlers[test_bot.id].ws_client
+    await bot_manager.sync(set())
+    assert bot_manager.active_bots == []
+    assert test_bot.id not in bot_manager.events_handlers
+    ws_client.stop.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_reconfigure_bot(bot_manager, test_bot):
+    """Test if changed settings are applied to the running bot without reinstalling it"""
+    assert bot_manager.reconfigure(test_bot.id) is None
+
+    await bot_manager.install(test_bot)
+    events_handler = bot_manager.events_handlers[test_bot.id]
+    trading_service = events_handler.trading_service
+
+    trading_service.reload_bot.return_value = {"amount"}
+    assert bot_manager.reconfigure(test_bot.id) == {"amount"}
+    events_handler.sync_subscriptions.assert_not_called()
+    events_handler.sync_listen_key.assert_not_called()
+
+    trading_service.reload_bot.return_value = {"symbol", "api_key"}
+    bot_manager.reconfigure(test_bot.id)
+    events_handler.sync_subscriptions.assert_called_once()
+    events_handler.sync_listen_key.assert_called_once()
+    assert bot_manager.events_handlers[test_bot.id] is events_handler
+
+@pytest.mark.asyncio
+async def test_install_bot_from_snapshot(bot_manager, test_bot):
+    """Test if a bot with a matching snapshot is restored instead of launched"""
+    changed_order = {"orderId": 123, "status": "FILLED"}
+    bot_manager.snapshots = Mock()
+    bot_manager.snapshots.read.return_value = {"cycle_id": "c", "last_event_time": 42}
+    MockTradingService.restore = Mock(return_value=[changed_order])
+    try:
+        await bot_manager.install(test_bot)
+    finally:
+        del MockTradingService.restore
+
+    events_handler = bot_manager.events_handlers[test_bot.id]
+    events_handler.trading_service.launch.assert_not_called()
+    events_handler.replay.assert_called_once_with([changed_order])
+    assert events_handler.last_event_time == 42
+
+@pytest.mark.asyncio
+async def test_install_bot_seeds_balances(bot_manager, test_bot):
+    """Test if the balances of the bot's account are loaded once its stream is subscribed"""
+    bot_manager.balances = Mock()
+
+    await bot_manager.install(test_bot)
+
+    events_handler = bot_manager.events_handlers[test_bot.id]
+    bot_manager.balances.seed.assert_called_once_with(test_bot.api_key, events_handler.trading_service.client)
+
+@pytest.mark.asyncio
+async def test_release_bot_drops_its_snapshot(bot_manager, test_bot):
+    """Test if the snapshot of a released bot is removed, unless the engine is shutting down"""
+    bot_manager.snapshots = Mock()
+    bot_manager.snapshots.read.return_value = None
+    await bot_manager.install(test_bot)
+
+    bot_manager.release_all(keep_snapshots=True)
+    bot_manager.snapshots.remove.assert_not_called()
+
+    await bot_manager.install(test_bot)
+    bot_manager.release_id(test_bot.id)
+    bot_manager.snapshots.remove.assert_called_once_with(test_bot.id)
@@ -0,0 +1,184 @@
+import json
+import pytest
+from decimal import Decimal
+from unittest.mock import AsyncMock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from uuid import uuid4
+
+from app.database import get_db
+from app.enums import BotStatusType, CycleStatusType, OrderStatusType, OrderType, SideType, TimeInForceType
+from app.models import Bot, Order, OrderArchive, TradingCycle
+from app.routes import bot
+from app.services.price_history import PriceHistory
+
+
+@pytest.fixture
+def client(db_session):
+    app = FastAPI()
+    app.include_router(bot.router, prefix="/api/v1")
+    app.dependency_overrides[get_db] = lambda: db_session
+    app.state.price_history = PriceHistory()
+    app.state.send_command = AsyncMock()
+    return TestClient(app)
+
+BOT_SETTINGS = {
+    "name": "API Bot", "exchange": "BINANCE", "symbol": "BTCUSDT", "amount": 1000, "grid_length": 10,
+    "first_order_offset": 1, "num_orders": 5, "next_order_volume": 5, "profit_percentage": 1,
+    "price_change_percentage": 1, "upper_price_limit": 0,
+}
+
+def test_create_bot(client, db_session):
+    response = client.post("/api/v1/bots/", json={**BOT_SETTINGS, "api_key": "key", "api_secret": "secret"})
+
+    assert response.status_code == 200
+    created = response.json()
+    assert created["status"] == BotStatusType.RUNNING
+    assert "api_secret" not in created
+    bot_id = db_session.query(Bot.id).filter(Bot.name == "API Bot").scalar()
+    client.app.state.send_command.assert_awaited_once_with("start", bot_id)
+
+def test_list_and_get_bots(client, test_bot):
+    listed = client.get("/api/v1/bots/")
+    assert listed.status_code == 200
+    assert [bot["id"] for bot in listed.json()] == [str(test_bot.id)]
+
+    response = client.get(f"/api/v1/bots/{test_bot.id}")
+    assert response.status_code == 200
+    assert response.json()["name"] == test_bot.name
+    assert client.get(f"/api/v1/bots/{uuid4()}").status_code == 404
+
+def test_start_bot(client, test_bot, db_session):
+    test_bot.is_active = False
+    test_bot.status = BotStatusType.STOPPED
+    db_session.commit()
+
+    assert client.post(f"/api/v1/bots/{test_bot.id}/start").status_code == 200
+
+    db_session.refresh(test_bot)
+    assert test_bot.is_active and test_bot.status == BotStatusType.RUNNING
+    client.app.state.send_command.assert_awaited_once_with("start", test_bot.id)
+    assert client.post(f"/api/v1/bots/{uuid4()}/start").status_code == 404
+
+def test_stop_bot(client, test_bot, db_session):
+    assert client.post(f"/api/v1/bots/{test_bot.id}/stop").status_code == 200
+
+    db_session.refresh(test_bot)
+    # The engine stops the bot once its running cycle is completed
+    assert test_bot.is_active and test_bot.status == BotStatusType.LAST_CYCLE
+    client.app.state.send_command.assert_awaited_once_with("update", test_bot.id)
+    assert client.post(f"/api/v1/bots/{uuid4()}/stop").status_code == 404
+
+@pytest.fixture
+def cycles(db_session, test_bot):
+    cycles = []
+    for _ in range(5):
+        cycle = TradingCycle(
+            id=uuid4(),
+            bot_id=test_bot.id,
+            exchange=test_bot.exchange,
+            symbol=test_bot.symbol,
+            amount=test_bot.amount,
+            status=CycleStatusType.COMPLETED,
+            grid_length=test_bot.grid_length,
+            first_order_offset=test_bot.first_order_offset,
+            num_orders=test_bot.num_orders,
+            next_order_volume=test_bot.next_order_volume,
+            profit_percentage=test_bot.profit_percentage,
+            price_change_percentage=test_bot.price_change_percentage,
+            price=Decimal('100000')
+        )
+        db_session.add(cycle)
+        cycles.append(cycle)
+    db_session.commit()
+    return cycles
+
+def make_order(model, cycle, number):
+    return model(
+        id=uuid4(),
+        exchange=cycle.exchange,
+        symbol=cycle.symbol,
+        side=SideType.BUY,
+        type=OrderType.LIMIT,
+        time_in_force=TimeInForceType.GTC,
+        price=Decimal('100000'),
+        quantity=Decimal('0.01'),
+        quantity_filled=Decimal('0'),
+        amount=Decimal('1000'),
+        status=OrderStatusType.NEW,
+        number=number,
+        exchange_order_id=1000 + number,
+        exchange_order_data={"i": 1000 + number},
+        cycle_id=cycle.id
+    )
+
+def test_list_bot_cycles_keyset_pagination(client, test_bot, cycles):
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        response = client.get(f"/api/v1/bots/{test_bot.id}/cycles", params=params)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= 2
+        seen.extend(item["id"] for item in page["items"])
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+
+    assert len(seen) == len(set(seen)) == len(cycles)
+    assert set(seen) == {str(cycle.id) for cycle in cycles}
+
+def test_list_bot_cycles_invalid_cursor(client, test_bot):
+    response = client.get(f"/api/v1/bots/{test_bot.id}/cycles", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_list_cycle_orders(client, test_cycle, db_session):
+    db_session.add_all([make_order(Order, test_cycle, number) for number in range(1, 4)])
+    db_session.commit()
+
+    first = client.get(f"/api/v1/cycles/{test_cycle.id}/orders", params={"limit": 2}).json()
+    second = client.get(f"/api/v1/cycles/{test_cycle.id}/orders",
+                        params={"limit": 2, "cursor": first["next_cursor"]}).json()
+
+    assert len(first["items"]) == 2
+    assert len(second["items"]) == 1
+    assert second["next_cursor"] is None
+    assert {item["number"] for item in first["items"] + second["items"]} == {1, 2, 3}
+
+def test_list_cycle_orders_not_found(client):
+    response = client.get(f"/api/v1/cycles/{uuid4()}/orders")
+    assert response.status_code == 404
+
+def test_stream_bot_orders(client, test_bot, cycles, db_session, monkeypatch):
+    db_session.add(make_order(OrderArchive, cycles[0], 1))
+    db_session.add_all([make_order(Order, cycles[1], number) for number in (2, 3)])
+    db_session.commit()
+    monkeypatch.setattr(bot, "SessionLocal", lambda: db_session)
+
+    response = client.get(f"/api/v1/bots/{test_bot.id}/orders/stream")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    # Archived orders come first
+    assert lines[0]["number"] == 1
+    assert {line["number"] for line in lines[1:]} == {2, 3}
+    assert lines[0]["price"] == "100000.00000000"
+    assert lines[0]["exchange_order_data"] == {"i": 1001}
+
+def test_bot_chart(client, test_bot, test_cycle, test_order):
+    for timestamp in range(10):
+        client.app.state.price_history.record("BTCUSDT", f"{100000 + timestamp}.00000000", timestamp * 30)
+
+    response = client.get(f"/api/v1/bots/{test_bot.id}/chart", params={"points": 5})
+    assert response.status_code == 200
+    chart = response.json()
+
+    assert len(chart["prices"]) == 5
+    assert chart["prices"][0] == [0, 100000.0] and chart["prices"][-1] == [270, 100009.0]
+    assert chart["candles"][0] == [0, 100000.0, 100001.0, 100000.0, 100001.0]
+    assert [level["number"] for level in chart["grid"]] == [test_order.number]
+
+    assert client.get(f"/api/v1/bots/{test_bot.id}/chart", params={"resolution": 7}).status_code == 400
+    assert client.get(f"/api/v1/bots/{uuid4()}/chart").status_code == 404
@@ -0,0 +1,72 @@
+import asyncio
+import json
+import pytest
+from decimal import Decimal
+from uuid import uuid4
+
+from app.services.bot_state_hub import BotStateHub
+
+
+@pytest.fixture
+def hub():
+    return BotStateHub(queue_size=2)
+
+def order_state(number, side, price, quantity_filled, status):
+    return dict(id=f"order-{number}", cycle_id="cycle-1", side=side, price=Decimal(price), quantity=Decimal('0.02'),
+                quantity_filled=Decimal(quantity_filled), status=status, number=number)
+
+def test_snapshot_tracks_position(hub):
+    bot_id = uuid4()
+    hub.publish(bot_id, "cycle", dict(id="cycle-1", status="ACTIVE", symbol="BTCUSDT", price=Decimal('100000'), quantity=Decimal('0.04')))
+    hub.publish(bot_id, "order", order_state(1, "BUY", '99000', '0.02', "FILLED"))
+    hub.publish(bot_id, "order", order_state(2, "BUY", '97000', '0.02', "FILLED"))
+    hub.publish(bot_id, "order", order_state(3, "SELL", '99990', '0.01', "PARTIALLY_FILLED"))
+    hub.publish(bot_id, "price", dict(symbol="BTCUSDT", price=Decimal('99000')))
+
+    snapshot = hub.snapshot(bot_id)
+
+    assert snapshot["cycle"]["id"] == "cycle-1"
+    assert [order["number"] for order in snapshot["orders"]] == [1, 2, 3]
+    assert snapshot["quantity"] == Decimal('0.03')
+    assert snapshot["average_price"] == Decimal('98000')
+    assert snapshot["take_profit_price"] == Decimal('99990')
+    assert snapshot["unrealized_pnl"] == Decimal('30.00')
+
+def test_new_cycle_resets_orders(hub):
+    bot_id = uuid4()
+    hub.publish(bot_id, "cycle", dict(id="cycle-1", status="ACTIVE", symbol="BTCUSDT", price=Decimal('100000'), quantity=0))
+    hub.publish(bot_id, "order", order_state(1, "BUY", '99000', '0', "NEW"))
+    hub.publish(bot_id, "cycle", dict(id="cycle-2", status="ACTIVE", symbol="BTCUSDT", price=Decimal('100000'), quantity=0))
+
+    assert hub.snapshot(bot_id)["orders"] == []
+
+async def test_subscribers_receive_deltas(hub):
+    bot_id = uuid4()
+    hub.attach(asyncio.get_running_loop())
+    queue = hub.subscribe(bot_id)
+
+    hub.publish(bot_id, "price", dict(symbol="BTCUSDT", price=Decimal('100000')))
+    hub.publish(bot_id, "price", dict(symbol="BTCUSDT", price=Decimal('100000')))  # unchanged, not pushed
+    await asyncio.sleep(0)
+
+    assert queue.qsize() == 1
+    assert json.loads(queue.get_nowait()) == {
+        "type": "price", "price": "100000", "quantity": "0", "average_price": None,
+        "take_profit_price": None, "unrealized_pnl": None
+    }
+
+    hub.unsubscribe(bot_id, queue)
+    assert bot_id not in hub.subscribers
+
+async def test_slow_subscriber_gets_a_snapshot(hub):
+    bot_id = uuid4()
+    hub.attach(asyncio.get_running_loop())
+    queue = hub.subscribe(bot_id)
+
+    for price in ('100000', '100001', '100002'):
+        hub.publish(bot_id, "price", dict(symbol="BTCUSDT", price=Decimal(price)))
+    await asyncio.sleep(0)
+
+    messages = [json.loads(queue.get_nowait()) for _ in range(queue.qsize())]
+    assert messages[-1]["type"] == "snapshot"
+    assert messages[-1]["price"] == "100002"
@@ -0,0 +1,101 @@
+import pytest
+from decimal import Decimal
+from uuid import uuid4
+
+from app.enums import CycleStatusType, OrderStatusType, OrderType, SideType, TimeInForceType
+from app.models import Order, OrderArchive, TradingCycle
+from app.services.bot_view import BotQueries, ViewCache
+
+
+def completed_cycle(db_session, bot, quantity, archived=False):
+    cycle = TradingCycle(
+        id=uuid4(),
+        bot_id=bot.id,
+        exchange=bot.exchange,
+        symbol=bot.symbol,
+        amount=bot.amount,
+        status=CycleStatusType.COMPLETED,
+        grid_length=bot.grid_length,
+        first_order_offset=bot.first_order_offset,
+        num_orders=bot.num_orders,
+        next_order_volume=bot.next_order_volume,
+        profit_percentage=bot.profit_percentage,
+        price_change_percentage=bot.price_change_percentage,
+        price=Decimal('100000'),
+        quantity=quantity
+    )
+    db_session.add(cycle)
+    db_session.flush()
+    return cycle
+
+def filled_order(db_session, cycle, side, price, quantity, exchange_order_id, model=Order):
+    db_session.add(model(
+        exchange=cycle.exchange,
+        symbol=cycle.symbol,
+        side=side,
+        type=OrderType.LIMIT,
+        time_in_force=TimeInForceType.GTC,
+        price=Decimal(price),
+        quantity=Decimal(quantity),
+        quantity_filled=Decimal(quantity),
+        amount=Decimal(price) * Decimal(quantity),
+        status=OrderStatusType.FILLED,
+        number=1,
+        exchange_order_id=exchange_order_id,
+        cycle_id=cycle.id
+    ))
+
+def test_bot_view_with_active_cycle(db_session, test_bot, test_cycle):
+    view = BotQueries(db_session).bot_view(test_bot.id)
+
+    assert view.bot.id == test_bot.id
+    assert view.cycle.id == test_cycle.id
+    assert view.completed_cycles == 0
+    assert view.profit == 0
+
+def test_bot_view_not_found(db_session):
+    assert BotQueries(db_session).bot_view(uuid4()) is None
+
+def test_completed_cycles_stats_match_cycle_profit(db_session, test_bot):
+    first = completed_cycle(db_session, test_bot, Decimal('0.02'))
+    filled_order(db_session, first, SideType.BUY, '100000', '0.02', 301)
+    filled_order(db_session, first, SideType.SELL, '101000', '0.02', 302)
+    archived = completed_cycle(db_session, test_bot, Decimal('0.01'))
+    archived.archived_at = archived.created_at
+    filled_order(db_session, archived, SideType.BUY, '90000', '0.01', 303, model=OrderArchive)
+    filled_order(db_session, archived, SideType.SELL, '91000', '0.01', 304, model=OrderArchive)
+    mismatched = completed_cycle(db_session, test_bot, Decimal('0.02'))
+    filled_order(db_session, mismatched, SideType.BUY, '100000', '0.02', 305)
+    db_session.commit()
+
+    view = BotQueries(db_session).bot_view(test_bot.id)
+
+    assert view.cycle is None
+    assert view.completed_cycles == 3
+    assert view.mismatched_cycles == 1
+    assert view.profit == first.profit() + archived.profit() == Decimal('30')
+
+def test_view_cache_ignores_price_ticks():
+    cache = ViewCache()
+    bot_id = uuid4()
+    cache.put(bot_id, "<p>page</p>", cache.generation(bot_id))
+
+    cache.invalidate(bot_id, "price", {"price": Decimal('100000')})
+    assert cache.get(bot_id) == "<p>page</p>"
+
+    cache.invalidate(bot_id, "order", {})
+    assert cache.get(bot_id) is None
+
+
+def test_view_cache_drops_pages_rendered_before_an_invalidation():
+    cache = ViewCache()
+    bot_id = uuid4()
+    generation = cache.generation(bot_id)
+
+    # The engine changes the bot while the page is rendered from the old rows
+    cache.invalidate(bot_id, "order", {})
+    cache.put(bot_id, "<p>stale</p>", generation)
+    assert cache.get(bot_id) is None
+
+    cache.put(bot_id, "<p>page</p>", cache.generation(bot_id))
+    assert cache.get(bot_id) == "<p>page</p>"
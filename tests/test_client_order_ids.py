@@ -0,0 +1,17 @@
+from uuid import uuid4
+
+from app.client_order_ids import ClientOrderId, client_order_id, parse_client_order_id, tag
+
+
+def test_round_trip():
+    bot_id, cycle_id = uuid4(), uuid4()
+    value = client_order_id(bot_id, cycle_id, "SELL", 12, 3)
+
+    assert len(value) <= 36
+    assert parse_client_order_id(value) == ClientOrderId(tag(bot_id), tag(cycle_id), "SELL", 12, 3)
+
+
+def test_ids_of_other_orders():
+    assert parse_client_order_id(None) is None
+    assert parse_client_order_id("web_4f2a1c") is None
+    assert parse_client_order_id("x-" + uuid4().hex) is None
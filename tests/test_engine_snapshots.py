@@ -0,0 +1,34 @@
+import json
+from decimal import Decimal
+from uuid import uuid4
+
+from app.services.engine_snapshots import SNAPSHOT_VERSION, EngineSnapshots
+
+
+def test_write_and_read(tmp_path):
+    snapshots = EngineSnapshots(str(tmp_path))
+    bot_id = uuid4()
+
+    assert snapshots.read(bot_id) is None
+
+    snapshots.write(bot_id, {"cycle_id": "c", "open_orders": {"123": ["NEW", Decimal("0.01")]}, "last_event_time": 5})
+    snapshot = snapshots.read(bot_id)
+
+    assert snapshot["version"] == SNAPSHOT_VERSION
+    assert snapshot["bot_id"] == str(bot_id)
+    assert snapshot["open_orders"] == {"123": ["NEW", "0.01"]}
+    assert snapshot["last_event_time"] == 5
+    assert [path.name for path in tmp_path.iterdir()] == [f"{bot_id}.json"]
+
+def test_other_versions_and_broken_files_are_ignored(tmp_path):
+    snapshots = EngineSnapshots(str(tmp_path))
+    old, broken = uuid4(), uuid4()
+    (tmp_path / f"{old}.json").write_text(json.dumps({"version": SNAPSHOT_VERSION - 1, "cycle_id": "c"}))
+    (tmp_path / f"{broken}.json").write_text('{"version": ')
+
+    assert snapshots.read(old) is None
+    assert snapshots.read(broken) is None
+
+    snapshots.remove(old)
+    snapshots.remove(old)
+    assert not (tmp_path / f"{old}.json").exists()
@@ -0,0 +1,102 @@
+import threading
+from uuid import uuid4
+
+import pytest
+
+from app.services.event_dispatcher import EventDispatcher
+
+
+def block(dispatcher, bot_id) -> threading.Event:
+    """Hold the queue of a bot with an event running until the returned one is set"""
+    started, release = threading.Event(), threading.Event()
+    dispatcher.dispatch(bot_id, lambda: started.set() or release.wait(5))
+    assert started.wait(5)
+    return release
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = EventDispatcher(workers=4, batch=2)
+    dispatcher.start()
+    yield dispatcher
+    dispatcher.stop()
+
+
+def test_events_of_a_bot_run_in_order(dispatcher):
+    bot_id = uuid4()
+    handled = []
+    for i in range(100):
+        dispatcher.dispatch(bot_id, handled.append, i)
+    dispatcher.stop()
+
+    assert handled == list(range(100))
+    assert dispatcher.stats()[bot_id]["processed"] == 100
+
+
+def test_bots_run_in_parallel(dispatcher):
+    # Neither event completes unless the other one runs at the same time
+    barrier = threading.Barrier(2, timeout=5)
+    dispatcher.dispatch(uuid4(), barrier.wait)
+    dispatcher.dispatch(uuid4(), barrier.wait)
+    dispatcher.stop()
+
+    assert not barrier.broken
+
+
+def test_slow_bot_holds_only_its_own_queue(dispatcher):
+    slow, fast = uuid4(), uuid4()
+    done = threading.Event()
+    release = block(dispatcher, slow)
+    dispatcher.dispatch(slow, lambda: None)
+    dispatcher.dispatch(fast, done.set)
+
+    assert done.wait(5)
+    assert dispatcher.stats()[slow]["depth"] == 1
+    release.set()
+
+
+def test_keyed_events_supersede_pending_ones(dispatcher):
+    bot_id = uuid4()
+    prices = []
+    release = block(dispatcher, bot_id)
+    for price in ("100", "101", "102"):
+        dispatcher.dispatch(bot_id, prices.append, price, key="BTCUSDT")
+    dispatcher.dispatch(bot_id, prices.append, "ETH", key="ETHUSDT")
+
+    stats = dispatcher.stats()[bot_id]
+    assert (stats["depth"], stats["coalesced"]) == (2, 2)
+    assert stats["oldest_wait"] > 0
+    release.set()
+    dispatcher.stop()
+    assert prices == ["102", "ETH"]
+
+
+def test_discard_and_failing_events(dispatcher):
+    bot_id = uuid4()
+    handled = []
+    release = block(dispatcher, bot_id)
+    dispatcher.dispatch(bot_id, handled.append, "dropped")
+    dispatcher.discard(bot_id)
+    release.set()
+    dispatcher.dispatch(bot_id, lambda: 1 / 0)
+    dispatcher.dispatch(bot_id, handled.append, "after the failure")
+    dispatcher.stop()
+    dispatcher.dispatch(bot_id, handled.append, "after stop")
+
+    assert handled == ["after the failure"]
+
+
+def test_discarded_bots_leave_the_stats(dispatcher):
+    bot_id, idle_bot_id = uuid4(), uuid4()
+    dispatcher.dispatch(idle_bot_id, lambda: None)
+    release = block(dispatcher, bot_id)
+    dispatcher.discard(bot_id)
+    assert bot_id in dispatcher.stats()  # until the event being run completes
+
+    release.set()
+    dispatcher.stop()
+    assert bot_id not in dispatcher.stats()
+
+    assert idle_bot_id in dispatcher.stats()
+    dispatcher.discard(idle_bot_id)
+    assert idle_bot_id not in dispatcher.stats()
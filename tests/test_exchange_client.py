@@ -0,0 +1,164 @@
+import time
+from unittest.mock import Mock
+
+import pytest
+import requests
+from binance.error import ClientError, ServerError
+
+from app.services.exchange_client import (
+    REJECTED, UNKNOWN_OUTCOME, ClientRegistry, ExchangeClient, ExchangeMetrics, RetryPolicy, classify
+)
+
+POLICY = RetryPolicy(attempts=3, base_delay=0, timeout=10)
+READ_POLICY = RetryPolicy(attempts=3, base_delay=0, timeout=10, idempotent=True)
+POLICIES = {"new_order": READ_POLICY, "cancel_order": READ_POLICY, "cancel_and_replace": POLICY}
+
+
+def rate_limited():
+    return ClientError(429, -1003, "Too many requests", {"Retry-After": "0"})
+
+
+@pytest.fixture
+def spot():
+    spot = Mock()
+    spot.timeout = 10
+    spot.api_key = "key"
+    return spot
+
+
+@pytest.fixture
+def metrics():
+    return ExchangeMetrics()
+
+
+@pytest.fixture
+def client(spot, metrics):
+    return ExchangeClient(spot, policies=POLICIES, default_policy=READ_POLICY, metrics=metrics)
+
+
+def test_classify():
+    assert classify(rate_limited()) == REJECTED
+    assert classify(ClientError(400, -1021, "Timestamp outside of the recvWindow", {})) == REJECTED
+    assert classify(ClientError(400, -1007, "Timeout waiting for response from backend server", {})) == UNKNOWN_OUTCOME
+    assert classify(ServerError(503, "Service unavailable")) == UNKNOWN_OUTCOME
+    assert classify(requests.exceptions.ConnectTimeout()) == REJECTED
+    assert classify(requests.exceptions.ReadTimeout()) == UNKNOWN_OUTCOME
+    assert classify(ClientError(400, -2010, "Account has insufficient balance", {})) is None
+    assert classify(ValueError()) is None
+
+
+def test_retries_transient_errors(client, spot, metrics):
+    spot.ticker_price.side_effect = [rate_limited(), ServerError(502, "Bad gateway"), {"price": "100000"}]
+
+    assert client.ticker_price(symbol="BTCUSDT") == {"price": "100000"}
+    assert spot.ticker_price.call_count == 3
+    assert client.api_key == "key"
+    stats = metrics.snapshot()["ticker_price"]
+    assert (stats["calls"], stats["retries"], stats["failures"]) == (1, 2, 0)
+
+
+def test_other_errors_are_raised_at_once(client, spot, metrics):
+    spot.new_order.side_effect = ClientError(400, -2010, "Account has insufficient balance", {})
+
+    with pytest.raises(ClientError):
+        client.new_order(symbol="BTCUSDT", side="BUY")
+    assert spot.new_order.call_count == 1
+    assert metrics.snapshot()["new_order"]["failures"] == 1
+
+
+def test_gives_up_after_the_last_attempt(client, spot):
+    spot.get_order.side_effect = ServerError(503, "Service unavailable")
+
+    with pytest.raises(ServerError):
+        client.get_order(symbol="BTCUSDT", orderId=1)
+    assert spot.get_order.call_count == 3
+
+
+def test_order_with_unknown_outcome_is_looked_up(client, spot):
+    spot.new_order.side_effect = requests.exceptions.ReadTimeout()
+    spot.get_order.return_value = {"orderId": 7, "status": "NEW", "executedQty": "0", "updateTime": 1000}
+
+    assert client.new_order(symbol="BTCUSDT", side="BUY")["transactTime"] == 1000
+    assert spot.new_order.call_count == 1
+    client_order_id = spot.new_order.call_args.kwargs["newClientOrderId"]
+    spot.get_order.assert_called_once_with(symbol="BTCUSDT", origClientOrderId=client_order_id)
+
+
+def test_order_not_placed_is_sent_again_with_the_same_id(client, spot):
+    spot.new_order.side_effect = [ServerError(503, "Service unavailable"), {"orderId": 7, "status": "NEW"}]
+    spot.get_order.side_effect = ClientError(400, -2013, "Order does not exist.", {})
+
+    assert client.new_order(symbol="BTCUSDT", side="BUY", newClientOrderId="grid-1")["orderId"] == 7
+    assert [call.kwargs["newClientOrderId"] for call in spot.new_order.call_args_list] == ["grid-1", "grid-1"]
+
+
+def test_replace_is_only_retried_when_rejected(client, spot):
+    spot.cancel_and_replace.side_effect = [rate_limited(), ServerError(503, "Service unavailable")]
+
+    with pytest.raises(ServerError):
+        client.cancel_and_replace(symbol="BTCUSDT", cancelOrderId=1)
+    assert spot.cancel_and_replace.call_count == 2
+
+
+def test_cancel_of_cancelled_order(client, spot):
+    spot.cancel_order.side_effect = [requests.exceptions.ReadTimeout(),
+                                     ClientError(400, -2011, "Unknown order sent.", {})]
+    spot.get_order.return_value = {"orderId": 1, "status": "CANCELED", "executedQty": "0"}
+
+    assert client.cancel_order(symbol="BTCUSDT", orderId=1)["status"] == "CANCELED"
+    spot.get_order.assert_called_once_with(symbol="BTCUSDT", orderId=1)
+
+
+def test_hedged_cancel(spot, metrics):
+    responses = iter([0.5, 0])
+
+    def cancel_order(**kwargs):
+        time.sleep(next(responses))
+        return {"orderId": 1, "status": "CANCELED", "executedQty": "0"}
+
+    spot.cancel_order.side_effect = cancel_order
+    client = ExchangeClient(spot, policies={"cancel_order": RetryPolicy(timeout=10, hedge_after=0.05)},
+                            metrics=metrics)
+
+    started = time.perf_counter()
+    assert client.cancel_order(symbol="BTCUSDT", orderId=1)["status"] == "CANCELED"
+    assert time.perf_counter() - started < 0.4
+    assert spot.cancel_order.call_count == 2
+    assert metrics.snapshot()["cancel_order"]["hedged"] == 1
+
+
+def test_latency_percentiles():
+    metrics = ExchangeMetrics(capacity=100)
+    for i in range(200):
+        metrics.record("get_order", i / 1000, 0, False)
+
+    stats = metrics.snapshot()["get_order"]
+    assert stats["calls"] == 200
+    assert stats["p50"] == 0.15
+    assert stats["p99"] == 0.199
+    assert stats["max"] == 0.199
+
+
+def test_client_registry():
+    registry = ClientRegistry()
+    client = registry.get("key", "secret", "https://api.binance.com")
+
+    assert registry.get("key", "secret", "https://api.binance.com") is client
+    assert registry.get("key", "secret", "https://testnet.binance.vision") is not client
+    assert registry.get("other", "secret", "https://api.binance.com") is not client
+    assert client.session.get_adapter("https://api.binance.com")._pool_maxsize == registry.pool_size
+    rotated = registry.get("key", "new secret", "https://api.binance.com")
+    assert rotated is not client and rotated.api_secret == "new secret"
+
+
+def test_idle_clients_are_closed():
+    registry = ClientRegistry(idle_timeout=60)
+    client = registry.get("key", "secret", "https://api.binance.com")
+    busy = registry.get("busy", "secret", "https://api.binance.com")
+    registry.last_used[("key", "https://api.binance.com")] -= 61
+
+    assert registry.close_idle() == 1
+    assert registry.get("busy", "secret", "https://api.binance.com") is busy
+    # A client used after it was dropped, by a bot that still holds it, is registered again
+    client.session.hooks["response"][-1](Mock())
+    assert registry.get("key", "secret", "https://api.binance.com") is client
@@ -0,0 +1,58 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from app.fixed_point import (PERCENT_PLACES, from_units, parse_units, price_change_trigger, symbol_precision,
+                             to_units)
+
+# Property checks over random values, seeded so that failures can be reproduced
+rng = random.Random(1234)
+
+def random_price(places=8):
+    units = rng.randrange(1, 10 ** 20)  # the range of a DECIMAL(20, 8) column
+    return Decimal(units).scaleb(-places)
+
+def random_percentage():
+    return Decimal(rng.randrange(0, 10000)).scaleb(-PERCENT_PLACES)
+
+def test_round_trip_of_column_values():
+    for _ in range(10000):
+        value = random_price()
+        units = to_units(value)
+        assert from_units(units) == value
+        assert parse_units(str(value)) == units
+        assert parse_units(f"{value:f}") == units
+
+def test_parse_exchange_strings():
+    assert parse_units("65001.23000000") == 6500123000000
+    assert parse_units("0.00000001") == 1
+    assert parse_units("-1.5") == -150000000
+    assert parse_units("42") == 4200000000
+    assert parse_units("0.100000000000") == 10000000
+    assert from_units(parse_units("65001.23")) == Decimal("65001.23")
+
+def test_inexact_values_are_refused():
+    with pytest.raises(ValueError):
+        parse_units("0.000000001")
+    with pytest.raises(ValueError):
+        to_units(Decimal("1") / 3)
+
+def test_price_change_trigger_matches_decimal_computation():
+    for _ in range(10000):
+        reference = random_price(rng.choice([2, 8]))
+        percentage = random_percentage()
+        trigger = price_change_trigger(to_units(reference), to_units(percentage, PERCENT_PLACES))
+
+        # Prices around the trigger and anywhere else
+        for price_units in (trigger - 1, trigger, trigger + 1, rng.randrange(1, 2 * trigger)):
+            price = from_units(price_units)
+            price_increase = (price - reference) / reference * 100
+            assert (price_units >= trigger) == (price_increase >= percentage), (reference, percentage, price)
+
+def test_symbol_precision_matches_exchange_filters():
+    assert symbol_precision("BTCUSDT").step_size == Decimal("0.00001")
+    assert symbol_precision("BTCUSDT").tick_size == Decimal("0.01")
+    assert symbol_precision("PEPEUSDT").step_size == Decimal("0.00000001")
+    with pytest.raises(ValueError):
+        symbol_precision("DOGEUSDT")
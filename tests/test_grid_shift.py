@@ -0,0 +1,50 @@
+from app.grid_shift import GridLevel, plan_grid_shift
+
+
+def test_unchanged_grid_is_kept():
+    levels = [GridLevel(1, 9900, 10), GridLevel(2, 9800, 11)]
+    shift = plan_grid_shift([("a", levels[0]), ("b", levels[1])], levels)
+
+    assert shift.keep == [("a", levels[0]), ("b", levels[1])]
+    assert shift.requests == 0
+
+def test_levels_within_tolerance_are_kept():
+    orders = [("a", GridLevel(1, 9900, 10)), ("b", GridLevel(2, 9800, 11))]
+    levels = [GridLevel(1, 9901, 9), GridLevel(2, 9795, 11)]
+
+    shift = plan_grid_shift(orders, levels, price_tolerance=2, quantity_tolerance=1)
+
+    assert shift.keep == [("a", levels[0])]
+    assert shift.replace == [("b", levels[1])]
+    assert shift.cancel == [] and shift.place == []
+
+def test_quantity_change_replaces_order():
+    orders = [("a", GridLevel(1, 9900, 10))]
+    levels = [GridLevel(1, 9900, 12)]
+
+    shift = plan_grid_shift(orders, levels, price_tolerance=2, quantity_tolerance=1)
+
+    assert shift.replace == [("a", levels[0])]
+
+def test_shifted_grid_reuses_overlapping_levels():
+    # The grid moves up one level: the old first level becomes the new second one
+    orders = [("a", GridLevel(1, 9900, 10)), ("b", GridLevel(2, 9800, 10)), ("c", GridLevel(3, 9700, 10))]
+    levels = [GridLevel(1, 10000, 10), GridLevel(2, 9900, 10), GridLevel(3, 9800, 10)]
+
+    shift = plan_grid_shift(orders, levels)
+
+    assert shift.keep == [("a", levels[1]), ("b", levels[2])]
+    assert shift.replace == [("c", levels[0])]
+    assert shift.requests == 1
+
+def test_surplus_orders_and_levels():
+    orders = [("a", GridLevel(1, 9900, 10)), ("b", GridLevel(2, 9800, 10))]
+
+    fewer = plan_grid_shift(orders, [GridLevel(1, 12000, 10)])
+    assert fewer.replace == [("a", GridLevel(1, 12000, 10))]
+    assert fewer.cancel == ["b"]
+
+    levels = [GridLevel(1, 12000, 10), GridLevel(2, 11000, 10), GridLevel(3, 10000, 10)]
+    more = plan_grid_shift(orders, levels)
+    assert more.replace == [("a", levels[0]), ("b", levels[1])]
+    assert more.place == [levels[2]]
@@ -0,0 +1,66 @@
+import json
+from unittest.mock import Mock, patch
+
+import pytest
+
+from app.services.market_data import MarketDataFeed
+
+
+@pytest.fixture
+def mock_socket_class():
+    with patch('app.services.market_data.SpotWebsocketStreamClient') as mock:
+        mock.side_effect = lambda **kwargs: Mock()
+        yield mock
+
+def test_symbols_share_combined_connections(mock_socket_class):
+    feed = MarketDataFeed(stream="miniTicker", streams_per_socket=2)
+    for symbol in ("BTCUSDT", "ETHUSDT", "PEPEUSDT"):
+        feed.subscribe(symbol, Mock())
+    feed.subscribe("BTCUSDT", Mock())  # a second bot on the same symbol
+
+    assert mock_socket_class.call_count == 2
+    assert all(call.kwargs["is_combined"] for call in mock_socket_class.call_args_list)
+    first, second = feed.sockets
+    assert [call.args[0] for call in first.subscribe.call_args_list] == ["btcusdt@miniTicker", "ethusdt@miniTicker"]
+    assert [call.args[0] for call in second.subscribe.call_args_list] == ["pepeusdt@miniTicker"]
+
+def test_unsubscribe_last_listener(mock_socket_class):
+    feed = MarketDataFeed(stream="bookTicker")
+    listener, other = Mock(), Mock()
+    feed.subscribe("BTCUSDT", listener)
+    feed.subscribe("BTCUSDT", other)
+    feed.subscribe("ETHUSDT", listener)
+    socket = next(iter(feed.sockets))
+
+    feed.unsubscribe("BTCUSDT", listener)
+    socket.unsubscribe.assert_not_called()
+
+    feed.unsubscribe("BTCUSDT", other)
+    socket.unsubscribe.assert_called_once_with("btcusdt@bookTicker")
+
+    feed.unsubscribe("ETHUSDT", listener)
+    socket.stop.assert_called_once()
+    assert feed.sockets == {}
+
+@pytest.mark.parametrize("stream,data,price", [
+    ("miniTicker", {"e": "24hrMiniTicker", "s": "BTCUSDT", "c": "65000.10000000", "o": "1", "v": "2"}, "65000.10000000"),
+    ("bookTicker", {"u": 1, "s": "BTCUSDT", "b": "64999.99000000", "B": "1", "a": "65000.01000000", "A": "2"},
+     "64999.99000000"),
+    ("aggTrade", {"e": "aggTrade", "s": "BTCUSDT", "p": "65000.02000000", "q": "0.1", "T": 1}, "65000.02000000"),
+    ("24hrTicker", {"e": "24hrTicker", "s": "BTCUSDT", "c": "65000.03000000", "p": "10"}, "65000.03000000"),
+])
+def test_price_streams(mock_socket_class, stream, data, price):
+    feed = MarketDataFeed(stream=stream)
+    listener, other = Mock(), Mock()
+    feed.subscribe("BTCUSDT", listener)
+    feed.subscribe("ETHUSDT", other)
+
+    feed._on_message(None, json.dumps({"stream": "btcusdt@whatever", "data": data}))
+    feed._on_message(None, json.dumps({"result": None, "id": 1}))
+
+    listener.assert_called_once_with("BTCUSDT", price)
+    other.assert_not_called()
+
+def test_unsupported_stream():
+    with pytest.raises(ValueError):
+        MarketDataFeed(stream="depth")
@@ -0,0 +1,22 @@
+from sqlalchemy import create_engine, inspect, text
+
+from app.migrations import COLUMNS, INDEXES, upgrade
+
+
+def test_upgrade_adds_the_missing_columns_and_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'upgrade.db'}")
+    upgrade(engine)
+    with engine.begin() as connection:  # as deployed before the columns were added
+        for table_name, column_name in COLUMNS:
+            connection.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {column_name}"))
+        for name in INDEXES:
+            connection.execute(text(f"DROP INDEX {name}"))
+
+    upgrade(engine)
+    upgrade(engine)
+
+    inspector = inspect(engine)
+    for table_name, column_name in COLUMNS:
+        assert column_name in {column["name"] for column in inspector.get_columns(table_name)}
+    indexes = {index["name"] for table_name in inspector.get_table_names() for index in inspector.get_indexes(table_name)}
+    assert set(INDEXES) <= indexes
@@ -0,0 +1,65 @@
+import pytest
+from datetime import timedelta
+from decimal import Decimal
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from app.enums import CycleStatusType, OrderStatusType, OrderType, SideType, TimeInForceType
+from app.models import Order, OrderArchive
+from app.services.order_archiver import OrderArchiver
+
+
+@pytest.fixture
+def order_archiver(db_session):
+    session_factory = sessionmaker(bind=db_session.bind, autoflush=False)
+    return OrderArchiver(session_factory=session_factory, min_age=timedelta(hours=1), batch_size=10)
+
+def add_order(db_session, cycle, side, price, quantity_filled, exchange_order_id):
+    order = Order(
+        exchange=cycle.exchange,
+        symbol=cycle.symbol,
+        side=side,
+        type=OrderType.LIMIT,
+        time_in_force=TimeInForceType.GTC,
+        price=price,
+        quantity=quantity_filled,
+        quantity_filled=quantity_filled,
+        amount=price * quantity_filled,
+        status=OrderStatusType.FILLED,
+        number=1,
+        exchange_order_id=exchange_order_id,
+        exchange_order_data={"i": exchange_order_id},
+        cycle_id=cycle.id
+    )
+    db_session.add(order)
+    return order
+
+def test_archive_completed_cycle(order_archiver, test_cycle, db_session):
+    test_cycle.status = CycleStatusType.COMPLETED
+    test_cycle.quantity = Decimal('0.01')
+    add_order(db_session, test_cycle, SideType.BUY, Decimal('100000'), Decimal('0.01'), 201)
+    add_order(db_session, test_cycle, SideType.SELL, Decimal('101000'), Decimal('0.01'), 202)
+    db_session.flush()
+    test_cycle.updated_at = db_session.execute(select(func.now())).scalar().replace(tzinfo=None) - timedelta(hours=2)
+    db_session.commit()
+    profit = test_cycle.profit()
+
+    assert order_archiver.archive_completed_cycles() == 1
+
+    db_session.expire_all()
+    assert test_cycle.archived_at is not None
+    assert test_cycle.orders.count() == 0
+    archived = db_session.query(OrderArchive).filter(OrderArchive.cycle_id == test_cycle.id).all()
+    assert sorted(order.exchange_order_id for order in archived) == [201, 202]
+    assert all(order.exchange_order_data == {"i": order.exchange_order_id} for order in archived)
+    # Profit is computed from the archive transparently
+    assert test_cycle.profit() == profit == Decimal('10')
+
+def test_archive_skips_active_and_recent_cycles(order_archiver, test_cycle, test_order, db_session):
+    assert order_archiver.archive_completed_cycles() == 0
+
+    test_cycle.status = CycleStatusType.COMPLETED
+    db_session.commit()
+
+    assert order_archiver.archive_completed_cycles() == 0
+    assert test_cycle.orders.count() == 1
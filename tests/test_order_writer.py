@@ -0,0 +1,77 @@
+import pytest
+from decimal import Decimal
+from unittest.mock import Mock
+from uuid import uuid4
+from sqlalchemy.orm import sessionmaker
+
+from app.enums import OrderStatusType
+from app.services.order_writer import OrderWriter
+
+
+@pytest.fixture
+def order_writer(db_session):
+    session_factory = sessionmaker(bind=db_session.bind, autoflush=False)
+    return OrderWriter(session_factory=session_factory, max_delay=0.001, max_rows=10)
+
+def test_submit_coalesces_updates(order_writer, test_order, db_session):
+    first = order_writer.submit(test_order.id, status=OrderStatusType.PARTIALLY_FILLED, quantity_filled=Decimal('0.01'))
+    second = order_writer.submit(test_order.id, status=OrderStatusType.FILLED, quantity_filled=Decimal('0.02'))
+
+    assert second > first
+    assert order_writer.pending == {
+        test_order.id: {"status": OrderStatusType.FILLED, "quantity_filled": Decimal('0.02')}
+    }
+
+def test_flush_writes_pending_updates(order_writer, test_order, db_session):
+    ticket = order_writer.submit(test_order.id, status=OrderStatusType.FILLED, quantity_filled=Decimal('0.02'),
+                                 exchange_order_data={"X": "FILLED"})
+
+    order_writer.flush()
+
+    db_session.refresh(test_order)
+    assert test_order.status == OrderStatusType.FILLED
+    assert test_order.quantity_filled == Decimal('0.02')
+    assert test_order.exchange_order_data == {"X": "FILLED"}
+    assert not order_writer.pending
+    assert order_writer.flushed == ticket
+
+def test_wait_without_background_thread_flushes(order_writer, test_order, db_session):
+    ticket = order_writer.submit(test_order.id, status=OrderStatusType.CANCELED)
+
+    order_writer.wait(ticket)
+
+    db_session.refresh(test_order)
+    assert test_order.status == OrderStatusType.CANCELED
+
+def test_background_flush(order_writer, test_order, db_session):
+    order_writer.start()
+    try:
+        ticket = order_writer.submit(test_order.id, status=OrderStatusType.FILLED)
+        order_writer.wait(ticket, timeout=5)
+    finally:
+        order_writer.stop()
+
+    db_session.refresh(test_order)
+    assert test_order.status == OrderStatusType.FILLED
+
+def test_failed_flush_keeps_updates(order_writer, test_order):
+    order_writer.session_factory = Mock(side_effect=Exception("DB down"))
+    order_writer.submit(test_order.id, status=OrderStatusType.FILLED)
+
+    with pytest.raises(Exception, match="DB down"):
+        order_writer.flush()
+
+    assert order_writer.pending == {test_order.id: {"status": OrderStatusType.FILLED}}
+    assert order_writer.flushed == 0
+
+def test_flush_skips_missing_orders(order_writer, test_order, db_session):
+    order_writer.submit(uuid4(), status=OrderStatusType.CANCELED)
+    order_writer.submit(test_order.id, status=OrderStatusType.FILLED, quantity_filled=Decimal('0.02'))
+
+    order_writer.flush()
+
+    db_session.refresh(test_order)
+    assert test_order.status == OrderStatusType.FILLED
+    assert test_order.quantity_filled == Decimal('0.02')
+    assert order_writer.pending == {}
+    assert order_writer.flushed == order_writer.submitted
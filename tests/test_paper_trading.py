@@ -0,0 +1,86 @@
+import pytest
+from decimal import Decimal
+from unittest.mock import Mock
+from uuid import uuid4
+
+from app.enums import CycleStatusType
+from app.fixed_point import to_units
+from app.models import PaperBot, PaperCycle
+from app.services.paper_trading import BUY, SELL, SHIFT, PaperBook, PaperTrading
+
+
+def test_book_matches_crossed_orders():
+    book = PaperBook()
+    bids = [book.add(0, BUY, to_units(price), 1) for price in (99, 98, 97)]
+    ask = book.add(1, SELL, to_units(101), 1)
+    trigger = book.add(2, SHIFT, to_units(102))
+
+    assert book.match(to_units(100)) == []
+    assert book.match(to_units("98.5")) == bids[:1]
+    book.release(bids[0])
+
+    book.cancel(bids[2])
+    assert book.match(to_units(90)) == bids[1:2]
+    assert book.match(to_units(105)) == [ask, trigger]
+    assert len(book) == 0
+
+    # Released slots are reused
+    assert book.add(0, BUY, to_units(95), 1) in (bids[0], bids[2])
+
+@pytest.fixture
+def paper_bot(db_session):
+    bot = PaperBot(
+        id=uuid4(), name="Paper", symbol="BTCUSDT", amount=Decimal('1000'), grid_length=Decimal('10'),
+        first_order_offset=Decimal('1'), num_orders=5, next_order_volume=Decimal('20'),
+        profit_percentage=Decimal('1'), price_change_percentage=Decimal('1'), is_active=True
+    )
+    db_session.add(bot)
+    db_session.commit()
+    return bot
+
+@pytest.fixture
+def paper_trading(db_session):
+    session_factory = Mock(return_value=db_session)
+    session_factory.return_value.__enter__ = Mock(return_value=db_session)
+    session_factory.return_value.__exit__ = Mock(return_value=False)
+    return PaperTrading(Mock(), session_factory)
+
+def test_paper_bot_cycle(paper_trading, paper_bot, db_session):
+    paper_trading.load()
+    paper_trading.market_data.subscribe.assert_called_once_with("BTCUSDT", paper_trading.on_price)
+
+    paper_trading.on_price("BTCUSDT", "100000.00000000")
+    book = paper_trading.books["BTCUSDT"]
+    assert len(paper_trading.grid_slots[0]) == 5
+    assert book.prices[paper_trading.grid_slots[0][0]] == to_units(99000)
+
+    # The first level fills and the take profit is placed 1% over it
+    paper_trading.on_price("BTCUSDT", "98900.00000000")
+    assert len(paper_trading.grid_slots[0]) == 4
+    take_profit = paper_trading.take_profit_slots[0]
+    assert book.prices[take_profit] == to_units(99990)
+    assert book.quantities[take_profit] == paper_trading.bought[0]
+
+    # The take profit fills, the cycle is recorded and a new one starts
+    paper_trading.on_price("BTCUSDT", "100000.00000000")
+    assert paper_trading.stats(paper_bot.id)["cycle_price"] == Decimal(100000)
+    assert len(paper_trading.grid_slots[0]) == 5
+
+    paper_trading.flush()
+    cycle = db_session.query(PaperCycle).filter(PaperCycle.paper_bot_id == paper_bot.id).one()
+    assert cycle.status == CycleStatusType.COMPLETED
+    assert cycle.buy_fills == 1
+    assert cycle.profit() == round(cycle.quantity * Decimal(990), 2)
+
+def test_paper_grid_shift(paper_trading, paper_bot):
+    paper_trading.add(paper_bot)
+    paper_trading.on_price("BTCUSDT", "100000.00000000")
+
+    paper_trading.on_price("BTCUSDT", "100999.00000000")
+    assert paper_trading.services[0].cycle.price == Decimal(100000)
+
+    paper_trading.on_price("BTCUSDT", "101000.00000000")
+    book = paper_trading.books["BTCUSDT"]
+    assert paper_trading.services[0].cycle.price == Decimal(101000)
+    assert book.prices[paper_trading.grid_slots[0][0]] == to_units(99990)
+    assert len(book) == 6  # the shifted grid and its next trigger
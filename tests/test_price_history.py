@@ -0,0 +1,57 @@
+import pytest
+
+from app.fixed_point import to_units
+from app.services.price_history import PriceHistory, RingBuffer, lttb
+
+
+def test_ring_buffer_keeps_the_last_values():
+    buffer = RingBuffer("q", 3)
+    assert buffer.to_list() == []
+
+    for value in range(1, 6):
+        buffer.append(value)
+
+    assert len(buffer) == 3
+    assert buffer.to_list() == [3, 4, 5]
+    assert buffer.to_list(2) == [4, 5]
+    assert buffer.last == 5
+
+    buffer.last = 6
+    assert buffer.to_list() == [3, 4, 6]
+
+def test_candles_are_aggregated_per_resolution():
+    history = PriceHistory(resolutions=(60, 300))
+    for timestamp, price in [(0, "100.00"), (10, "103.00"), (59, "99.00"), (60, "101.00"), (61, "102.50")]:
+        history.record("BTCUSDT", price, timestamp)
+
+    assert history.candles("BTCUSDT", 60) == [
+        (0, to_units("100"), to_units("103"), to_units("99"), to_units("99")),
+        (60, to_units("101"), to_units("102.5"), to_units("101"), to_units("102.5")),
+    ]
+    assert history.candles("BTCUSDT", 300) == [
+        (0, to_units("100"), to_units("103"), to_units("99"), to_units("102.5")),
+    ]
+    assert history.candles("BTCUSDT", 60, count=1)[0][0] == 60
+    assert history.candles("ETHUSDT", 60) == []
+
+    with pytest.raises(ValueError):
+        history.candles("BTCUSDT", 15)
+
+def test_ticks_are_bounded():
+    history = PriceHistory(tick_capacity=2)
+    for timestamp, price in enumerate(["1.00000000", "2.00000000", "3.00000000"]):
+        history.record("BTCUSDT", price, timestamp)
+
+    assert history.ticks("BTCUSDT") == ([1.0, 2.0], [to_units(2), to_units(3)])
+
+def test_lttb_keeps_the_extremes():
+    xs = list(range(100))
+    ys = [0] * 100
+    ys[37], ys[71] = 50, -50
+
+    sampled = lttb(xs, ys, 10)
+
+    assert len(sampled) == 10
+    assert sampled[0] == (0, 0) and sampled[-1] == (99, 0)
+    assert (37, 50) in sampled and (71, -50) in sampled
+    assert lttb(xs[:5], ys[:5], 10) == list(zip(xs[:5], ys[:5]))
@@ -0,0 +1,56 @@
+import json
+
+from app.services import stream_messages as messages
+
+TICKER = {"e": "24hrTicker", "E": 1700000000000, "s": "BTCUSDT", "p": "120.00000000", "P": "0.185",
+          "w": "65010.12000000", "x": "64900.00000000", "c": "65020.01000000", "Q": "0.00100000",
+          "b": "65020.00000000", "B": "1.20000000", "a": "65020.01000000", "A": "0.50000000",
+          "o": "64900.01000000", "h": "65500.00000000", "l": "64000.00000000", "v": "1234.50000000",
+          "q": "80000000.00000000", "O": 1699913600000, "C": 1700000000000, "F": 1, "L": 1000, "n": 1000}
+EXECUTION_REPORT = {"e": "executionReport", "E": 1700000000000, "s": "BTCUSDT", "c": "web_123", "S": "BUY",
+                    "o": "LIMIT", "f": "GTC", "q": "0.02000000", "p": "64000.00000000", "x": "TRADE",
+                    "X": "PARTIALLY_FILLED", "i": 4242, "l": "0.01000000", "z": "0.01000000", "C": ""}
+ACCOUNT_POSITION = {"e": "outboundAccountPosition", "E": 1700000000000, "u": 1700000000000,
+                    "B": [{"a": "BTC", "f": "0.01000000", "l": "0.00000000"},
+                          {"a": "USDT", "f": "100.00000000", "l": "1280.00000000"}]}
+
+
+def test_decode_ticker():
+    ticker = messages.decode(json.dumps(TICKER))
+
+    assert isinstance(ticker, messages.Ticker)
+    assert ticker == messages.Ticker(symbol="BTCUSDT", price="65020.01000000")
+
+def test_decode_execution_report():
+    report = messages.decode(json.dumps(EXECUTION_REPORT))
+
+    assert isinstance(report, messages.ExecutionReport)
+    assert (report.symbol, report.side, report.status) == ("BTCUSDT", "BUY", "PARTIALLY_FILLED")
+    assert report.order_id == 4242
+    assert report.quantity_filled == "0.01000000"
+    assert report.client_order_id == "web_123"
+
+def test_decode_account_position():
+    position = messages.decode(json.dumps(ACCOUNT_POSITION))
+
+    assert isinstance(position, messages.AccountPosition)
+    assert [(balance.asset, balance.free, balance.locked) for balance in position.balances] == [
+        ("BTC", "0.01000000", "0.00000000"), ("USDT", "100.00000000", "1280.00000000")
+    ]
+
+def test_other_messages_are_skipped():
+    assert messages.decode('{"e": "balanceUpdate", "a": "BTC", "d": "0.1"}') is None
+    assert messages.decode('{"result": null, "id": 1}') is None
+
+def test_combined_stream_messages():
+    decode = messages.combined_decoder(messages.BookTicker)
+    raw = json.dumps({"stream": "btcusdt@bookTicker",
+                      "data": {"u": 1, "s": "BTCUSDT", "b": "64999.99000000", "B": "1", "a": "65000.01000000"}})
+
+    assert decode(raw) == messages.BookTicker(symbol="BTCUSDT", price="64999.99000000")
+    assert decode('{"result": null, "id": 1}') is None
+
+def test_ids_sent_as_strings_are_coerced():
+    report = messages.decode(json.dumps({**EXECUTION_REPORT, "i": "4242"}))
+
+    assert report.order_id == 4242
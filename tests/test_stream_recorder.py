@@ -0,0 +1,121 @@
+import json
+import os
+from decimal import Decimal
+from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+
+from app.enums import OrderStatusType
+from app.models import Order
+from app.services.bot_events_handler import BotEventsHandler
+from app.services.stream_recorder import (
+    MARKET_SOURCE, Record, StreamRecorder, StreamReplayer, read_recording, segments, user_source
+)
+
+
+def mini_ticker(price: str) -> str:
+    return json.dumps({"stream": "btcusdt@miniTicker", "data": {"e": "24hrMiniTicker", "s": "BTCUSDT", "c": price}})
+
+
+def test_recording_round_trip(tmp_path):
+    recorder = StreamRecorder(str(tmp_path), segment_bytes=200)
+    for i in range(10):
+        recorder.record(MARKET_SOURCE, mini_ticker(f"{100000 + i}"))
+    recorder.record("user:bot", b'{"e": "outboundAccountPosition"}')
+    recorder.close()
+
+    assert len(segments(str(tmp_path))) > 1
+    records = list(read_recording(str(tmp_path)))
+    assert [record.source for record in records] == [MARKET_SOURCE] * 10 + ["user:bot"]
+    assert json.loads(records[3].raw)["data"]["c"] == "100003"
+    assert records[-1].raw == '{"e": "outboundAccountPosition"}'
+    assert [record.time for record in records] == sorted(record.time for record in records)
+
+
+def test_truncated_segment_is_read_up_to_the_cut(tmp_path):
+    recorder = StreamRecorder(str(tmp_path))
+    for i in range(1000):
+        recorder.record(MARKET_SOURCE, mini_ticker(f"{100000 + i}"))
+    recorder.close()
+    path = segments(str(tmp_path))[0]
+    with open(path, "r+b") as segment:
+        segment.truncate(os.path.getsize(path) // 2)
+
+    records = list(read_recording(str(tmp_path)))
+    assert len(records) < 1000
+    assert all(json.loads(record.raw)["data"]["s"] == "BTCUSDT" for record in records)
+
+
+def test_oldest_segments_are_deleted_beyond_the_maximum_size(tmp_path):
+    recorder = StreamRecorder(str(tmp_path), segment_bytes=200, max_bytes=1)
+    for i in range(10):
+        recorder.record(MARKET_SOURCE, mini_ticker(f"{100000 + i}"))
+    recorder.close()
+
+    # Only the segment being written is kept
+    assert len(segments(str(tmp_path))) == 1
+    assert json.loads(list(read_recording(str(tmp_path)))[-1].raw)["data"]["c"] == "100009"
+
+
+def test_segments_are_deleted_beyond_the_maximum_age(tmp_path):
+    recorder = StreamRecorder(str(tmp_path), segment_bytes=200, max_age=3600)
+    for i in range(4):
+        recorder.record(MARKET_SOURCE, mini_ticker(f"{100000 + i}"))
+    old = segments(str(tmp_path))[:-1]
+    assert old
+    for path in old:
+        os.utime(path, (0, 0))
+
+    for i in range(4):
+        recorder.record(MARKET_SOURCE, mini_ticker(f"{200000 + i}"))
+    recorder.close()
+
+    remaining = segments(str(tmp_path))
+    assert remaining and not set(old) & set(remaining)
+
+@pytest.fixture
+def events_handler(db_session, test_bot, test_cycle):
+    service = Mock()
+    service.db = db_session
+    service.bot = test_bot
+    service.cycle = test_cycle
+    service.unit_of_work = MagicMock()
+    service.find_order.side_effect = lambda client_order_id, order_id: test_cycle.orders.filter(
+        Order.exchange_order_id == str(order_id)
+    ).first()
+    with patch('app.services.bot_events_handler.SpotWebsocketStreamClient'):
+        yield BotEventsHandler(bot=test_bot, trading_service=service, listen_key="test_listen_key")
+
+
+def test_replay_into_events_handler(events_handler, test_order, db_session):
+    report = {"e": "executionReport", "E": 1000, "s": "BTCUSDT", "S": "BUY", "X": "FILLED",
+              "i": int(test_order.exchange_order_id), "z": "0.02", "l": "0.02", "L": "100000"}
+    records = [
+        Record(0, MARKET_SOURCE, mini_ticker("100500")),
+        Record(1000, "user:another-bot", json.dumps(report)),
+        Record(2000, user_source(events_handler.bot.id), json.dumps(report)),
+    ]
+
+    stats = StreamReplayer(events_handler).replay(records, speed=None)
+
+    assert (stats.messages, stats.errors) == (2, 0)
+    events_handler.trading_service.publish.assert_called_once_with("price", symbol="BTCUSDT",
+                                                                   price=Decimal("100500"))
+    db_session.refresh(test_order)
+    assert test_order.status == OrderStatusType.FILLED
+    events_handler.trading_service.update_take_profit_order.assert_called_once()
+
+
+def test_replay_keeps_the_pace_of_the_recording(events_handler):
+    records = [Record(i * 100_000_000, MARKET_SOURCE, mini_ticker("100000")) for i in range(3)]
+
+    assert StreamReplayer(events_handler).replay(records, speed=4).seconds >= 0.05
+    assert StreamReplayer(events_handler).replay(records, speed=None).seconds < 0.05
+
+
+def test_recorded_by_events_handler(events_handler, tmp_path):
+    events_handler.recorder = StreamRecorder(str(tmp_path))
+    events_handler.message_handler(None, '{"e": "listStatus"}')
+    events_handler.recorder.close()
+
+    assert list(read_recording(str(tmp_path)))[0][1:] == (user_source(events_handler.bot.id), '{"e": "listStatus"}')
@@ -1,9 +1,16 @@
+import json
 import pytest
 from decimal import Decimal
-from app.models import TradingCycle, Order
-from app.enums import OrderStatusType, SideType, TimeInForceType, OrderType, CycleStatusType
+from app.client_order_ids import client_order_id
+from app.models import Base, Bot, TradingCycle, Order
+from app.enums import BotStatusType, OrderStatusType, SideType, TimeInForceType, OrderType, CycleStatusType
 from uuid import uuid4
-from unittest.mock import patch
+from unittest.mock import Mock, patch
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+from app.services.balance_cache import BalanceCache, InsufficientBalanceError
+from app.services.engine_snapshots import EngineSnapshots
+from app.services.stream_messages import AccountPosition, Balance
 from app.services.trading_service import TradingService
 
 def test_launch(trading_service, test_bot):
@@ -110,6 +117,29 @@ def test_place_grid_orders(trading_service, mock_binance_client, test_cycle, db_
     assert mock_binance_client.new_order.call_count == trading_service.bot.num_orders
     assert test_cycle.quantity == Decimal('0.01063')
 
+def test_placed_orders_survive_a_failed_grid(test_bot, mock_binance_client, tmp_path):
+    # Committed for real, unlike the test session which rolls back everything at the end
+    engine = create_engine(f"sqlite:///{tmp_path / 'grid.db'}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    with session_factory() as db:
+        bot = Bot(**{column.name: getattr(test_bot, column.name) for column in Bot.__table__.columns})
+        db.add(bot)
+        db.commit()
+
+    new_order = mock_binance_client.new_order.side_effect
+    mock_binance_client.new_order.side_effect = [new_order(), new_order(), Exception("Timeout")]
+    with patch.object(TradingService, "_new_client", return_value=mock_binance_client), session_factory() as db:
+        trading_service = TradingService(db=db, bot=db.get(Bot, bot.id), session_factory=session_factory)
+    with pytest.raises(Exception):
+        with trading_service.unit_of_work():
+            trading_service.start_new_cycle()
+
+    # The orders live on the exchange are stored, so their reports find them
+    with session_factory() as db:
+        assert db.query(Order).count() == 2
+    engine.dispose()
+
 def test_place_take_profit_order(trading_service, mock_binance_client, test_cycle, db_session):
     trading_service.cycle = test_cycle
 
@@ -369,9 +399,11 @@ def test_check_cycle_completion(trading_service, mock_binance_client, test_cycle
     db_session.add(tp_order)
     db_session.commit()
     
+    trading_service.snapshots = Mock()
     trading_service.check_cycle_completion()
     
     assert test_cycle.status == CycleStatusType.COMPLETED
+    trading_service.snapshots.remove.assert_called_once_with(trading_service.bot.id)
     # Should try to start a new cycle since bot is active
     assert mock_binance_client.ticker_price.call_count == 2
 
@@ -436,7 +468,8 @@ def test_create_binance_order_success(trading_service, mock_binance_client, test
         type="LIMIT",
         timeInForce="GTC",
         quantity="0.02000",
-        price="24000"
+        price="24000",
+        newClientOrderId=client_order_id(trading_service.bot.id, test_cycle.id, "BUY", 1, 0)
     )
     
     order = test_cycle.orders.first()
@@ -453,8 +486,55 @@ def test_create_binance_order_success(trading_service, mock_binance_client, test
     assert order.status == OrderStatusType.NEW
     assert order.number == 1
     assert order.exchange_order_id == 10001
+    assert order.client_order_id == client_order_id(trading_service.bot.id, test_cycle.id, "BUY", 1, 0)
     assert order.cycle_id == test_cycle.id
 
+def test_client_order_ids_of_retried_and_replaced_orders(trading_service, mock_binance_client, test_cycle):
+    trading_service.cycle = test_cycle
+    new_order = mock_binance_client.new_order.side_effect
+    mock_binance_client.new_order.side_effect = [Exception("Timeout"), new_order(), new_order()]
+
+    with pytest.raises(Exception):
+        trading_service.create_binance_order(side="BUY", price=Decimal('24000'), quantity=Decimal('0.02'), number=1)
+    trading_service.create_binance_order(side="BUY", price=Decimal('24000'), quantity=Decimal('0.02'), number=1)
+    trading_service.create_binance_order(side="BUY", price=Decimal('23000'), quantity=Decimal('0.02'), number=1)
+
+    # The order that may not have been placed is sent again under the same id, the next one gets a new id
+    sent = [call.kwargs["newClientOrderId"] for call in mock_binance_client.new_order.call_args_list]
+    assert sent[0] == sent[1] == client_order_id(trading_service.bot.id, test_cycle.id, "BUY", 1, 0)
+    assert sent[2] == client_order_id(trading_service.bot.id, test_cycle.id, "BUY", 1, 1)
+    # A service started later on the same cycle carries on from the stored orders
+    restarted = TradingService(db=trading_service.db, bot=trading_service.bot)
+    restarted.cycle = test_cycle
+    assert restarted.next_client_order_id("BUY", 1) == client_order_id(trading_service.bot.id, test_cycle.id,
+                                                                       "BUY", 1, 2)
+
+def test_client_order_ids_of_renumbered_orders(trading_service, test_cycle, db_session):
+    trading_service.cycle = test_cycle
+    trading_service.create_binance_order(side="BUY", price=Decimal('24000'), quantity=Decimal('0.02'), number=2)
+    # A grid shift moved the order to the first level
+    order = test_cycle.orders.filter(Order.number == 2).one()
+    order.number = 1
+    db_session.commit()
+
+    restarted = TradingService(db=trading_service.db, bot=trading_service.bot)
+    restarted.cycle = test_cycle
+    assert restarted.next_client_order_id("BUY", 2) == client_order_id(trading_service.bot.id, test_cycle.id,
+                                                                       "BUY", 2, 1)
+    assert restarted.next_client_order_id("BUY", 1) == client_order_id(trading_service.bot.id, test_cycle.id,
+                                                                       "BUY", 1, 0)
+
+def test_find_order(trading_service, test_cycle, test_order):
+    trading_service.cycle = test_cycle
+    trading_service.create_binance_order(side="BUY", price=Decimal('24000'), quantity=Decimal('0.02'), number=2)
+    order = test_cycle.orders.filter(Order.number == 2).one()
+
+    with patch.object(trading_service.db, "query", side_effect=AssertionError("no query")):
+        assert trading_service.find_order(order.client_order_id, 0) is order
+    # Orders without a client order id are found by their exchange order id
+    assert trading_service.find_order("web_abc", int(test_order.exchange_order_id)) == test_order
+    assert trading_service.find_order("web_abc", 1) is None
+
 def test_create_binance_order_error(trading_service, mock_binance_client, test_cycle):
     trading_service.cycle = test_cycle
     # Setup mock to raise an exception
@@ -471,8 +551,7 @@ def test_create_binance_order_error(trading_service, mock_binance_client, test_c
     
     assert "Failed to create order" in str(exc_info.value)
 
-@patch.object(TradingService, 'cancel_cycle_orders')
-def test_check_grid_update(mock_cancel_orders, trading_service, mock_binance_client, test_cycle, db_session):
+def test_check_grid_update(trading_service, mock_binance_client, test_cycle, db_session):
     trading_service.cycle = test_cycle
 
     # Create test orders with NEW status
@@ -521,9 +600,12 @@ def test_check_grid_update(mock_cancel_orders, trading_service, mock_binance_cli
     # Verify cycle price was updated
     assert test_cycle.price == current_price
 
-    # Verify grid was updated
-    mock_cancel_orders.assert_called_once()
-    assert mock_binance_client.new_order.call_count == trading_service.bot.num_orders
+    # Verify grid was updated: both orders are moved up in place, the other levels are placed
+    assert mock_binance_client.cancel_and_replace.call_count == 2
+    assert mock_binance_client.new_order.call_count == trading_service.bot.num_orders - 2
+    mock_binance_client.cancel_order.assert_not_called()
+    assert {order.status for order in orders} == {OrderStatusType.CANCELED}
+    assert test_cycle.orders.filter(Order.status == OrderStatusType.NEW).count() == trading_service.bot.num_orders
 
 @patch.object(TradingService, 'cancel_cycle_orders')
 def test_check_grid_update_with_filled_order(mock_cancel_orders, trading_service, mock_binance_client, test_cycle, db_session):
@@ -635,10 +717,11 @@ def test_query_open_orders(trading_service, mock_binance_client, test_cycle, db_
     db_session.commit()
 
     # Mock Binance API responses
-    mock_binance_client.get_order.side_effect = [
-        {"orderId": 123, "status": "FILLED", "executedQty": "0.02"},
-        {"orderId": 124, "status": "PARTIALLY_FILLED", "executedQty": "0.01"}
-    ]
+    binance_orders = {
+        123: {"orderId": 123, "status": "FILLED", "executedQty": "0.02"},
+        124: {"orderId": 124, "status": "PARTIALLY_FILLED", "executedQty": "0.01"}
+    }
+    mock_binance_client.get_order.side_effect = lambda symbol, orderId: binance_orders[int(orderId)]
 
     # Call the method
     queried_orders = trading_service.query_open_orders()
@@ -754,3 +837,174 @@ def test_cycle_profit_no_orders(test_cycle, db_session):
     
     # Should return 0 as there are no orders
     assert test_cycle.profit() == 0
+
+def test_unit_of_work_with_session_factory(test_bot, test_cycle, mock_binance_client, db_session):
+    sessions = []
+    def session_factory():
+        session = sessionmaker(bind=db_session.bind, autoflush=False, expire_on_commit=False)()
+        sessions.append(session)
+        return session
+
+    service = TradingService(db=db_session, bot=test_bot, session_factory=session_factory)
+    service.client = mock_binance_client
+
+    with service.unit_of_work() as db:
+        assert db is sessions[0]
+        assert service.cycle in db
+        service.cycle.price = Decimal('101000')
+        db.commit()
+
+    # The session is released, the bot state stays readable while detached
+    assert service.db is None
+    assert not list(sessions[0])
+    assert service.cycle.price == Decimal('101000')
+
+    with service.unit_of_work() as db:
+        assert db is sessions[1]
+        assert service.bot in db
+        assert service.cycle.orders.count() == 0
+
+def test_state_changes_are_published(trading_service, mock_binance_client, test_cycle, test_bot):
+    trading_service.cycle = test_cycle
+    trading_service.events = Mock()
+
+    trading_service.create_binance_order(side="BUY", price=Decimal('24000'), quantity=Decimal('0.02'), number=1)
+
+    bot_id, event, data = trading_service.events.publish.call_args.args
+    assert (bot_id, event) == (test_bot.id, "order")
+    assert data["side"] == SideType.BUY
+    assert data["status"] == OrderStatusType.NEW
+    assert data["quantity_filled"] == Decimal('0')
+    assert data["cycle_id"] == str(test_cycle.id)
+
+def test_reload_bot(trading_service, db_session):
+    db_session.execute(update(Bot).where(Bot.id == trading_service.bot.id).values(status=BotStatusType.LAST_CYCLE),
+                       execution_options={"synchronize_session": False})
+
+    assert trading_service.reload_bot() == {"status"}
+    assert trading_service.bot.status == BotStatusType.LAST_CYCLE
+
+def test_reload_bot_with_new_credentials(trading_service, db_session, mock_binance_client):
+    db_session.execute(update(Bot).where(Bot.id == trading_service.bot.id).values(api_key="new_api_key"),
+                       execution_options={"synchronize_session": False})
+
+    assert trading_service.reload_bot() == {"api_key"}
+    assert trading_service.client is not mock_binance_client
+    assert trading_service.api_key == "new_api_key"
+
+def test_new_credentials_wait_for_the_running_cycle(trading_service, db_session, mock_binance_client, test_cycle):
+    trading_service.cycle = test_cycle
+    db_session.execute(update(Bot).where(Bot.id == trading_service.bot.id).values(api_key="new_api_key",
+                                                                                   is_active=False),
+                       execution_options={"synchronize_session": False})
+
+    # The orders of the running cycle are on the previous account
+    assert trading_service.reload_bot() == {"api_key", "is_active"}
+    assert trading_service.client is mock_binance_client
+    assert trading_service.api_key == "test_api_key"
+
+    test_cycle.quantity = Decimal('0.02')
+    trading_service.sell_quantity_filled = Mock(return_value=Decimal('0.02'))
+    new_client = Mock()
+    with patch.object(TradingService, "_new_client", return_value=new_client):
+        trading_service.check_cycle_completion()
+
+    assert test_cycle.status == CycleStatusType.COMPLETED
+    assert trading_service.client is new_client
+    assert trading_service.api_key == "new_api_key"
+
+def test_restore_from_snapshot(trading_service, mock_binance_client, test_cycle, test_order, tmp_path):
+    trading_service.cycle = test_cycle
+    snapshots = EngineSnapshots(str(tmp_path))
+    snapshots.write(trading_service.bot.id, trading_service.snapshot_state())
+    snapshot = snapshots.read(trading_service.bot.id)
+    open_order = {"symbol": "BTCUSDT", "orderId": 123, "side": "BUY", "status": "NEW", "executedQty": "0.00000000"}
+
+    # Nothing changed on the exchange: a single request and nothing to replay
+    mock_binance_client.get_open_orders.return_value = [open_order]
+    assert trading_service.restore(snapshot) == []
+    mock_binance_client.get_order.assert_not_called()
+
+    # The order was filled meanwhile
+    filled_order = {**open_order, "status": "FILLED", "executedQty": "0.02000000"}
+    mock_binance_client.get_open_orders.return_value = []
+    mock_binance_client.get_order.return_value = filled_order
+    assert trading_service.restore(snapshot) == [filled_order]
+
+def test_restore_from_outdated_snapshot(trading_service, mock_binance_client, test_cycle, test_order, db_session):
+    trading_service.cycle = test_cycle
+    snapshot = json.loads(json.dumps(trading_service.snapshot_state(), default=str))
+
+    test_order.quantity_filled = Decimal('0.01')
+    db_session.commit()
+    assert trading_service.restore(snapshot) is None
+
+    assert trading_service.restore({**snapshot, "cycle_id": str(uuid4())}) is None
+    mock_binance_client.get_open_orders.assert_not_called()
+
+def test_unfunded_grid_fails_before_any_order(trading_service, mock_binance_client, test_cycle):
+    trading_service.cycle = test_cycle
+    trading_service.balances = BalanceCache()
+    mock_binance_client.account.return_value = {
+        "updateTime": 1000,
+        "balances": [{"asset": "USDT", "free": "900.00000000", "locked": "0.00000000"}]
+    }
+    trading_service.balances.seed(trading_service.bot.api_key, mock_binance_client)
+
+    with pytest.raises(InsufficientBalanceError):
+        trading_service.place_grid_orders()
+    mock_binance_client.new_order.assert_not_called()
+
+    trading_service.balances.apply(trading_service.bot.api_key, AccountPosition(
+        event_time=2000, balances=[Balance(asset="USDT", free="1000.00000000", locked="0.00000000")]
+    ))
+    trading_service.place_grid_orders()
+    assert mock_binance_client.new_order.call_count == test_cycle.num_orders
+    assert trading_service.balances.reserved[trading_service.bot.api_key]["USDT"] == 0
+
+def test_grid_reservation_is_kept_between_orders(trading_service, mock_binance_client, test_cycle):
+    trading_service.cycle = test_cycle
+    trading_service.balances = BalanceCache()
+    mock_binance_client.account.return_value = {
+        "updateTime": 1000,
+        "balances": [{"asset": "USDT", "free": "1000.00000000", "locked": "0.00000000"}]
+    }
+    trading_service.balances.seed(trading_service.bot.api_key, mock_binance_client)
+
+    with trading_service.reserve("BUY", Decimal("1000")) as reservation:
+        trading_service.create_binance_order("BUY", Decimal("50000"), Decimal("0.002"), number=1,
+                                             reservation=reservation)
+        # The funds of the rest of the grid stay set aside
+        assert trading_service.balances.reserved[trading_service.bot.api_key]["USDT"] == Decimal("900")
+    assert trading_service.balances.reserved[trading_service.bot.api_key]["USDT"] == 0
+
+def test_second_buy_fill_replaces_the_funded_take_profit(trading_service, mock_binance_client, test_cycle,
+                                                          db_session):
+    trading_service.cycle = test_cycle
+    orders = [
+        Order(cycle_id=test_cycle.id, exchange=trading_service.bot.exchange, symbol=trading_service.bot.symbol,
+              side=side, price=price, quantity=Decimal('0.01'), quantity_filled=filled, status=status,
+              exchange_order_id=exchange_order_id, type=OrderType.LIMIT, time_in_force=TimeInForceType.GTC,
+              number=number, amount=price * Decimal('0.01'))
+        for side, price, filled, status, exchange_order_id, number in [
+            (SideType.BUY, Decimal('24000'), Decimal('0.01'), OrderStatusType.FILLED, 123, 1),
+            (SideType.SELL, Decimal('24240'), Decimal('0'), OrderStatusType.NEW, 124, 2),
+            (SideType.BUY, Decimal('23000'), Decimal('0.01'), OrderStatusType.FILLED, 125, 2),
+        ]
+    ]
+    db_session.add_all(orders)
+    db_session.commit()
+    # The bought BTC: the first half locked by the take profit order, the second half just received
+    trading_service.balances = BalanceCache()
+    mock_binance_client.account.return_value = {
+        "updateTime": 1000,
+        "balances": [{"asset": "BTC", "free": "0.01000000", "locked": "0.01000000"}]
+    }
+    trading_service.balances.seed(trading_service.api_key, mock_binance_client)
+    mock_binance_client.cancel_order.return_value = {"status": "CANCELED", "executedQty": "0", "transactTime": 2000}
+
+    trading_service.update_take_profit_order()
+
+    assert orders[1].status == OrderStatusType.CANCELED
+    assert mock_binance_client.new_order.call_args.kwargs["side"] == "SELL"
+    assert Decimal(mock_binance_client.new_order.call_args.kwargs["quantity"]) == Decimal('0.02')